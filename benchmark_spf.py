@@ -0,0 +1,189 @@
+"""
+Benchmark do motor de SPF (dycastra) sobre LSDBs sintéticos.
+
+Gera topologias aleatórias (anel + cordas) com 100, 1.000 e 10.000 roteadores,
+cada um anunciando a própria sub-rede /24, e mede o tempo de montagem do grafo
+e do cálculo de rotas. Para os tamanhos menores também executa a implementação
+anterior (lista ordenada a cada iteração) e confere se as tabelas são iguais.
+
+Em seguida mede o SPF incremental: para cada tamanho, aplica mudanças de custo e
+quedas de enlace isoladas e compara o tempo com o de uma execução completa,
+conferindo que as tabelas continuam idênticas (com --caminhos > 1, as rotas ECMP).
+
+Uso:
+    python benchmark_spf.py [--tamanhos 100 1000 10000] [--limite-legado 1000] [--caminhos 4]
+"""
+import argparse
+import copy
+import random
+import time
+
+from dycastra import GrafoSPF, SPFIncremental, calcular_rotas
+
+
+def ip_roteador(i: int) -> str:
+    return f"10.{i // 256}.{i % 256}.1"
+
+
+def subnet_roteador(i: int) -> str:
+    return f"10.{i // 256}.{i % 256}.0/24"
+
+
+def gerar_lsdb(num_roteadores: int, cordas_por_roteador: int = 1, semente: int = 42) -> dict:
+    """Gera um LSDB formatado ({id: lsa.to_dict()}) com pesos simétricos entre 1 e 10."""
+    rng = random.Random(semente)
+    enlaces = {}
+    for i in range(num_roteadores):
+        vizinhos = [(i + 1) % num_roteadores]
+        vizinhos += [rng.randrange(num_roteadores) for _ in range(cordas_por_roteador)]
+        for j in vizinhos:
+            if j != i:
+                enlaces[(min(i, j), max(i, j))] = rng.randint(1, 10)
+
+    lsdb = {
+        ip_roteador(i): {"id": ip_roteador(i), "seq": 1, "vizinhos": {}, "subnets": [subnet_roteador(i)]}
+        for i in range(num_roteadores)
+    }
+    for (i, j), peso in enlaces.items():
+        lsdb[ip_roteador(i)]["vizinhos"][f"router{j}"] = [ip_roteador(j), peso]
+        lsdb[ip_roteador(j)]["vizinhos"][f"router{i}"] = [ip_roteador(i), peso]
+    return lsdb
+
+
+def dijkstra_legado(origem, lsdb):
+    """Cópia da implementação anterior (sem os logs de depuração), para comparação."""
+    grafo = {}
+    for router_id, lsa in lsdb.items():
+        if router_id not in grafo:
+            grafo[router_id] = {}
+        for subnet in lsa.get("subnets", []):
+            if subnet == "127.0.0.0/8":
+                continue
+            grafo[router_id][subnet] = 0
+            if subnet not in grafo:
+                grafo[subnet] = {}
+            grafo[subnet][router_id] = 0
+        for viz_name, (ip_viz, custo) in lsa["vizinhos"].items():
+            if ip_viz in lsdb:
+                grafo[router_id][ip_viz] = custo
+                if ip_viz not in grafo:
+                    grafo[ip_viz] = {}
+                grafo[ip_viz][router_id] = custo
+
+    dist = {node: float("inf") for node in grafo}
+    prev = {node: None for node in grafo}
+    dist[origem] = 0
+    visitados = set()
+    pq = [(0, origem)]
+    while pq:
+        pq.sort()
+        d, u = pq.pop(0)
+        if u in visitados or d > dist[u]:
+            continue
+        visitados.add(u)
+        for v, custo in grafo.get(u, {}).items():
+            if v in dist and dist[u] + custo < dist[v]:
+                dist[v] = dist[u] + custo
+                prev[v] = u
+                pq.append((dist[v], v))
+
+    tabela = {}
+    for destino in grafo:
+        if destino == origem or prev[destino] is None or "/" not in destino:
+            continue
+        atual = destino
+        while prev[atual] is not None and prev[atual] != origem:
+            atual = prev[atual]
+        if prev[atual] == origem and "/" not in atual:
+            tabela[destino] = atual
+    return tabela
+
+
+def cronometrar(funcao, repeticoes: int):
+    melhor = float("inf")
+    retorno = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        retorno = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, retorno
+
+
+def medir_incremental(lsdb: dict, mudancas: int, semente: int = 7, caminhos: int = 1):
+    """Aplica mudanças isoladas (custo ou queda de enlace) e mede iSPF x SPF completo."""
+    rng = random.Random(semente)
+    origem = ip_roteador(0)
+    spf = SPFIncremental(origem, maximo_caminhos=caminhos)
+    spf.calcular(lsdb, set(lsdb))
+
+    t_incremental = t_completo = 0.0
+    medidas = 0
+    for _ in range(mudancas):
+        # Só roteadores que ainda têm enlaces: as quedas anteriores podem ter isolado alguns
+        candidatos = [id for id, lsa in lsdb.items() if lsa["vizinhos"]]
+        if not candidatos:
+            break
+        router_id = rng.choice(candidatos)
+        lsa = copy.deepcopy(lsdb[router_id])
+        nome, (ip_viz, peso) = rng.choice(list(lsa["vizinhos"].items()))
+        if rng.random() < 0.5:
+            del lsa["vizinhos"][nome]
+            # Enlace caiu: o vizinho também deixa de anunciá-lo
+            viz = copy.deepcopy(lsdb[ip_viz])
+            viz["vizinhos"] = {n: v for n, v in viz["vizinhos"].items() if v[0] != router_id}
+            lsdb[ip_viz] = viz
+            alterados = {router_id, ip_viz}
+        else:
+            lsa["vizinhos"][nome] = [ip_viz, rng.randint(1, 10)]
+            alterados = {router_id}
+        lsdb[router_id] = lsa
+
+        inicio = time.perf_counter()
+        tabela = spf.calcular(lsdb, alterados)
+        t_incremental += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        tabela_completa = calcular_rotas(origem, GrafoSPF.do_lsdb(lsdb), caminhos)
+        t_completo += time.perf_counter() - inicio
+        if tabela != tabela_completa:
+            raise SystemExit("SPF incremental divergiu do completo!")
+        medidas += 1
+    return t_incremental / max(medidas, 1), t_completo / max(medidas, 1), spf.execucoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--limite-legado", type=int, default=1000,
+                        help="maior LSDB em que a implementação anterior também é medida")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--mudancas", type=int, default=50, help="mudanças isoladas medidas no SPF incremental")
+    parser.add_argument("--caminhos", type=int, default=1, help="máximo de caminhos ECMP por rota no SPF incremental")
+    args = parser.parse_args()
+
+    print(f"{'roteadores':>10} {'grafo (ms)':>11} {'spf (ms)':>9} {'legado (ms)':>12} {'ganho':>7} {'rotas':>6}")
+    for tamanho in args.tamanhos:
+        lsdb = gerar_lsdb(tamanho)
+        origem = ip_roteador(0)
+
+        t_grafo, grafo = cronometrar(lambda: GrafoSPF.do_lsdb(lsdb), args.repeticoes)
+        t_spf, tabela = cronometrar(lambda: calcular_rotas(origem, grafo), args.repeticoes)
+
+        legado, ganho = "-", "-"
+        if tamanho <= args.limite_legado:
+            t_legado, tabela_legado = cronometrar(lambda: dijkstra_legado(origem, lsdb), 1)
+            if {destino: (salto,) for destino, salto in tabela_legado.items()} != tabela:
+                raise SystemExit(f"Tabelas divergentes para {tamanho} roteadores!")
+            legado = f"{t_legado * 1000:.1f}"
+            ganho = f"{t_legado / (t_grafo + t_spf):.1f}x"
+
+        print(f"{tamanho:>10} {t_grafo * 1000:>11.1f} {t_spf * 1000:>9.1f} {legado:>12} {ganho:>7} {len(tabela):>6}")
+
+    print(f"\n{'roteadores':>10} {'ispf (ms)':>10} {'completo (ms)':>14} {'ganho':>7}  execuções")
+    for tamanho in args.tamanhos:
+        t_inc, t_comp, execucoes = medir_incremental(gerar_lsdb(tamanho), args.mudancas, caminhos=args.caminhos)
+        print(f"{tamanho:>10} {t_inc * 1000:>10.2f} {t_comp * 1000:>14.1f} {t_comp / t_inc:>6.1f}x  {execucoes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,695 @@
-import json
+import heapq
 import pprint
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
 
-def dijkstra(origem, lsdb):
+# Sub-rede de loopback nunca entra no grafo
+SUBREDE_LOOPBACK = "127.0.0.0/8"
+
+# Próximos saltos de uma rota, em ordem: um só, ou vários de mesmo custo (ECMP)
+ProximosSaltos = Tuple[str, ...]
+
+
+# O LSDB do SPF pode ter LSAs no formato de LSA.to_dict (JSON, benchmark, processo do SPF)
+# ou os LSAs compactos do roteador, lidos direto das colunas, sem conversão
+def enlaces_lsa(lsa) -> Iterable[Tuple[str, float]]:
+    """Pares (IP do vizinho, custo) declarados no LSA."""
+    if isinstance(lsa, dict):
+        return lsa["vizinhos"].values()
+    return zip(lsa.ips, lsa.custos)
+
+
+def subredes_lsa(lsa) -> Iterable[str]:
+    if isinstance(lsa, dict):
+        return lsa.get("subnets", ())
+    return lsa.subnets
+
+
+class GrafoSPF:
+    """
+    Grafo compacto usado pelo SPF.
+
+    Os nós (IPs de roteadores e sub-redes) são internados em inteiros densos.
+    Os índices são atribuídos na ordem lexicográfica dos nomes, de modo que o
+    desempate da heap por (distância, índice) é o mesmo da implementação
+    original, que ordenava tuplas (distância, nome).
+
+    A adjacência fica em formato CSR: os vizinhos do nó i estão em
+    destinos[inicio[i]:inicio[i + 1]], com os custos nas mesmas posições de custos.
+    """
+
+    __slots__ = ("nos", "indice", "eh_subrede", "inicio", "destinos", "custos")
+
+    def __init__(self, arestas: Dict[tuple, float], nos: set):
+        self.nos: List[str] = sorted(nos)
+        self.indice: Dict[str, int] = {no: i for i, no in enumerate(self.nos)}
+        self.eh_subrede = bytearray(1 if "/" in no else 0 for no in self.nos)
+
+        adjacencia: List[list] = [[] for _ in self.nos]
+        for (a, b), custo in arestas.items():
+            ia, ib = self.indice[a], self.indice[b]
+            adjacencia[ia].append((ib, custo))
+            if ia != ib:
+                adjacencia[ib].append((ia, custo))
+
+        self.inicio = array("l", [0])
+        self.destinos = array("l")
+        self.custos = array("d")
+        for lista in adjacencia:
+            for v, custo in lista:
+                self.destinos.append(v)
+                self.custos.append(custo)
+            self.inicio.append(len(self.destinos))
+
+    @classmethod
+    def do_lsdb(cls, lsdb: Dict[str, Dict]) -> "GrafoSPF":
+        """
+        Monta o grafo a partir do LSDB ({id: LSA}, compacto ou no formato de lsa.to_dict()).
+
+        Cada enlace é não direcionado e só entra no grafo se os dois roteadores o
+        declaram (verificação bidirecional): o LSA antigo de um vizinho que caiu não
+        mantém o enlace com quem já o retirou. Se os dois LSAs declaram custos
+        diferentes, vale o custo do LSA que aparece por último no LSDB.
+        """
+        nos = set()
+        arestas: Dict[tuple, float] = {}
+        declarantes: Dict[tuple, set] = {}
+        for router_id, lsa in lsdb.items():
+            nos.add(router_id)
+            for subnet in subredes_lsa(lsa):
+                if subnet == SUBREDE_LOOPBACK:
+                    continue
+                nos.add(subnet)
+                arestas[(router_id, subnet) if router_id < subnet else (subnet, router_id)] = 0
+            for ip_viz, custo in enlaces_lsa(lsa):
+                if ip_viz in lsdb:
+                    chave = (router_id, ip_viz) if router_id < ip_viz else (ip_viz, router_id)
+                    arestas[chave] = custo
+                    declarantes.setdefault(chave, set()).add(router_id)
+        for chave, roteadores in declarantes.items():
+            if len(roteadores) < 2:
+                del arestas[chave]
+        return cls(arestas, nos)
+
+    def como_dict(self) -> Dict[str, Dict[str, float]]:
+        """Representação dicionário de dicionários, usada apenas para depuração."""
+        return {
+            no: {self.nos[self.destinos[k]]: self.custos[k] for k in range(self.inicio[i], self.inicio[i + 1])}
+            for i, no in enumerate(self.nos)
+        }
+
+
+class ResultadoSPF:
+    """Distâncias, predecessores e primeiro salto de cada nó (por índice)."""
+
+    __slots__ = ("origem", "dist", "anterior", "primeiro_salto")
+
+    def __init__(self, origem: int, dist: List[float], anterior: array, primeiro_salto: array):
+        self.origem = origem
+        self.dist = dist
+        self.anterior = anterior
+        self.primeiro_salto = primeiro_salto
+
+
+def calcular_spf(grafo: GrafoSPF, origem: int) -> ResultadoSPF:
+    """
+    Dijkstra com heap binária sobre o grafo compacto.
+
+    O primeiro salto é propagado durante o relaxamento: um vizinho direto da
+    origem é o seu próprio primeiro salto e os demais herdam o do predecessor.
+    Assim a tabela de rotas sai de uma única passada, sem backtracking.
+    """
+    n = len(grafo.nos)
+    inicio, destinos, custos = grafo.inicio, grafo.destinos, grafo.custos
+    dist = [float("inf")] * n
+    anterior = array("l", [-1]) * n
+    primeiro_salto = array("l", [-1]) * n
+    visitados = bytearray(n)
+
+    dist[origem] = 0
+    pq = [(0, origem)]
+    while pq:
+        d, u = heapq.heappop(pq)
+        if visitados[u]:
+            continue
+        visitados[u] = 1
+
+        salto_u = primeiro_salto[u]
+        for k in range(inicio[u], inicio[u + 1]):
+            v = destinos[k]
+            nova_dist = d + custos[k]
+            if nova_dist < dist[v]:
+                dist[v] = nova_dist
+                anterior[v] = u
+                primeiro_salto[v] = v if u == origem else salto_u
+                heapq.heappush(pq, (nova_dist, v))
+
+    return ResultadoSPF(origem, dist, anterior, primeiro_salto)
+
+
+def saltos_ecmp(grafo: GrafoSPF, resultado: ResultadoSPF) -> List[frozenset]:
+    """
+    Conjunto de todos os primeiros saltos de caminhos de custo mínimo até cada nó.
+
+    Percorre os nós em ordem de distância juntando os conjuntos dos predecessores
+    "apertados" (dist[u] + custo == dist[v]). Nós de mesma distância ligados por
+    enlaces de custo 0 (sub-redes compartilhadas) são refeitos até estabilizar.
+    """
+    inicio, destinos, custos = grafo.inicio, grafo.destinos, grafo.custos
+    dist, origem = resultado.dist, resultado.origem
+    inf = float("inf")
+    saltos = [frozenset()] * len(grafo.nos)
+    ordem = sorted((v for v in range(len(grafo.nos)) if dist[v] < inf and v != origem), key=dist.__getitem__)
+
+    def refazer(v: int) -> bool:
+        novos = set()
+        for k in range(inicio[v], inicio[v + 1]):
+            u = destinos[k]
+            if u != v and dist[u] + custos[k] == dist[v]:
+                if u == origem:
+                    novos.add(v)
+                else:
+                    novos |= saltos[u]
+        if novos == saltos[v]:
+            return False
+        saltos[v] = frozenset(novos)
+        return True
+
+    i = 0
+    while i < len(ordem):
+        j = i
+        while j < len(ordem) and dist[ordem[j]] == dist[ordem[i]]:
+            j += 1
+        grupo = ordem[i:j]
+        mudou = True
+        while mudou:
+            mudou = False
+            for v in grupo:
+                mudou = refazer(v) or mudou
+            mudou = mudou and len(grupo) > 1
+        i = j
+    return saltos
+
+
+def nomes_saltos(grafo: GrafoSPF, saltos, maximo_caminhos: int) -> ProximosSaltos:
+    """Nomes dos saltos que são roteadores (sub-redes são diretamente conectadas), no máximo maximo_caminhos."""
+    nos, eh_subrede = grafo.nos, grafo.eh_subrede
+    return tuple(sorted(nos[s] for s in saltos if not eh_subrede[s])[:maximo_caminhos])
+
+
+def tabela_rotas(grafo: GrafoSPF, resultado: ResultadoSPF, saltos: Optional[List[frozenset]] = None,
+                 maximo_caminhos: int = 1) -> Dict[str, ProximosSaltos]:
+    """
+    Monta {sub-rede: próximos saltos} considerando apenas saltos que são roteadores.
+    Sem saltos (ECMP), cada sub-rede tem o único primeiro salto da árvore do SPF.
+    """
+    nos, eh_subrede = grafo.nos, grafo.eh_subrede
+    anterior, primeiro_salto = resultado.anterior, resultado.primeiro_salto
+    tabela = {}
+    for destino, nome in enumerate(nos):
+        # Considera apenas sub-redes alcançáveis como destinos finais
+        if not eh_subrede[destino] or destino == resultado.origem or anterior[destino] < 0:
+            continue
+        if saltos is not None and maximo_caminhos > 1:
+            proximos = nomes_saltos(grafo, saltos[destino], maximo_caminhos)
+            if proximos:
+                tabela[nome] = proximos
+            continue
+        salto = primeiro_salto[destino]
+        # Sub-rede ligada diretamente à origem: o "salto" seria a própria sub-rede
+        if not eh_subrede[salto]:
+            tabela[nome] = (nos[salto],)
+    return tabela
+
+
+def calcular_rotas(origem: str, grafo: GrafoSPF, maximo_caminhos: int = 1) -> Dict[str, ProximosSaltos]:
+    """Executa o SPF a partir do IP de origem e devolve {sub-rede: próximos saltos}."""
+    indice_origem: Optional[int] = grafo.indice.get(origem)
+    if indice_origem is None:
+        return {}
+    resultado = calcular_spf(grafo, indice_origem)
+    saltos = saltos_ecmp(grafo, resultado) if maximo_caminhos > 1 else None
+    return tabela_rotas(grafo, resultado, saltos, maximo_caminhos)
+
+
+class SPFIncremental:
+    """
+    SPF incremental (iSPF) que mantém a árvore e o vetor de distâncias entre execuções.
+
+    A cada chamada de calcular() recebe o LSDB formatado e os IDs dos LSAs que
+    mudaram desde a chamada anterior. Só os enlaces alterados são comparados;
+    a subárvore pendurada em um enlace da árvore que piorou (ou sumiu) é
+    recalculada, e melhorias são propagadas a partir do enlace que melhorou.
+
+    O resultado é idêntico ao de uma execução completa: com custos positivos
+    entre roteadores e sub-redes anunciadas por um único roteador, o predecessor
+    escolhido pelo Dijkstra completo é sempre o vizinho "apertado" de menor
+    (distância, índice), e é exatamente essa regra que a fase incremental aplica.
+    Fora dessas condições, ou quando a mudança afeta mais que limite_afetados
+    dos roteadores, cai para a execução completa.
+
+    Quando só as sub-redes de um LSA mudam (vizinhos idênticos), a árvore entre
+    roteadores não muda: as rotas dos prefixos afetados são refeitas a partir da
+    distância e do primeiro salto já conhecidos do roteador que os anuncia, sem
+    SPF (cálculo parcial de rotas, modo "parcial").
+
+    Com maximo_caminhos > 1, cada rota leva todos os primeiros saltos de caminhos
+    de mesmo custo mínimo (ECMP), até esse limite. Os conjuntos de primeiros saltos
+    dos roteadores são mantidos junto com a árvore: na fase incremental só são
+    refeitos os dos nós cuja distância ou enlaces mudaram, descendo pelos enlaces
+    "apertados" enquanto o conjunto mudar.
+
+    Com alternativos=True, cada cálculo também escolhe um próximo salto alternativo
+    livre de laço (LFA, RFC 5286) para cada sub-rede: um vizinho N fora dos próximos
+    saltos primários tal que dist(N, D) < dist(N, origem) + dist(origem, D), ou seja,
+    N não devolve o tráfego para a origem. Entre os candidatos, preferem-se os que
+    também protegem contra a queda dos nós primários E (dist(N, D) < dist(N, E) + dist(E, D))
+    e depois o de menor custo total. As distâncias a partir de cada vizinho vêm de um
+    Dijkstra por vizinho, refeito só quando a árvore pode ter mudado (no modo parcial
+    as distâncias anteriores continuam valendo). `protecao` agrupa as sub-redes por
+    próximo salto primário, pronto para a troca quando ele cair.
+    """
+
+    def __init__(self, origem: str, limite_afetados: float = 0.25, alternativos: bool = False, maximo_caminhos: int = 1):
+        self.origem = origem
+        self.limite_afetados = limite_afetados
+        self.calcular_alternativos = alternativos
+        self.maximo_caminhos = maximo_caminhos
+        self.grafo: Optional[GrafoSPF] = None
+        self.indice_origem: Optional[int] = None
+        self.ordem: List[str] = []           # Ordem dos LSAs no LSDB (decide o custo de enlaces assimétricos)
+        self.posicao: List[int] = []
+        self.declarados: List[Dict[int, float]] = []  # Vizinhos declarados no LSA de cada roteador
+        self.prefixos: List[frozenset] = []           # Sub-redes anunciadas por cada roteador
+        self.anunciantes: Dict[str, set] = {}         # Sub-rede -> roteadores que a anunciam
+        self.adj: List[Dict[int, float]] = []         # Enlaces efetivos entre roteadores
+        self.dist: List[float] = []
+        self.anterior: array = array("l")
+        self.primeiro_salto: array = array("l")
+        self.saltos: List[frozenset] = []             # Primeiros saltos ECMP de cada nó (maximo_caminhos > 1)
+        self.filhos: List[set] = []
+        self.exato = False
+        self.tabela: Dict[str, ProximosSaltos] = {}
+        self.prefixos_alterados: set = set()  # Sub-redes cuja rota mudou na última chamada
+        self.ultimo_modo: Optional[str] = None
+        self.execucoes = {"completo": 0, "incremental": 0, "parcial": 0}
+        self.dist_vizinhos: Dict[int, List[float]] = {} # Distâncias a partir de cada vizinho da origem
+        self.alternativos: Dict[str, str] = {}          # Sub-rede -> próximo salto alternativo (LFA)
+        self.protecao: Dict[str, List[str]] = {}        # Próximo salto primário -> sub-redes que passam por ele
+
+    def calcular(self, lsdb: Dict[str, Dict], alterados) -> Dict[str, ProximosSaltos]:
+        """Atualiza o SPF com os LSAs alterados e devolve {sub-rede: próximos saltos}."""
+        if not self._incremental(lsdb, alterados):
+            tabela_anterior = self.tabela
+            self._completo(lsdb)
+            self.prefixos_alterados = {
+                subnet for subnet in tabela_anterior.keys() | self.tabela.keys()
+                if tabela_anterior.get(subnet) != self.tabela.get(subnet)
+            }
+        self.execucoes[self.ultimo_modo] += 1
+        if self.calcular_alternativos:
+            self._calcular_alternativos(recalcular_distancias=self.ultimo_modo != "parcial")
+        return self.tabela
+
+    def caminho(self, router_id: str) -> Optional[Tuple[float, ProximosSaltos]]:
+        """Distância e próximos saltos até um roteador na última árvore calculada (None se inalcançável)."""
+        r = self.grafo.indice.get(router_id) if self.grafo is not None else None
+        if r is None or self.indice_origem is None or self.dist[r] == float("inf"):
+            return None
+        if r == self.indice_origem:
+            return 0.0, ()
+        if self.maximo_caminhos > 1:
+            return self.dist[r], nomes_saltos(self.grafo, self.saltos[r], self.maximo_caminhos)
+        salto = self.primeiro_salto[r]
+        return self.dist[r], (() if self.grafo.eh_subrede[salto] else (self.grafo.nos[salto],))
+
+    def _declarados_lsa(self, lsa: Dict, lsdb: Dict[str, Dict]) -> Dict[int, float]:
+        indice = self.grafo.indice
+        return {indice[ip_viz]: custo for ip_viz, custo in enlaces_lsa(lsa) if ip_viz in lsdb}
+
+    @staticmethod
+    def _prefixos_lsa(lsa: Dict) -> frozenset:
+        return frozenset(s for s in subredes_lsa(lsa) if s != SUBREDE_LOOPBACK)
+
+    def _custo_efetivo(self, a: int, b: int) -> Optional[float]:
+        """Custo do enlace a-b (None se um dos lados não o declara): vale o LSA que aparece por último no LSDB."""
+        custo_a = self.declarados[a].get(b)
+        custo_b = self.declarados[b].get(a)
+        if custo_a is None or custo_b is None:
+            return None
+        return custo_a if self.posicao[a] > self.posicao[b] else custo_b
+
+    def _completo(self, lsdb: Dict[str, Dict]):
+        self.ultimo_modo = "completo"
+        grafo = self.grafo = GrafoSPF.do_lsdb(lsdb)
+        n = len(grafo.nos)
+        self.ordem = list(lsdb)
+        self.posicao = [-1] * n
+        self.declarados = [{} for _ in range(n)]
+        self.prefixos = [frozenset()] * n
+        self.anunciantes = {}
+        for pos, router_id in enumerate(self.ordem):
+            i = grafo.indice[router_id]
+            self.posicao[i] = pos
+            self.declarados[i] = self._declarados_lsa(lsdb[router_id], lsdb)
+            self.prefixos[i] = self._prefixos_lsa(lsdb[router_id])
+            for subnet in self.prefixos[i]:
+                self.anunciantes.setdefault(subnet, set()).add(i)
+
+        self.adj = [{} for _ in range(n)]
+        custos_positivos = True
+        for a in range(n):
+            if grafo.eh_subrede[a]:
+                continue
+            for k in range(grafo.inicio[a], grafo.inicio[a + 1]):
+                b = grafo.destinos[k]
+                if b != a and not grafo.eh_subrede[b]:
+                    self.adj[a][b] = grafo.custos[k]
+                    custos_positivos = custos_positivos and grafo.custos[k] > 0
+
+        self.indice_origem = grafo.indice.get(self.origem)
+        if self.indice_origem is None:
+            self.exato = False
+            self.tabela = {}
+            return
+
+        resultado = calcular_spf(grafo, self.indice_origem)
+        self.dist = resultado.dist
+        self.anterior = resultado.anterior
+        self.primeiro_salto = resultado.primeiro_salto
+        self.filhos = [set() for _ in range(n)]
+        for v in range(n):
+            if not grafo.eh_subrede[v] and self.anterior[v] >= 0:
+                self.filhos[self.anterior[v]].add(v)
+        self.exato = custos_positivos and all(len(r) == 1 for r in self.anunciantes.values())
+        self.saltos = saltos_ecmp(grafo, resultado) if self.maximo_caminhos > 1 else []
+        self.tabela = tabela_rotas(grafo, resultado, self.saltos, self.maximo_caminhos)
+
+    def _incremental(self, lsdb: Dict[str, Dict], alterados) -> bool:
+        """Aplica as mudanças de forma incremental. Retorna False se for preciso rodar o SPF completo."""
+        if self.indice_origem is None or list(lsdb) != self.ordem:
+            return False
+
+        indice = self.grafo.indice
+        pares = set()
+        prefixos_mudados = set()
+        for router_id in alterados:
+            x = indice[router_id]
+            lsa = lsdb[router_id]
+            antigos = self.declarados[x]
+            self.declarados[x] = self._declarados_lsa(lsa, lsdb)
+            pares.update((min(x, y), max(x, y)) for y in antigos.keys() | self.declarados[x].keys() if y != x)
+
+            # Só sub-redes folha (um único anunciante) podem mudar sem mexer na árvore
+            prefixos = self._prefixos_lsa(lsa)
+            for subnet in self.prefixos[x] - prefixos:
+                if len(self.anunciantes[subnet]) > 1:
+                    return False  # Sub-rede compartilhada era nó de trânsito
+                del self.anunciantes[subnet]
+            for subnet in prefixos - self.prefixos[x]:
+                roteadores = self.anunciantes.setdefault(subnet, set())
+                roteadores.add(x)
+                if len(roteadores) > 1:
+                    return False  # Sub-rede compartilhada vira nó de trânsito
+            prefixos_mudados |= self.prefixos[x] ^ prefixos
+            self.prefixos[x] = prefixos
+
+        alteradas = []
+        for a, b in pares:
+            novo = self._custo_efetivo(a, b)
+            antigo = self.adj[a].get(b)
+            if novo == antigo:
+                continue
+            if novo is not None and novo <= 0:
+                return False
+            alteradas.append((a, b, antigo, novo))
+
+        if alteradas:
+            if not self.exato:
+                return False
+            saltos_alterados = self._atualizar_arvore(alteradas)
+            if saltos_alterados is None:
+                return False
+            for r in saltos_alterados:
+                prefixos_mudados |= self.prefixos[r]
+            self.ultimo_modo = "incremental"
+        else:
+            self.ultimo_modo = "parcial"
+
+        self.prefixos_alterados = set()
+        for subnet in prefixos_mudados:
+            self._atualizar_rota(subnet)
+        return True
+
+    def _subarvore(self, raiz: int, destino: set):
+        pilha = [raiz]
+        while pilha:
+            v = pilha.pop()
+            if v not in destino:
+                destino.add(v)
+                pilha.extend(self.filhos[v])
+
+    def _atualizar_arvore(self, alteradas: list) -> Optional[set]:
+        """Atualiza distâncias e árvore. Retorna os roteadores cujo primeiro salto mudou (None = usar SPF completo)."""
+        inf = float("inf")
+        adj, dist, anterior, primeiro_salto, filhos = self.adj, self.dist, self.anterior, self.primeiro_salto, self.filhos
+        origem = self.indice_origem
+
+        # 1. Subárvores penduradas em enlaces da árvore que pioraram ou sumiram
+        afetados = set()
+        for a, b, antigo, novo in alteradas:
+            if antigo is not None and (novo is None or novo > antigo):
+                if anterior[b] == a:
+                    self._subarvore(b, afetados)
+                elif anterior[a] == b:
+                    self._subarvore(a, afetados)
+        num_roteadores = len(self.ordem)
+        if len(afetados) > self.limite_afetados * num_roteadores:
+            return None
+
+        for a, b, antigo, novo in alteradas:
+            if novo is None:
+                del adj[a][b], adj[b][a]
+            else:
+                adj[a][b] = adj[b][a] = novo
+
+        # 2. Distâncias: Dijkstra semeado pela fronteira da região afetada e pelos enlaces que melhoraram
+        for v in afetados:
+            dist[v] = inf
+        pq = []
+        for v in afetados:
+            melhor = min((dist[u] + custo for u, custo in adj[v].items() if u not in afetados), default=inf)
+            if melhor < inf:
+                pq.append((melhor, v))
+        for a, b, antigo, novo in alteradas:
+            if novo is not None:
+                for u, v in ((a, b), (b, a)):
+                    if dist[u] + novo < dist[v]:
+                        pq.append((dist[u] + novo, v))
+        heapq.heapify(pq)
+
+        mudaram = set(afetados)
+        while pq:
+            d, v = heapq.heappop(pq)
+            if d >= dist[v]:
+                continue
+            dist[v] = d
+            mudaram.add(v)
+            for w, custo in adj[v].items():
+                if d + custo < dist[w]:
+                    heapq.heappush(pq, (d + custo, w))
+
+        # 3. Predecessores e primeiro salto, em ordem de distância, descendo pela árvore quando algo muda
+        reavaliar = set(mudaram)
+        for v in mudaram:
+            reavaliar.update(adj[v])
+        for a, b, _, _ in alteradas:
+            reavaliar.update((a, b))
+        reavaliar.discard(origem)
+        candidatos_ecmp = set(reavaliar)
+        pq = [(dist[v], v) for v in reavaliar]
+        heapq.heapify(pq)
+        saltos_alterados = set()
+        while pq:
+            dv, v = heapq.heappop(pq)
+            novo_anterior = -1
+            if dv < inf:
+                novo_anterior = min((u for u, custo in adj[v].items() if dist[u] + custo == dv),
+                                    key=lambda u: (dist[u], u))
+            novo_salto = -1 if novo_anterior < 0 else (v if novo_anterior == origem else primeiro_salto[novo_anterior])
+
+            if novo_anterior == anterior[v] and novo_salto == primeiro_salto[v]:
+                continue
+            if novo_anterior != anterior[v]:
+                if anterior[v] >= 0:
+                    filhos[anterior[v]].discard(v)
+                if novo_anterior >= 0:
+                    filhos[novo_anterior].add(v)
+                anterior[v] = novo_anterior
+            if novo_salto != primeiro_salto[v]:
+                primeiro_salto[v] = novo_salto
+                saltos_alterados.add(v)
+            for f in filhos[v]:
+                if f not in reavaliar:
+                    reavaliar.add(f)
+                    heapq.heappush(pq, (dist[f], f))
+        if self.maximo_caminhos > 1:
+            saltos_alterados |= self._atualizar_saltos(candidatos_ecmp)
+        return saltos_alterados
+
+    def _atualizar_saltos(self, candidatos: set) -> set:
+        """Refaz os conjuntos ECMP dos candidatos em ordem de distância, descendo pelos enlaces apertados."""
+        adj, dist, saltos, origem = self.adj, self.dist, self.saltos, self.indice_origem
+        inf = float("inf")
+        pq = [(dist[v], v) for v in candidatos]
+        heapq.heapify(pq)
+        vistos = set(candidatos)
+        alterados = set()
+        while pq:
+            dv, v = heapq.heappop(pq)
+            novos = set()
+            if dv < inf:
+                for u, custo in adj[v].items():
+                    if dist[u] + custo == dv:
+                        if u == origem:
+                            novos.add(v)
+                        else:
+                            novos |= saltos[u]
+            if novos == saltos[v]:
+                continue
+            saltos[v] = frozenset(novos)
+            alterados.add(v)
+            if dv < inf:
+                for w, custo in adj[v].items():
+                    if w not in vistos and dv + custo == dist[w]:
+                        vistos.add(w)
+                        heapq.heappush(pq, (dist[w], w))
+        return alterados
+
+    def _distancias(self, raiz: int) -> List[float]:
+        """Dijkstra entre roteadores a partir de raiz; sub-redes compartilhadas ligam seus anunciantes com custo 0."""
+        dist = [float("inf")] * len(self.dist)
+        dist[raiz] = 0
+        pq = [(0, raiz)]
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]:
+                continue
+            vizinhos = list(self.adj[u].items())
+            for subnet in self.prefixos[u]:
+                roteadores = self.anunciantes[subnet]
+                if len(roteadores) > 1:
+                    vizinhos.extend((r, 0) for r in roteadores)
+            for v, custo in vizinhos:
+                if d + custo < dist[v]:
+                    dist[v] = d + custo
+                    heapq.heappush(pq, (d + custo, v))
+        return dist
+
+    def _calcular_alternativos(self, recalcular_distancias: bool):
+        origem = self.indice_origem
+        alternativos: Dict[str, str] = {}
+        protecao: Dict[str, List[str]] = {}
+        if origem is None:
+            self.dist_vizinhos, self.alternativos, self.protecao = {}, alternativos, protecao
+            return
+        if recalcular_distancias:
+            self.dist_vizinhos = {n: self._distancias(n) for n in self.adj[origem]}
+        indice, inf = self.grafo.indice, float("inf")
+
+        for subnet, primarios in self.tabela.items():
+            roteadores = self.anunciantes.get(subnet, ())
+            indices_primarios = [indice[p] for p in primarios]
+            dist_origem = min(self.dist[r] for r in roteadores)
+            distancias_primarios = []
+            for e in indices_primarios:
+                dist_e = self.dist_vizinhos.get(e)
+                if dist_e is not None:
+                    distancias_primarios.append((e, min(dist_e[r] for r in roteadores)))
+            melhor = None
+            for n, dist_n in self.dist_vizinhos.items():
+                if n in indices_primarios:
+                    continue
+                dist_n_destino = min(dist_n[r] for r in roteadores)
+                if not dist_n_destino < dist_n[origem] + dist_origem:
+                    continue # N pode devolver o tráfego para a origem
+                protege_no = len(distancias_primarios) == len(indices_primarios) and all(
+                    dist_n_destino < dist_n[e] + dist_e_destino for e, dist_e_destino in distancias_primarios)
+                candidato = (not protege_no, self.adj[origem][n] + dist_n_destino, n)
+                if candidato[1] < inf and (melhor is None or candidato < melhor):
+                    melhor = candidato
+            if melhor is not None:
+                alternativos[subnet] = self.grafo.nos[melhor[2]]
+            for primario in primarios:
+                protecao.setdefault(primario, []).append(subnet)
+        # Troca as tabelas de uma vez: o roteador as lê de outra thread quando uma adjacência cai
+        self.alternativos, self.protecao = alternativos, protecao
+
+    def _atualizar_rota(self, subnet: str):
+        """Refaz a rota de uma sub-rede folha a partir do roteador que a anuncia."""
+        proximos: ProximosSaltos = ()
+        roteadores = self.anunciantes.get(subnet)
+        if roteadores:
+            (r,) = roteadores
+            if r != self.indice_origem and self.dist[r] < float("inf"):
+                if self.maximo_caminhos > 1:
+                    proximos = nomes_saltos(self.grafo, self.saltos[r], self.maximo_caminhos)
+                elif not self.grafo.eh_subrede[self.primeiro_salto[r]]:
+                    proximos = (self.grafo.nos[self.primeiro_salto[r]],)
+
+        anterior = self.tabela.get(subnet)
+        if proximos:
+            self.tabela[subnet] = proximos
+        else:
+            self.tabela.pop(subnet, None)
+        if self.tabela.get(subnet) != anterior:
+            self.prefixos_alterados.add(subnet)
+
+
+def dijkstra(origem, lsdb, depurar=False):
     """
     Implementação do algoritmo de Dijkstra para calcular caminhos mais curtos.
     
     Args:
         origem: IP do roteador de origem
         lsdb: Banco de dados de estado de enlace (Link State Database)
+        depurar: Imprime o grafo e as tabelas de distâncias e predecessores
         
     Returns:
-        Dicionário com mapeamento de sub-redes de destino para próximo salto
+        Dicionário com mapeamento de sub-redes de destino para a tupla de próximos saltos
     """
-    print(f"\n--- Calculando rotas para {origem} ---") # Log de início
-    # 1. Monta o grafo, incluindo roteadores e sub-redes
-    grafo = {}
-
-    for router_id, lsa in lsdb.items():
-        if router_id not in grafo:
-            grafo[router_id] = {}
-
-        # Adiciona sub-redes diretamente conectadas (IGNORANDO LOOPBACK)
-        if "subnets" in lsa:
-            for subnet in lsa["subnets"]:
-                # Pula a rede de loopback
-                if subnet == "127.0.0.0/8":
-                    continue 
-                # Adiciona conexões de custo 0 para sub-redes válidas
-                grafo[router_id][subnet] = 0
-                if subnet not in grafo:
-                    grafo[subnet] = {}
-                grafo[subnet][router_id] = 0
-
-        # Adiciona vizinhos roteadores (CORRIGIDO)
-        # (O código para adicionar vizinhos que corrigimos antes permanece o mesmo)
-        for viz_name, (ip_viz, custo) in lsa["vizinhos"].items():
-            if ip_viz in lsdb: 
-                grafo[router_id][ip_viz] = custo
-                if ip_viz not in grafo:
-                     grafo[ip_viz] = {}
-                grafo[ip_viz][router_id] = custo
-
-    # (O restante da função dijkstra permanece o mesmo)
-    # ...
-
-
+    if depurar:
+        print(f"\n--- Calculando rotas para {origem} ---") # Log de início
+    # 1. Monta o grafo compacto, incluindo roteadores e sub-redes
+    grafo = GrafoSPF.do_lsdb(lsdb)
 
     # --- LOG DE DEPURAÇÃO: Imprime o grafo construído ---
-    print("\n--- Grafo Construído ---")
-    pprint.pprint(grafo)
-    print("--- Fim do Grafo ---\n")
+    if depurar:
+        print("\n--- Grafo Construído ---")
+        pprint.pprint(grafo.como_dict())
+        print("--- Fim do Grafo ---\n")
     # ---------------------------------------------------
 
-    # 2. Inicializa Dijkstra
-    dist = {node: float("inf") for node in grafo}
-    prev = {node: None for node in grafo}
-    dist[origem] = 0
-    visitados = set()
-    pq = [(0, origem)] # Usando uma lista como min-priority queue (simplificado)
-
-    while pq:
-        # Extrai o nó com menor distância (simulação de min-heap)
-        pq.sort()
-        d, u = pq.pop(0)
+    indice_origem = grafo.indice.get(origem)
+    if indice_origem is None:
+        return {}
 
-        if u in visitados:
-            continue
-        if d > dist[u]: # Otimização: ignora entradas obsoletas na "fila"
-            continue
-            
-        visitados.add(u)
-        
-        # Atualizar distâncias dos vizinhos
-        if u in grafo: # Verifica se u existe no grafo antes de iterar
-            for v, custo in grafo[u].items():
-                if v in dist and dist[u] + custo < dist[v]: # Verifica se v existe em dist
-                    dist[v] = dist[u] + custo
-                    prev[v] = u
-                    pq.append((dist[v], v))
+    # 2. Executa o SPF (heap binária + primeiro salto propagado)
+    resultado = calcular_spf(grafo, indice_origem)
 
     # --- LOG DE DEPURAÇÃO: Imprime dist e prev ---
-    print("\n--- Tabela de Distâncias (dist) ---")
-    pprint.pprint(dist)
-    print("--- Fim da Tabela de Distâncias ---\n")
-    print("\n--- Tabela de Predecessores (prev) ---")
-    pprint.pprint(prev)
-    print("--- Fim da Tabela de Predecessores ---\n")
+    if depurar:
+        print("\n--- Tabela de Distâncias (dist) ---")
+        pprint.pprint({no: resultado.dist[i] for i, no in enumerate(grafo.nos)})
+        print("--- Fim da Tabela de Distâncias ---\n")
+        print("\n--- Tabela de Predecessores (prev) ---")
+        anterior = resultado.anterior
+        pprint.pprint({no: grafo.nos[anterior[i]] if anterior[i] >= 0 else None for i, no in enumerate(grafo.nos)})
+        print("--- Fim da Tabela de Predecessores ---\n")
     # ---------------------------------------------
 
-        # 3. Monta tabela de rotas, incluindo apenas sub-redes (BACKTRACKING CORRIGIDO)
-    tabela = {}
-    for destino in grafo:
-        # Ignora o próprio roteador de origem e destinos inalcançáveis
-        if destino == origem or prev[destino] is None:
-            continue
-
-        # Considera apenas sub-redes como destinos finais
-        if "/" in destino:
-            # Backtrack para encontrar o próximo salto (next hop router IP)
-            current_node = destino
-            next_hop_ip = None
-
-            # Volta no caminho até encontrar o nó cujo predecessor é a origem
-            while prev[current_node] is not None and prev[current_node] != origem:
-                current_node = prev[current_node]
-            
-            # Após o loop, 'current_node' é o nó que está diretamente conectado à origem
-            # Este 'current_node' É o próximo salto que queremos
-            if prev[current_node] == origem:
-                next_hop_ip = current_node # Este deve ser o IP do roteador vizinho
-                
-                # Garante que o próximo salto seja um IP de roteador (não uma sub-rede)
-                if "/" not in next_hop_ip:
-                    tabela[destino] = next_hop_ip
-                # else: # Opcional: Log se o próximo salto identificado não for um IP
-                #    print(f"[AVISO] Próximo salto para {destino} a partir de {origem} é {next_hop_ip}, que não é um IP. Rota descartada.")
-            # else: # Opcional: Log se o backtracking falhar
-            #    print(f"[ERRO] Backtracking falhou para {destino} a partir de {origem}. Nó final: {current_node}, Prev: {prev[current_node]}")
-
-    return tabela
-
+    # 3. Monta tabela de rotas, incluindo apenas sub-redes
+    return tabela_rotas(grafo, resultado)
 
 
 if __name__ == "__main__":
@@ -172,4 +742,4 @@ if __name__ == "__main__":
         }
     }
 
-    print(dijkstra("172.20.1.3", lsdb))
\ No newline at end of file
+    print(dijkstra("172.20.1.3", lsdb, depurar=True))
\ No newline at end of file
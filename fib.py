@@ -0,0 +1,484 @@
+"""
+Programação da tabela de rotas do kernel (FIB) pelo roteador.
+
+Todas as adições, remoções e substituições de um recálculo de rotas são
+aplicadas de uma vez por um backend:
+
+    BackendNetlink  fala rtnetlink direto num socket AF_NETLINK: as mensagens
+                    vão em lotes e cada rota recebe seu próprio ack, sem criar
+                    nenhum processo.
+    BackendMemoria  guarda as rotas num dicionário, com a mesma semântica de
+                    erros do kernel, para testar sem NET_ADMIN.
+
+As operações são tuplas (acao, destino, proximos_saltos), com acao em "add",
+"del" e "replace" e proximos_saltos uma tupla de IPs: com mais de um, a rota é
+multipath (ECMP, `nexthop via ... nexthop via ...`). aplicar() devolve, na mesma ordem, None para cada operação
+bem-sucedida ou a mensagem de erro dela. Como antes, remover uma rota que já
+não existe conta como sucesso.
+
+As rotas instaladas pelo roteador levam o protocolo RTPROT_ROTEADOR (188, que o
+`ip route` mostra como "proto ospf"), e só elas são consideradas dele. FIBSombra
+mantém uma cópia em memória dessas rotas: é preenchida uma vez com um dump do
+kernel, atualizada a cada lote aplicado e corrigida pelas notificações de rota
+do kernel (RTNLGRP_IPV4_ROUTE) lidas por MonitorRotas. Assim o diff de cada
+recálculo não consulta o kernel, e mudanças feitas por terceiros chegam como
+eventos.
+
+FIBSombra.transacao() aplica as mudanças de um recálculo em make-before-break:
+primeiro as rotas novas e alteradas (replace é atômico no kernel, o prefixo
+nunca fica sem rota), só depois as remoções. Operações que falham são
+repetidas e, numa transação atômica, uma falha restaura as rotas anteriores.
+"""
+import errno
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+ProximosSaltos = Tuple[str, ...]
+Operacao = Tuple[str, str, Optional[ProximosSaltos]]
+
+# Constantes de linux/netlink.h e linux/rtnetlink.h
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40 # Máscara do grupo RTNLGRP_IPV4_ROUTE (7)
+RTA_DST = 1
+RTA_GATEWAY = 5
+RTA_MULTIPATH = 9
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RTPROT_ROTEADOR = 188 # Marca as rotas instaladas pelo roteador ("proto ospf" no `ip route`)
+RT_SCOPE_UNIVERSE = 0
+RTN_UNICAST = 1
+
+NLMSGHDR = struct.Struct("=IHHII")
+NLMSGERR = struct.Struct("=i")
+RTMSG = struct.Struct("=BBBBBBBBI")
+RTATTR = struct.Struct("=HH")
+RTNEXTHOP = struct.Struct("=HBBi") # Cada caminho dentro de RTA_MULTIPATH, seguido dos atributos dele
+
+# Erros do kernel ao remover uma rota que já não existe (tratados como sucesso)
+ERROS_ROTA_INEXISTENTE = (errno.ESRCH, errno.ENETUNREACH, errno.ENODEV)
+
+FLAGS_ACAO = {
+    "add": (RTM_NEWROUTE, NLM_F_CREATE | NLM_F_EXCL),
+    "replace": (RTM_NEWROUTE, NLM_F_CREATE | NLM_F_REPLACE),
+    "del": (RTM_DELROUTE, 0),
+}
+
+
+def formatar_saltos(saltos: Optional[ProximosSaltos]) -> str:
+    return ", ".join(saltos) if saltos else "-"
+
+
+def _alinhar(tamanho: int) -> int:
+    return (tamanho + 3) & ~3
+
+
+def _atributo(tipo: int, valor: bytes) -> bytes:
+    tamanho = RTATTR.size + len(valor)
+    return RTATTR.pack(tamanho, tipo) + valor + b"\0" * (_alinhar(tamanho) - tamanho)
+
+
+def _multipath(saltos: ProximosSaltos) -> bytes:
+    caminhos = []
+    for salto in saltos:
+        gateway = _atributo(RTA_GATEWAY, socket.inet_aton(salto))
+        caminhos.append(RTNEXTHOP.pack(RTNEXTHOP.size + len(gateway), 0, 0, 0) + gateway)
+    return _atributo(RTA_MULTIPATH, b"".join(caminhos))
+
+
+def _gateways_multipath(valor: bytes) -> List[str]:
+    gateways = []
+    inicio = 0
+    while inicio + RTNEXTHOP.size <= len(valor):
+        tamanho = RTNEXTHOP.unpack_from(valor, inicio)[0]
+        if tamanho < RTNEXTHOP.size:
+            break
+        gateway = _atributos(valor, inicio + RTNEXTHOP.size, inicio + tamanho).get(RTA_GATEWAY)
+        if gateway is not None:
+            gateways.append(socket.inet_ntoa(gateway))
+        inicio += _alinhar(tamanho)
+    return gateways
+
+
+def _interpretar_rota(data: bytes, inicio: int, fim: int) -> Optional[Tuple[str, ProximosSaltos, int]]:
+    """
+    (destino, proximos_saltos, protocolo) de uma mensagem de rota, ou None se ela não for
+    uma rota via gateway da tabela principal (default e link local também ficam de fora).
+    Os próximos saltos de uma rota multipath vêm ordenados.
+    """
+    _, dst_len, _, _, tabela, protocolo, _, tipo_rota, _ = RTMSG.unpack_from(data, inicio)
+    atributos = _atributos(data, inicio + RTMSG.size, fim)
+    if RTA_TABLE in atributos:
+        tabela = struct.unpack("=I", atributos[RTA_TABLE])[0]
+    if RTA_GATEWAY in atributos:
+        saltos: ProximosSaltos = (socket.inet_ntoa(atributos[RTA_GATEWAY]),)
+    elif RTA_MULTIPATH in atributos:
+        saltos = tuple(sorted(_gateways_multipath(atributos[RTA_MULTIPATH])))
+    else:
+        saltos = ()
+    if tabela != RT_TABLE_MAIN or tipo_rota != RTN_UNICAST or dst_len == 0 or not saltos:
+        return None
+    destino = f"{socket.inet_ntoa(atributos.get(RTA_DST, bytes(4)))}/{dst_len}"
+    if destino.startswith("169.254"):
+        return None
+    return destino, saltos, protocolo
+
+
+def _atributos(data: bytes, inicio: int, fim: int) -> Dict[int, bytes]:
+    atributos = {}
+    while inicio + RTATTR.size <= fim:
+        tamanho, tipo = RTATTR.unpack_from(data, inicio)
+        if tamanho < RTATTR.size:
+            break
+        atributos[tipo] = data[inicio + RTATTR.size:inicio + tamanho]
+        inicio += _alinhar(tamanho)
+    return atributos
+
+
+def _receber(sock: socket.socket, buffer: bytearray):
+    """Lê um datagrama netlink e devolve as mensagens contidas nele: (tipo, seq, data, inicio, fim)."""
+    tamanho = sock.recv_into(buffer)
+    data = bytes(buffer[:tamanho])
+    inicio = 0
+    while inicio + NLMSGHDR.size <= tamanho:
+        comprimento, tipo, _, seq, _ = NLMSGHDR.unpack_from(data, inicio)
+        if comprimento < NLMSGHDR.size:
+            break
+        yield tipo, seq, data, inicio + NLMSGHDR.size, inicio + comprimento
+        inicio += _alinhar(comprimento)
+
+
+class BackendFIB:
+    def aplicar(self, operacoes: List[Operacao]) -> List[Optional[str]]:
+        raise NotImplementedError
+
+    def listar(self) -> Dict[str, ProximosSaltos]:
+        """Rotas instaladas pelo roteador: {destino: proximos_saltos}."""
+        raise NotImplementedError
+
+
+class BackendMemoria(BackendFIB):
+    def __init__(self, rotas: Optional[Dict[str, ProximosSaltos]] = None):
+        self.rotas: Dict[str, ProximosSaltos] = dict(rotas or {})
+        self.lotes = 0
+
+    def aplicar(self, operacoes: List[Operacao]) -> List[Optional[str]]:
+        self.lotes += 1
+        resultados = []
+        for acao, destino, proximos_saltos in operacoes:
+            if acao == "del":
+                self.rotas.pop(destino, None)
+                resultados.append(None)
+            elif acao == "add" and destino in self.rotas:
+                resultados.append(os.strerror(errno.EEXIST))
+            elif acao in ("add", "replace"):
+                self.rotas[destino] = proximos_saltos
+                resultados.append(None)
+            else:
+                resultados.append(f"Ação desconhecida: {acao}")
+        return resultados
+
+    def listar(self) -> Dict[str, ProximosSaltos]:
+        return dict(self.rotas)
+
+
+class BackendNetlink(BackendFIB):
+    """Rotas IPv4 na tabela principal via rtnetlink (precisa de NET_ADMIN para alterar)."""
+
+    LOTE_BYTES = 32 * 1024 # Mensagens enviadas antes de ler os acks, para não estourar o buffer de recepção
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        self.socket.bind((0, 0))
+        self.seq = 0
+        self.buffer = bytearray(256 * 1024)
+
+    def _mensagem(self, tipo: int, flags: int, corpo: bytes) -> Tuple[int, bytes]:
+        self.seq += 1
+        return self.seq, NLMSGHDR.pack(NLMSGHDR.size + len(corpo), tipo, flags | NLM_F_REQUEST, self.seq, 0) + corpo
+
+    def _montar(self, acao: str, destino: str, proximos_saltos: Optional[ProximosSaltos]) -> Tuple[int, bytes]:
+        tipo, flags = FLAGS_ACAO[acao]
+        rede = ipaddress.IPv4Network(destino)
+        if acao == "del":
+            # Tipo zerado casa qualquer rota do nosso protocolo; o escopo universe é o das rotas via gateway
+            # (RT_SCOPE_NOWHERE, usado pelo `ip route del`, não é aceito como curinga por todo kernel)
+            rtmsg = RTMSG.pack(socket.AF_INET, rede.prefixlen, 0, 0, RT_TABLE_MAIN, RTPROT_ROTEADOR, RT_SCOPE_UNIVERSE, 0, 0)
+        else:
+            rtmsg = RTMSG.pack(socket.AF_INET, rede.prefixlen, 0, 0, RT_TABLE_MAIN, RTPROT_ROTEADOR, RT_SCOPE_UNIVERSE, RTN_UNICAST, 0)
+        corpo = rtmsg + _atributo(RTA_DST, rede.network_address.packed)
+        if proximos_saltos and acao != "del":
+            if len(proximos_saltos) == 1:
+                corpo += _atributo(RTA_GATEWAY, socket.inet_aton(proximos_saltos[0]))
+            else:
+                corpo += _multipath(proximos_saltos)
+        return self._mensagem(tipo, flags | NLM_F_ACK, corpo)
+
+    def _receber(self):
+        return _receber(self.socket, self.buffer)
+
+    def aplicar(self, operacoes: List[Operacao]) -> List[Optional[str]]:
+        resultados: List[Optional[str]] = [None] * len(operacoes)
+        pendentes: Dict[int, int] = {} # seq -> índice da operação
+        lote: List[bytes] = []
+        tamanho_lote = 0
+
+        def enviar_lote():
+            if not lote:
+                return
+            self.socket.send(b"".join(lote))
+            lote.clear()
+            while pendentes:
+                for tipo, seq, data, inicio, _ in self._receber():
+                    if tipo != NLMSG_ERROR or seq not in pendentes:
+                        continue
+                    indice = pendentes.pop(seq)
+                    codigo = -NLMSGERR.unpack_from(data, inicio)[0]
+                    acao = operacoes[indice][0]
+                    if codigo and not (acao == "del" and codigo in ERROS_ROTA_INEXISTENTE):
+                        resultados[indice] = os.strerror(codigo)
+
+        for indice, (acao, destino, proximos_saltos) in enumerate(operacoes):
+            try:
+                seq, mensagem = self._montar(acao, destino, proximos_saltos)
+            except (KeyError, ValueError, OSError) as e:
+                resultados[indice] = f"Operação inválida ({acao} {destino} via {formatar_saltos(proximos_saltos)}): {e}"
+                continue
+            pendentes[seq] = indice
+            lote.append(mensagem)
+            tamanho_lote += len(mensagem)
+            if tamanho_lote >= self.LOTE_BYTES:
+                enviar_lote()
+                tamanho_lote = 0
+        enviar_lote()
+        return resultados
+
+    def listar(self) -> Dict[str, ProximosSaltos]:
+        seq, mensagem = self._mensagem(RTM_GETROUTE, NLM_F_DUMP, RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0))
+        self.socket.send(mensagem)
+        rotas = {}
+        while True:
+            for tipo, seq_msg, data, inicio, fim in self._receber():
+                if seq_msg != seq:
+                    continue
+                if tipo == NLMSG_DONE:
+                    return rotas
+                if tipo == NLMSG_ERROR:
+                    codigo = -NLMSGERR.unpack_from(data, inicio)[0]
+                    raise OSError(codigo, os.strerror(codigo))
+                rota = _interpretar_rota(data, inicio, fim) if tipo == RTM_NEWROUTE else None
+                if rota is not None and rota[2] == RTPROT_ROTEADOR:
+                    rotas[rota[0]] = rota[1]
+
+
+class MonitorRotas:
+    """
+    Assina as notificações do kernel de rotas IPv4 (RTNLGRP_IPV4_ROUTE) e de mudanças
+    em interfaces e seus endereços IPv4 (RTNLGRP_LINK e RTNLGRP_IPV4_IFADDR). Ler as
+    notificações não exige NET_ADMIN.
+    """
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        self.socket.bind((0, RTMGRP_IPV4_ROUTE | RTMGRP_IPV4_IFADDR | RTMGRP_LINK))
+        self.buffer = bytearray(256 * 1024)
+
+    def loop(self, ao_evento: Optional[Callable[[int, str, ProximosSaltos, int], None]], ao_perder_eventos: Callable[[], None],
+             ao_mudar_interface: Optional[Callable[[], None]] = None):
+        """
+        Chama ao_evento(tipo, destino, proximos_saltos, protocolo) para cada rota via gateway
+        criada (RTM_NEWROUTE) ou removida (RTM_DELROUTE), e ao_mudar_interface() uma vez por
+        datagrama que traga mudanças de interface ou endereço. Se o buffer do socket estourar
+        (ENOBUFS), notificações se perderam e ao_perder_eventos é chamado para ressincronizar.
+        """
+        while True:
+            try:
+                interface_mudou = False
+                for tipo, _, data, inicio, fim in _receber(self.socket, self.buffer):
+                    if tipo in (RTM_NEWROUTE, RTM_DELROUTE):
+                        rota = _interpretar_rota(data, inicio, fim) if ao_evento is not None else None
+                        if rota is not None:
+                            ao_evento(tipo, *rota)
+                    elif tipo in (RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR):
+                        interface_mudou = True
+                if interface_mudou and ao_mudar_interface is not None:
+                    ao_mudar_interface()
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                ao_perder_eventos()
+
+
+class Transacao:
+    """Resultado de FIBSombra.transacao()."""
+
+    __slots__ = ("resultados", "anteriores", "instaladas_em", "tentativas", "revertida", "duracao")
+
+    def __init__(self, operacoes: List[Operacao]):
+        self.resultados: List[Optional[str]] = [None] * len(operacoes) # Na ordem das operações, como aplicar()
+        self.anteriores: Dict[str, Optional[ProximosSaltos]] = {} # Próximos saltos de cada destino antes da transação
+        self.instaladas_em: Dict[str, float] = {} # time.monotonic() do ack de cada rota nova ou alterada
+        self.tentativas = 0 # Lotes repetidos por causa de falhas
+        self.revertida = False
+        self.duracao = 0.0
+
+
+class FIBSombra(BackendFIB):
+    """
+    Cópia em memória das rotas do roteador, na frente de um backend.
+
+    aplicar() segura o lock enquanto o lote vai ao kernel, então as notificações do
+    próprio lote só são vistas depois que a sombra já foi atualizada e chegam como
+    eco (sem mudança). Adições são enviadas como replace: se outro protocolo já tem
+    uma rota para o prefixo, o roteador assume o prefixo, como o diff antigo fazia.
+    """
+
+    def __init__(self, backend: BackendFIB):
+        self.backend = backend
+        self.rotas: Dict[str, ProximosSaltos] = {}
+        self.lock = threading.Lock()
+        self.contadores = {"lotes": 0, "transacoes": 0, "revertidas": 0, "eventos": 0, "externos": 0, "ressincronizacoes": 0}
+
+    def semear(self) -> Dict[str, ProximosSaltos]:
+        """Preenche a sombra com as rotas do roteador que já estão no kernel."""
+        with self.lock:
+            self.rotas = self.backend.listar()
+            return dict(self.rotas)
+
+    def listar(self) -> Dict[str, ProximosSaltos]:
+        with self.lock:
+            return dict(self.rotas)
+
+    def aplicar(self, operacoes: List[Operacao]) -> List[Optional[str]]:
+        with self.lock:
+            return self._aplicar(operacoes)
+
+    def _aplicar(self, operacoes: List[Operacao]) -> List[Optional[str]]:
+        enviadas = [("replace" if acao == "add" else acao, destino, proximos_saltos) for acao, destino, proximos_saltos in operacoes]
+        self.contadores["lotes"] += 1
+        resultados = self.backend.aplicar(enviadas)
+        for (acao, destino, proximos_saltos), erro in zip(enviadas, resultados):
+            if erro is None:
+                if acao == "del":
+                    self.rotas.pop(destino, None)
+                else:
+                    self.rotas[destino] = tuple(sorted(proximos_saltos)) # Na ordem das notificações do kernel
+        return resultados
+
+    def _aplicar_com_repeticao(self, operacoes: List[Operacao], indices: List[int], transacao: Transacao, repeticoes: int):
+        """Aplica operacoes[i] para i em indices, repetindo as que falharem; grava os erros restantes na transação."""
+        while indices:
+            resultados = self._aplicar([operacoes[i] for i in indices])
+            agora = time.monotonic()
+            falhas = []
+            for indice, erro in zip(indices, resultados):
+                transacao.resultados[indice] = erro
+                if erro is not None:
+                    falhas.append(indice)
+                elif operacoes[indice][0] != "del":
+                    transacao.instaladas_em[operacoes[indice][1]] = agora
+            if not falhas or repeticoes <= 0:
+                return
+            repeticoes -= 1
+            transacao.tentativas += 1
+            indices = falhas
+
+    def transacao(self, operacoes: List[Operacao], repeticoes: int = 1, atomica: bool = False) -> Transacao:
+        """
+        Aplica as mudanças de um recálculo em make-before-break. As adições e substituições
+        vão primeiro, na ordem recebida (o chamador põe as mais urgentes na frente), e só
+        depois que o kernel confirmou todas vão as remoções. Cada fase repete até
+        `repeticoes` vezes as operações que falharam. Se `atomica` e alguma adição ou
+        substituição continuar falhando, as que deram certo voltam ao próximo salto anterior
+        e nenhuma remoção é feita: a FIB fica como estava antes da transação.
+        """
+        transacao = Transacao(operacoes)
+        inicio = time.monotonic()
+        with self.lock:
+            self.contadores["transacoes"] += 1
+            transacao.anteriores = {destino: self.rotas.get(destino) for _, destino, _ in operacoes}
+            instalar = [i for i, (acao, _, _) in enumerate(operacoes) if acao != "del"]
+            remover = [i for i, (acao, _, _) in enumerate(operacoes) if acao == "del"]
+
+            self._aplicar_com_repeticao(operacoes, instalar, transacao, repeticoes)
+            if atomica and any(transacao.resultados[i] is not None for i in instalar):
+                self._reverter(operacoes, instalar, transacao)
+                for i in remover:
+                    transacao.resultados[i] = "não aplicada: transação revertida"
+            else:
+                self._aplicar_com_repeticao(operacoes, remover, transacao, repeticoes)
+        transacao.duracao = time.monotonic() - inicio
+        return transacao
+
+    def _reverter(self, operacoes: List[Operacao], instalar: List[int], transacao: Transacao):
+        aplicadas = [i for i in instalar if transacao.resultados[i] is None]
+        desfazer = []
+        for i in aplicadas:
+            destino = operacoes[i][1]
+            anterior = transacao.anteriores[destino]
+            desfazer.append(("replace", destino, anterior) if anterior is not None else ("del", destino, None))
+        resultados = self._aplicar(desfazer) if desfazer else []
+        for i, erro in zip(aplicadas, resultados):
+            transacao.resultados[i] = "revertida: outra rota da transação falhou" if erro is None else f"falha ao reverter: {erro}"
+            transacao.instaladas_em.pop(operacoes[i][1], None)
+        transacao.revertida = True
+        self.contadores["revertidas"] += 1
+
+    def evento(self, tipo: int, destino: str, proximos_saltos: ProximosSaltos, protocolo: int) -> Optional[str]:
+        """
+        Aplica uma notificação do kernel à sombra. Retorna a descrição da mudança se ela não
+        veio do próprio roteador (None para o eco dos lotes aplicados por aqui).
+        """
+        with self.lock:
+            self.contadores["eventos"] += 1
+            if protocolo != RTPROT_ROTEADOR:
+                descricao = f"rota de outro protocolo ({protocolo}) {'criada' if tipo == RTM_NEWROUTE else 'removida'}: {destino} via {formatar_saltos(proximos_saltos)}"
+            elif tipo == RTM_NEWROUTE:
+                if self.rotas.get(destino) == proximos_saltos:
+                    return None
+                descricao = f"rota do roteador alterada externamente: {destino} via {formatar_saltos(proximos_saltos)} (era {formatar_saltos(self.rotas.get(destino))})"
+                self.rotas[destino] = proximos_saltos
+            else:
+                if self.rotas.get(destino) != proximos_saltos:
+                    return None
+                descricao = f"rota do roteador removida externamente: {destino} via {formatar_saltos(proximos_saltos)}"
+                del self.rotas[destino]
+            self.contadores["externos"] += 1
+            return descricao
+
+    def ressincronizar(self):
+        self.semear()
+        with self.lock:
+            self.contadores["ressincronizacoes"] += 1
+
+    def estado(self) -> Dict:
+        with self.lock:
+            return {"rotas": len(self.rotas), **self.contadores}
+
+
+def criar_backend(nome: str) -> BackendFIB:
+    if nome == "memoria":
+        return BackendMemoria()
+    return BackendNetlink()
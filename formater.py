@@ -36,3 +36,31 @@ class Formatter:
             vizinhos_dict[nome] = (ip, custo)
 
         return vizinhos_dict
+
+    @staticmethod
+    def formatar_areas(vizinhos_str: str, area_padrao: str) -> dict[str, str]:
+        """
+        Extrai a área do enlace com cada vizinho.
+
+        Recebe: "[router1, 172.20.1.2, 1],[router3, 172.20.3.2, 1, 1]" e "0"
+        retorna: {
+            "router1": "0",
+            "router3": "1"
+        }
+
+        Args:
+            vizinhos_str: String de vizinhos, com a área como quarto campo opcional
+            area_padrao: Área dos enlaces sem o quarto campo
+
+        Returns:
+            Dicionário com a área de cada vizinho
+        """
+        areas = {}
+        if not vizinhos_str:
+            return areas
+
+        for vizinho in vizinhos_str.strip("[]").split("],["):
+            partes = vizinho.split(",")
+            areas[partes[0].strip()] = partes[3].strip() if len(partes) > 3 else area_padrao
+
+        return areas
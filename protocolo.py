@@ -0,0 +1,279 @@
+"""
+Codificação dos LSAs trocados entre os roteadores.
+
+Formato binário (versão 1), todos os campos em ordem de rede:
+
+    cabeçalho (12 bytes)
+        magic    B   0xA7 (um LSA em JSON sempre começa com '{')
+        versao   B
+        tipo     B   1 = LSA
+        reservado B
+        id       4s  IPv4 do roteador de origem
+        seq      I
+    corpo
+        num_vizinhos H, num_subnets H
+        vizinhos     num_vizinhos x (ip 4s, custo I)
+        subnets      num_subnets x (rede 4s, prefixo B)
+        idade        H   segundos (opcional: LSAs sem o campo têm idade 0)
+        num_resumos  H   (opcional, só depois da idade)
+        resumos      num_resumos x (rede 4s, prefixo B, custo I)
+
+O par (id, seq) fica em posição fixa, então LSAs antigos ou repetidos podem ser
+descartados lendo só o cabeçalho. Os nomes dos vizinhos não vão no formato
+binário: ao decodificar, o IP do vizinho é usado como nome. A idade fica no fim
+para decodificadores que não a conhecem simplesmente a ignorarem, e pode ser
+trocada a cada salto (definir_idade) sem recodificar o LSA. Os resumos são os
+prefixos de outras áreas anunciados por roteadores de borda de área, com o
+custo até eles; LSAs sem resumos terminam na idade.
+
+O JSON continua disponível como fallback: cada roteador anuncia nos Hellos os
+formatos que entende e só recebe LSAs binários quem anunciou suporte a eles.
+
+LSAs codificados (em qualquer formato) maiores que o tamanho máximo de datagrama
+são divididos em fragmentos (tipo 2), com o mesmo cabeçalho seguido de
+indice H e total H. Como (id, seq) continua na mesma posição, fragmentos de
+LSAs já conhecidos também são descartados pelo cabeçalho. Remontagem junta os
+fragmentos de volta no LSA original.
+"""
+import json
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+FORMATO_BINARIO = "binario"
+FORMATO_JSON = "json"
+
+MAGIC = 0xA7
+VERSAO = 1
+TIPO_LSA = 1
+TIPO_FRAGMENTO = 2
+
+TAMANHO_MAXIMO_UDP = 65535 # Buffer de recepção que nunca trunca um datagrama
+MAXIMO_FRAGMENTOS = 1024
+
+CABECALHO = struct.Struct("!BBBB4sI")
+FRAGMENTO = struct.Struct("!BBBB4sIHH")
+CONTAGENS = struct.Struct("!HH")
+VIZINHO = struct.Struct("!4sI")
+SUBNET = struct.Struct("!4sB")
+IDADE = struct.Struct("!H")
+NUM_RESUMOS = struct.Struct("!H")
+RESUMO = struct.Struct("!4sBI")
+IDADE_MAXIMA_CODIFICAVEL = 0xFFFF
+
+# Endereços já convertidos para texto: a rede tem poucos IPs distintos e eles se
+# repetem em todo LSA, então reaproveitar a string evita um inet_ntoa por vizinho
+_ENDERECOS: Dict[bytes, str] = {}
+_ENDERECOS_LIMITE = 65536
+
+
+def _endereco(ip_bytes: bytes) -> str:
+    ip = _ENDERECOS.get(ip_bytes)
+    if ip is None:
+        if len(_ENDERECOS) >= _ENDERECOS_LIMITE:
+            _ENDERECOS.clear()
+        ip = _ENDERECOS[ip_bytes] = socket.inet_ntoa(ip_bytes)
+    return ip
+
+
+def eh_binario(data: bytes) -> bool:
+    return len(data) >= CABECALHO.size and data[0] == MAGIC
+
+
+def eh_fragmento(data: bytes) -> bool:
+    return eh_binario(data) and data[2] == TIPO_FRAGMENTO
+
+
+def ler_cabecalho(data: bytes) -> Tuple[str, int]:
+    """Lê (id, seq) de um LSA binário ou fragmento sem decodificar o corpo."""
+    magic, versao, tipo, _, id_bytes, seq = CABECALHO.unpack_from(data)
+    if magic != MAGIC or versao != VERSAO or tipo not in (TIPO_LSA, TIPO_FRAGMENTO):
+        raise ValueError(f"Cabeçalho de LSA desconhecido (magic={magic:#x}, versão={versao}, tipo={tipo})")
+    return _endereco(id_bytes), seq
+
+
+def codificar_binario(lsa: Dict) -> bytes:
+    """Codifica um LSA (no formato de LSA.to_dict) em binário. Levanta ValueError se não couber no formato."""
+    try:
+        partes = [
+            CABECALHO.pack(MAGIC, VERSAO, TIPO_LSA, 0, socket.inet_aton(lsa["id"]), lsa["seq"]),
+            CONTAGENS.pack(len(lsa["vizinhos"]), len(lsa["subnets"])),
+        ]
+        for ip, custo in lsa["vizinhos"].values():
+            partes.append(VIZINHO.pack(socket.inet_aton(ip), int(custo)))
+        for subnet in lsa["subnets"]:
+            rede, prefixo = subnet.split("/")
+            partes.append(SUBNET.pack(socket.inet_aton(rede), int(prefixo)))
+        partes.append(IDADE.pack(min(int(lsa.get("idade", 0)), IDADE_MAXIMA_CODIFICAVEL)))
+        resumos = lsa.get("resumos", ())
+        if resumos:
+            partes.append(NUM_RESUMOS.pack(len(resumos)))
+            for subnet, custo in resumos:
+                rede, prefixo = subnet.split("/")
+                partes.append(RESUMO.pack(socket.inet_aton(rede), int(prefixo), int(custo)))
+    except (OSError, struct.error) as e:
+        raise ValueError(f"LSA não representável no formato binário: {e}") from e
+    return b"".join(partes)
+
+
+def decodificar_binario(data: bytes) -> Dict:
+    id, seq = ler_cabecalho(data)
+    if data[2] != TIPO_LSA:
+        raise ValueError("Fragmento recebido onde se esperava um LSA completo")
+    if len(data) < CABECALHO.size + CONTAGENS.size:
+        raise ValueError(f"LSA binário truncado ({len(data)} bytes)")
+    num_vizinhos, num_subnets = CONTAGENS.unpack_from(data, CABECALHO.size)
+    posicao = CABECALHO.size + CONTAGENS.size
+    if len(data) < posicao + num_vizinhos * VIZINHO.size + num_subnets * SUBNET.size:
+        raise ValueError(f"LSA binário truncado ({len(data)} bytes)")
+
+    vizinhos = {}
+    for ip_bytes, custo in VIZINHO.iter_unpack(data[posicao:posicao + num_vizinhos * VIZINHO.size]):
+        ip = _endereco(ip_bytes)
+        vizinhos[ip] = (ip, custo)
+    posicao += num_vizinhos * VIZINHO.size
+
+    subnets = [
+        f"{_endereco(rede)}/{prefixo}"
+        for rede, prefixo in SUBNET.iter_unpack(data[posicao:posicao + num_subnets * SUBNET.size])
+    ]
+    posicao += num_subnets * SUBNET.size
+    idade = IDADE.unpack_from(data, posicao)[0] if len(data) >= posicao + IDADE.size else 0
+    lsa = {"id": id, "seq": seq, "vizinhos": vizinhos, "subnets": subnets, "idade": idade}
+    posicao += IDADE.size
+    if len(data) >= posicao + NUM_RESUMOS.size:
+        num_resumos = NUM_RESUMOS.unpack_from(data, posicao)[0]
+        posicao += NUM_RESUMOS.size
+        if len(data) < posicao + num_resumos * RESUMO.size:
+            raise ValueError(f"LSA binário truncado ({len(data)} bytes)")
+        lsa["resumos"] = [
+            [f"{_endereco(rede)}/{prefixo}", custo]
+            for rede, prefixo, custo in RESUMO.iter_unpack(data[posicao:posicao + num_resumos * RESUMO.size])
+        ]
+    return lsa
+
+
+def definir_idade(data: bytes, idade: int) -> bytes:
+    """Troca a idade de um LSA binário completo sem decodificá-lo (acrescenta o campo se não existir)."""
+    num_vizinhos, num_subnets = CONTAGENS.unpack_from(data, CABECALHO.size)
+    fim = CABECALHO.size + CONTAGENS.size + num_vizinhos * VIZINHO.size + num_subnets * SUBNET.size
+    return bytes(data[:fim]) + IDADE.pack(min(idade, IDADE_MAXIMA_CODIFICAVEL)) + bytes(data[fim + IDADE.size:])
+
+
+def codificar(lsa: Dict, formato: str) -> bytes:
+    if formato == FORMATO_BINARIO:
+        return codificar_binario(lsa)
+    return json.dumps(lsa).encode()
+
+
+def decodificar(data: bytes) -> Dict:
+    """Decodifica um LSA em qualquer um dos formatos. Levanta ValueError se for inválido."""
+    if eh_binario(data):
+        return decodificar_binario(data)
+    return json.loads(data.decode()) # json.JSONDecodeError é subclasse de ValueError
+
+
+def fragmentar(data: bytes, id: str, seq: int, tamanho_maximo: int) -> List[bytes]:
+    """Divide um LSA codificado em datagramas de até tamanho_maximo bytes (um só se já couber)."""
+    if len(data) <= tamanho_maximo:
+        return [data]
+    carga = tamanho_maximo - FRAGMENTO.size
+    if carga <= 0:
+        raise ValueError(f"Tamanho máximo de datagrama muito pequeno: {tamanho_maximo}")
+    total = -(-len(data) // carga)
+    if total > MAXIMO_FRAGMENTOS:
+        raise ValueError(f"LSA de {len(data)} bytes precisaria de {total} fragmentos (máximo {MAXIMO_FRAGMENTOS})")
+    id_bytes = socket.inet_aton(id)
+    return [
+        FRAGMENTO.pack(MAGIC, VERSAO, TIPO_FRAGMENTO, 0, id_bytes, seq, indice, total) + data[indice * carga:(indice + 1) * carga]
+        for indice in range(total)
+    ]
+
+
+class Remontagem:
+    """
+    Junta os fragmentos de LSAs grandes.
+
+    Guarda no máximo uma remontagem por vizinho e roteador de origem: cada vizinho
+    fragmenta na codificação negociada com ele, então fragmentos de vizinhos
+    diferentes nunca se misturam. Um fragmento de seq mais nova descarta a
+    remontagem incompleta da anterior, e fragmentos de seq mais antiga são ignorados. Remontagens paradas há mais de `expiracao`
+    segundos são descartadas, e no máximo `limite` ficam abertas ao mesmo tempo.
+    Não é thread-safe: deve ser usada só pelo caminho de recepção.
+    """
+
+    def __init__(self, expiracao: float = 2.0, limite: int = 256):
+        self.expiracao = expiracao
+        self.limite = limite
+        self.pendentes: Dict[Tuple[str, str], list] = {} # (vizinho, id) -> [seq, partes, faltando, ultimo_fragmento]
+        self.ultima_limpeza = time.monotonic()
+        self.contadores = {
+            "fragmentos": 0,
+            "remontados": 0,
+            "descartados_obsoletos": 0,  # Fragmento de seq mais antiga, ou remontagem substituída
+            "descartados_expirados": 0,
+            "descartados_invalidos": 0,
+        }
+
+    def adicionar(self, fragmento: bytes, origem: str) -> Optional[bytes]:
+        """
+        Registra um fragmento recebido do vizinho `origem` (copiando-o).
+        Retorna o LSA completo quando o último fragmento chega.
+        """
+        agora = time.monotonic()
+        self.contadores["fragmentos"] += 1
+        if agora - self.ultima_limpeza > self.expiracao:
+            self.limpar(agora)
+
+        _, _, _, _, id_bytes, seq, indice, total = FRAGMENTO.unpack_from(fragmento)
+        if not 0 < total <= MAXIMO_FRAGMENTOS or indice >= total:
+            self.contadores["descartados_invalidos"] += 1
+            return None
+        chave = (origem, _endereco(id_bytes))
+
+        pendente = self.pendentes.get(chave)
+        if pendente is not None and seq != pendente[0]:
+            self.contadores["descartados_obsoletos"] += 1
+            if seq < pendente[0]:
+                return None
+            pendente = None # Seq mais nova: a remontagem anterior é abandonada
+        if pendente is None:
+            if chave not in self.pendentes and len(self.pendentes) >= self.limite:
+                self.contadores["descartados_invalidos"] += 1
+                return None
+            pendente = self.pendentes[chave] = [seq, [None] * total, total, agora]
+        elif len(pendente[1]) != total:
+            self.contadores["descartados_invalidos"] += 1
+            return None
+
+        partes = pendente[1]
+        if partes[indice] is None:
+            partes[indice] = bytes(fragmento[FRAGMENTO.size:])
+            pendente[2] -= 1
+        pendente[3] = agora
+        if pendente[2]:
+            return None
+        del self.pendentes[chave]
+        self.contadores["remontados"] += 1
+        return b"".join(partes)
+
+    def limpar(self, agora: float):
+        self.ultima_limpeza = agora
+        for chave in [chave for chave, pendente in self.pendentes.items() if agora - pendente[3] > self.expiracao]:
+            del self.pendentes[chave]
+            self.contadores["descartados_expirados"] += 1
+
+    def estado(self) -> Dict:
+        return {"pendentes": len(self.pendentes), **self.contadores}
+
+
+def formato_de(data: bytes) -> str:
+    return FORMATO_BINARIO if eh_binario(data) else FORMATO_JSON
+
+
+def escolher_formato(locais: Tuple[str, ...], do_vizinho: Optional[Tuple[str, ...]]) -> str:
+    """Formato usado com um vizinho: binário só se os dois lados o anunciaram."""
+    if do_vizinho and FORMATO_BINARIO in locais and FORMATO_BINARIO in do_vizinho:
+        return FORMATO_BINARIO
+    return FORMATO_JSON
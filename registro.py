@@ -0,0 +1,196 @@
+"""
+Subsistema de logs compartilhado pelo roteador e pelos hosts.
+
+Cada mensagem tem uma categoria (que vira o arquivo <categoria>.log) e um nível.
+Mensagens abaixo do nível configurado para a categoria são descartadas antes de
+qualquer formatação: a mensagem pode ser um formato com argumentos no estilo %
+ou uma função sem argumentos, chamada só se a mensagem for registrada. Argumentos
+que são funções sem argumentos também só são avaliados nesse caso.
+
+As mensagens aceitas vão para uma fila e são gravadas por uma thread em segundo
+plano, em lotes, com os arquivos mantidos abertos e rotacionados por tamanho.
+O caminho que registra nunca espera por disco: com a fila cheia, a mensagem é
+descartada e contada.
+
+Configuração por variáveis de ambiente (ver Registro.do_ambiente):
+    log_nivel           nível padrão (debug, info, aviso, erro); padrão info
+    log_categorias      níveis por categoria, ex.: "lsa=debug,rotas_debug=off"
+    log_tamanho_maximo  bytes por arquivo antes de rotacionar; padrão 5 MB
+    log_copias          arquivos rotacionados mantidos; padrão 3
+    log_stdout          "0" desliga a cópia das mensagens no stdout
+"""
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, IO, List, Optional, Tuple, Union
+
+DEBUG = 10
+INFO = 20
+AVISO = 30
+ERRO = 40
+DESLIGADO = 100
+
+NIVEIS = {"debug": DEBUG, "info": INFO, "aviso": AVISO, "erro": ERRO, "off": DESLIGADO}
+
+Mensagem = Union[str, Callable[[], str]]
+
+
+def nivel_padrao(categoria: str) -> int:
+    """Nível de uma mensagem sem nível explícito: categorias *_debug são DEBUG, erros são ERRO."""
+    if categoria.endswith("_debug"):
+        return DEBUG
+    if categoria == "erros":
+        return ERRO
+    return INFO
+
+
+def interpretar_categorias(texto: str) -> Dict[str, int]:
+    """Converte "lsa=debug,rotas_debug=off" em {"lsa": DEBUG, "rotas_debug": DESLIGADO}."""
+    niveis = {}
+    for item in texto.split(","):
+        if "=" not in item:
+            continue
+        categoria, nivel = (parte.strip().lower() for parte in item.split("=", 1))
+        if categoria and nivel in NIVEIS:
+            niveis[categoria] = NIVEIS[nivel]
+    return niveis
+
+
+class Registro:
+    LOTE = 512 # Mensagens gravadas por vez pela thread de escrita
+
+    def __init__(self, diretorio: str, origem: str = "", nivel: int = INFO, categorias: Optional[Dict[str, int]] = None,
+                 tamanho_maximo: int = 5 * 1024 * 1024, copias: int = 3, stdout: bool = True, capacidade: int = 10000):
+        self.diretorio = diretorio
+        self.origem = origem
+        self.nivel = nivel
+        self.categorias = dict(categorias or {})
+        self.tamanho_maximo = tamanho_maximo
+        self.copias = copias
+        self.stdout = stdout
+        self.fila: "queue.Queue[Optional[Tuple[float, str, str]]]" = queue.Queue(capacidade)
+        self.arquivos: Dict[str, IO[str]] = {}
+        self.tamanhos: Dict[str, int] = {}
+        self.descartadas = 0
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def do_ambiente(cls, diretorio: str, origem: str = "") -> "Registro":
+        return cls(
+            diretorio,
+            origem,
+            nivel=NIVEIS.get(os.environ.get("log_nivel", "info").strip().lower(), INFO),
+            categorias=interpretar_categorias(os.environ.get("log_categorias", "")),
+            tamanho_maximo=int(os.environ.get("log_tamanho_maximo", str(5 * 1024 * 1024))),
+            copias=int(os.environ.get("log_copias", "3")),
+            stdout=os.environ.get("log_stdout", "1") != "0",
+        )
+
+    def habilitado(self, categoria: str, nivel: Optional[int] = None) -> bool:
+        """Permite pular trabalho caro (montar a mensagem) quando ela seria descartada."""
+        if nivel is None:
+            nivel = nivel_padrao(categoria)
+        return nivel >= self.categorias.get(categoria, self.nivel)
+
+    def log(self, categoria: str, msg: Mensagem, *args, nivel: Optional[int] = None):
+        if not self.habilitado(categoria, nivel):
+            return
+        try:
+            if callable(msg):
+                msg = msg()
+            elif args:
+                msg = msg % tuple(arg() if callable(arg) else arg for arg in args)
+        except Exception as e:
+            msg = f"Erro ao formatar mensagem de log {msg!r}: {e}"
+        if self.thread is None:
+            self.iniciar()
+        try:
+            self.fila.put_nowait((time.time(), categoria, msg))
+        except queue.Full:
+            self.descartadas += 1
+
+    def iniciar(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            os.makedirs(self.diretorio, exist_ok=True)
+            self.thread = threading.Thread(target=self.escrever, daemon=True, name="registro")
+            self.thread.start()
+            atexit.register(self.encerrar)
+
+    def encerrar(self, espera: float = 2.0):
+        """Grava o que ainda está na fila e fecha os arquivos."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        try:
+            self.fila.put(None, timeout=espera)
+        except queue.Full:
+            return
+        self.thread.join(espera)
+
+    def escrever(self):
+        while True:
+            lote = [self.fila.get()]
+            while len(lote) < self.LOTE:
+                try:
+                    lote.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            encerrar = None in lote
+            try:
+                self.gravar_lote([item for item in lote if item is not None])
+            except Exception as e:
+                print(f"Erro ao gravar logs em {self.diretorio}: {e}", file=sys.stderr, flush=True)
+            if encerrar:
+                for arquivo in self.arquivos.values():
+                    arquivo.close()
+                self.arquivos.clear()
+                return
+
+    def gravar_lote(self, lote: List[Tuple[float, str, str]]):
+        por_categoria: Dict[str, List[str]] = {}
+        todas: List[str] = []
+        segundo_formatado, texto_segundo = None, ""
+        for instante, categoria, msg in lote:
+            segundo = int(instante)
+            if segundo != segundo_formatado: # Mensagens do mesmo segundo reaproveitam o timestamp
+                segundo_formatado, texto_segundo = segundo, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(segundo))
+            linha = f"{texto_segundo} - {self.origem} - {msg}\n" if self.origem else f"{texto_segundo} - {msg}\n"
+            por_categoria.setdefault(categoria, []).append(linha)
+            todas.append(linha)
+
+        for categoria, linhas in por_categoria.items():
+            texto = "".join(linhas)
+            arquivo = self.abrir(categoria)
+            arquivo.write(texto)
+            arquivo.flush()
+            self.tamanhos[categoria] += len(texto.encode())
+            if self.tamanhos[categoria] >= self.tamanho_maximo:
+                self.rotacionar(categoria)
+        if self.stdout:
+            sys.stdout.write("".join(todas)) # Na ordem de chegada, para o docker logs
+            sys.stdout.flush()
+
+    def abrir(self, categoria: str) -> IO[str]:
+        arquivo = self.arquivos.get(categoria)
+        if arquivo is None:
+            caminho = os.path.join(self.diretorio, f"{categoria}.log")
+            arquivo = self.arquivos[categoria] = open(caminho, "a")
+            self.tamanhos[categoria] = arquivo.tell()
+        return arquivo
+
+    def rotacionar(self, categoria: str):
+        """<categoria>.log vira .log.1, .log.1 vira .log.2 e assim por diante, até self.copias."""
+        self.arquivos.pop(categoria).close()
+        caminho = os.path.join(self.diretorio, f"{categoria}.log")
+        if self.copias > 0:
+            for i in range(self.copias - 1, 0, -1):
+                if os.path.exists(f"{caminho}.{i}"):
+                    os.replace(f"{caminho}.{i}", f"{caminho}.{i + 1}")
+            os.replace(caminho, f"{caminho}.1")
+        else:
+            os.remove(caminho)
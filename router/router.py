@@ -1,29 +1,96 @@
+import asyncio
 import json
 import os
 import socket
 import threading
 import time
-import subprocess
 import netifaces
 import ipaddress
+import math
 import random 
+import signal
 import hashlib
-from typing import Dict, Tuple
+import sys
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from formater import Formatter
-from dycastra import dijkstra
+from dycastra import SUBREDE_LOOPBACK, ProximosSaltos, SPFIncremental
+from spf_processo import ProcessoSPF, SPFRemoto
+import protocolo
+import fib
+import registro
+from registro import AVISO, DEBUG
 
 PORTA = 5000
 ROTEADOR_IP = os.environ["my_ip"]
 ROTEADOR_NAME = os.environ["my_name"]
 VIZINHOS = Formatter.formatar_vizinhos(os.environ.get("vizinhos", ""))
+# Área do roteador e de cada enlace (quarto campo opcional em vizinhos); roteadores com
+# enlaces em mais de uma área são de borda (ABR) e resumem os prefixos de uma área para as outras
+AREA = os.environ.get("area", "0").strip()
+AREAS_VIZINHOS = Formatter.formatar_areas(os.environ.get("vizinhos", ""), AREA)
+AREA_BACKBONE = "0"
 LOG_BASE_DIR = "/app/logs"
+# Fração máxima de roteadores afetados para o SPF incremental; acima disso roda o SPF completo
+ISPF_LIMITE_AFETADOS = float(os.environ.get("ispf_limite_afetados", "0.25"))
+# Agendamento do SPF (segundos): atraso após a primeira mudança, espera mínima e máxima entre execuções
+SPF_ATRASO_INICIAL = float(os.environ.get("spf_atraso_inicial", "0.05"))
+SPF_ESPERA_MINIMA = float(os.environ.get("spf_espera_minima", "0.2"))
+SPF_ESPERA_MAXIMA = float(os.environ.get("spf_espera_maxima", "5"))
+# Alternativos livres de laço (LFA) calculados junto com o SPF e usados assim que uma adjacência cai
+LFA = os.environ.get("lfa", "1") != "0"
+# Máximo de caminhos de mesmo custo (ECMP) instalados por rota; 1 instala só o caminho da árvore do SPF
+ECMP_MAXIMO_CAMINHOS = int(os.environ.get("ecmp_maximo_caminhos", "4"))
+# SPF num processo separado (snapshots do LSDB por memória compartilhada); "0" roda o SPF no próprio roteador
+SPF_PROCESSO = os.environ.get("spf_processo", "1") != "0"
+SPF_PROCESSO_PRAZO = float(os.environ.get("spf_processo_prazo", "30")) # Sem resposta nesse tempo, o processo é recriado
+# Ingestão de LSAs: capacidade da fila (um LSA pendente por origem) e número de workers
+LSA_FILA_CAPACIDADE = int(os.environ.get("lsa_fila_capacidade", "1024"))
+LSA_WORKERS = int(os.environ.get("lsa_workers", "4"))
+# Runtime do roteador: "threads" (padrão) ou "asyncio"
+MODO_EXECUCAO = os.environ.get("modo_execucao", "threads").strip().lower()
+INTERVALO_ENVIO_LSA = 15 # Segundos entre registros do estado nos logs (e verificações do refresh)
+# Inundação confiável (segundos): reenvio de LSAs não confirmados e refresh do próprio LSA sem mudanças
+LSA_RETRANSMISSAO = float(os.environ.get("lsa_retransmissao", "1"))
+LSA_REFRESH = float(os.environ.get("lsa_refresh", "1800"))
+# Idade (segundos) em que um LSA sem refresh sai do LSDB, e máximo de LSAs guardados
+LSA_IDADE_MAXIMA = int(os.environ.get("lsa_idade_maxima", "3600"))
+LSDB_MAXIMO = int(os.environ.get("lsdb_maximo", "10000"))
+# Protocolo Hello (segundos): intervalo entre Hellos e tempo sem Hello para derrubar a adjacência
+HELLO_INTERVALO = float(os.environ.get("hello_intervalo", "0.2"))
+DEAD_INTERVALO = float(os.environ.get("dead_intervalo", "0.8"))
+# Custo dos enlaces: "aleatoria" (peso simétrico reprodutível), "configurada" (custo de vizinhos)
+# ou "rtt" (medido pelos Hellos, suavizado e com histerese)
+METRICA = os.environ.get("metrica", "aleatoria").strip().lower()
+RTT_ALFA = float(os.environ.get("rtt_alfa", "0.2")) # Peso da amostra nova na média móvel do RTT
+RTT_UNIDADE = float(os.environ.get("rtt_unidade_ms", "1")) / 1000 # RTT equivalente a uma unidade de custo
+RTT_HISTERESE = float(os.environ.get("rtt_histerese", "0.5")) # Folga, em unidades de custo, antes de mudar o custo
+# Segmentos multiacesso: eleição de DR/BDR (prioridade 0 nunca é eleito) e inundação por multicast
+DR = os.environ.get("dr", "1") != "0"
+PRIORIDADE_DR = int(os.environ.get("prioridade_dr", "1"))
+GRUPO_MULTICAST = "224.0.0.5" # AllSPFRouters, como no OSPF
+# Formato preferido dos LSAs; "json" desliga o binário e anuncia só JSON nos Hellos
+FORMATO_LSA = os.environ.get("formato_lsa", protocolo.FORMATO_BINARIO).strip().lower()
+# LSAs codificados maiores que isso são fragmentados (abaixo da MTU de 1500 das redes Docker)
+LSA_TAMANHO_DATAGRAMA = int(os.environ.get("lsa_tamanho_datagrama", "1400"))
+FORMATOS_LSA = (protocolo.FORMATO_BINARIO, protocolo.FORMATO_JSON) if FORMATO_LSA == protocolo.FORMATO_BINARIO else (protocolo.FORMATO_JSON,)
 
-def log(categoria: str, msg: str, origem: str = ""):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_msg = f"{timestamp} - {origem} - {msg}"
-    print(log_msg)
-    with open(f"{LOG_BASE_DIR}/{categoria}.log", "a") as f:
-        f.write(log_msg + "\n")
+# Sub-redes anunciadas no LSA: "principal" (só a de my_ip) ou "todas" as interfaces do roteador
+ANUNCIAR_SUBREDES = os.environ.get("anunciar_subredes", "principal").strip().lower()
+# Segundos até revarrer as interfaces mesmo sem notificação do kernel
+SUBREDES_VALIDADE = float(os.environ.get("subredes_validade", "30"))
+
+# Backend de programação da FIB: "netlink" (kernel) ou "memoria" (testes sem NET_ADMIN)
+FIB_BACKEND = os.environ.get("fib_backend", "netlink").strip().lower()
+# Transação de rotas: "prefixo" mantém o que deu certo, "atomica" volta tudo se uma rota nova falhar
+FIB_TRANSACAO = os.environ.get("fib_transacao", "prefixo").strip().lower()
+FIB_REPETICOES = int(os.environ.get("fib_repeticoes", "1")) # Novas tentativas das operações que falharem
+
+# Logs com nível por categoria, gravados em segundo plano (ver registro.py). Mensagens
+# do caminho de inundação e do SPF são DEBUG e usam formatação preguiçosa
+REGISTRO = registro.Registro.do_ambiente(LOG_BASE_DIR, ROTEADOR_NAME)
+log = REGISTRO.log
 
 def get_symmetric_random_weight(ip1: str, ip2: str) -> int:
     """
@@ -34,155 +101,653 @@ def get_symmetric_random_weight(ip1: str, ip2: str) -> int:
     sorted_ips = sorted([ip1, ip2])
     # Cria uma string de semente estável
     seed_str = f"{sorted_ips[0]}-{sorted_ips[1]}"
-    # Usa um hash da string de semente para semear o gerador de números aleatórios
+    # Usa um hash da string de semente para semear um gerador próprio (sem mexer no random global)
     seed_int = int(hashlib.sha256(seed_str.encode()).hexdigest(), 16)
-    # Semeia o gerador
-    random.seed(seed_int)
-    # Gera um inteiro aleatório entre 1 e 10
-    weight = random.randint(1, 10)
-    # log("peso_debug", f"Peso calculado para {ip1}-{ip2}: {weight} (seed_str: {seed_str})", ROTEADOR_NAME) # Log opcional
+    # Gera um inteiro aleatório entre 1 e 10 (mesmo valor de random.seed(seed_int) + randint)
+    weight = random.Random(seed_int).randint(1, 10)
+    # log("peso_debug", f"Peso calculado para {ip1}-{ip2}: {weight} (seed_str: {seed_str})") # Log opcional
     return weight
 
+def agregar_prefixos(prefixos: Dict[str, float]) -> Dict[str, int]:
+    """
+    Junta prefixos contíguos nos maiores blocos que eles cobrem exatamente (ex.: 172.20.0.0/24
+    e 172.20.1.0/24 viram 172.20.0.0/23). O custo de um bloco é o maior dos prefixos dele.
+    """
+    redes = sorted((ipaddress.ip_network(subnet), custo) for subnet, custo in prefixos.items())
+    resumos, i = {}, 0
+    for bloco in ipaddress.collapse_addresses(rede for rede, _ in redes):
+        custo = 0
+        while i < len(redes) and redes[i][0].subnet_of(bloco):
+            custo = max(custo, redes[i][1])
+            i += 1
+        resumos[str(bloco)] = int(math.ceil(custo))
+    return resumos
+
+
 class NetworkUtils:
     @staticmethod
-    def _testar_ping(ip: str) -> Tuple[bool, float]:
-        init_ping = time.time()
-        try:
-            result = subprocess.run(
-                ["ping", "-c", "5", "-W", "1", ip],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            end_ping = time.time()
-            return result.returncode == 0, end_ping - init_ping
-        except Exception:
-            return False, 0.0
-
-    # Substituído: realizar_pings por determinar_vizinhos_ativos_e_pesos
-    @staticmethod
-    def determinar_vizinhos_ativos_e_pesos(vizinhos: Dict[str, Tuple[str, int]]) -> Dict[str, Tuple[str, int]]:
-        """Verifica quais vizinhos estão ativos e atribui pesos aleatórios simétricos."""
+    def determinar_vizinhos_ativos_e_pesos(vizinhos: Dict[str, Tuple[str, int]], ativos: set,
+                                           custos_medidos: Optional[Dict[str, int]] = None) -> Dict[str, Tuple[str, int]]:
+        """
+        Filtra os vizinhos com adjacência ativa (protocolo Hello) e atribui os pesos conforme METRICA:
+        aleatórios simétricos, o custo configurado em `vizinhos` ou o custo medido pelo RTT
+        (custos_medidos, por IP; vizinhos ainda sem medida ficam com o custo configurado).
+        """
+        log("pesos_debug", "Determinando vizinhos ativos e pesos para %s (%s), métrica %s", ROTEADOR_NAME, ROTEADOR_IP, METRICA)
+        custos_medidos = custos_medidos or {}
         vizinhos_ativos_com_peso = {}
-        log("pesos_debug", f"Determinando vizinhos ativos e pesos para {ROTEADOR_NAME} ({ROTEADOR_IP})", ROTEADOR_NAME)
-        for viz_name, (viz_ip, _) in vizinhos.items():
-            is_alive, _ = NetworkUtils._testar_ping(viz_ip) # Ainda verifica se está vivo
-            if is_alive:
-                # Calcula o peso aleatório simétrico
-                peso = get_symmetric_random_weight(ROTEADOR_IP, viz_ip)
+        for viz_name, (viz_ip, custo_configurado) in vizinhos.items():
+            if viz_name in ativos:
+                if METRICA == "rtt" and viz_ip in custos_medidos:
+                    peso = custos_medidos[viz_ip]
+                elif METRICA in ("rtt", "configurada"):
+                    peso = int(custo_configurado)
+                else:
+                    # Calcula o peso aleatório simétrico
+                    peso = get_symmetric_random_weight(ROTEADOR_IP, viz_ip)
                 vizinhos_ativos_com_peso[viz_name] = (viz_ip, peso)
-                log("pesos_debug", f"  - Vizinho {viz_name} ({viz_ip}) está ATIVO. Peso aleatório simétrico: {peso}", ROTEADOR_NAME)
+                log("pesos_debug", "  - Vizinho %s (%s) está ATIVO. Peso: %s", viz_name, viz_ip, peso)
             else:
-                log("lsa", f"Ping falhou para {viz_name} ({viz_ip}), considerado INATIVO.", ROTEADOR_NAME)
-        log("pesos_debug", f"Vizinhos ativos com pesos determinados: {vizinhos_ativos_com_peso}", ROTEADOR_NAME)
+                log("lsa", "Adjacência com %s (%s) não está UP, considerado INATIVO.", viz_name, viz_ip, nivel=DEBUG)
+        log("pesos_debug", "Vizinhos ativos com pesos determinados: %s", vizinhos_ativos_com_peso)
         return vizinhos_ativos_com_peso
 
+class MetricaRTT:
+    """
+    Converte as amostras de RTT de um vizinho em custo de enlace.
+
+    O RTT é suavizado por média móvel exponencial (peso `alfa` para a amostra nova)
+    e dividido por `unidade` segundos; o custo é o teto desse valor, no mínimo 1.
+    Para um ruído na fronteira entre dois custos não gerar um LSA por Hello, o custo
+    anunciado só muda quando o valor sai da faixa dele alargada por `histerese`
+    (em unidades de custo) dos dois lados.
+    """
+
+    def __init__(self, alfa: float, unidade: float, histerese: float):
+        self.alfa = alfa
+        self.unidade = unidade
+        self.histerese = histerese
+
+    def atualizar(self, adj: "Adjacencia", rtt: float) -> bool:
+        """Registra uma amostra de RTT (segundos). Retorna True se o custo anunciado mudou."""
+        adj.rtt = rtt if adj.rtt is None else adj.rtt + self.alfa * (rtt - adj.rtt)
+        valor = adj.rtt / self.unidade
+        if adj.custo is not None and adj.custo - 1 - self.histerese <= valor <= adj.custo + self.histerese:
+            return False
+        custo = max(1, math.ceil(valor))
+        if custo == adj.custo:
+            return False
+        log("adjacencias", "Custo do enlace com %s (%s): %s -> %s (RTT suavizado %.3f ms)",
+            adj.nome, adj.ip, adj.custo, custo, adj.rtt * 1000)
+        adj.custo = custo
+        return True
+
+class Adjacencia:
+    """Estado da adjacência com um vizinho configurado: down -> init (ouviu Hello) -> up (bidirecional)."""
+
+    __slots__ = ("nome", "ip", "estado", "ultimo_hello", "desde", "transicoes", "formatos", "eco", "rtt", "custo",
+                 "prioridade", "designados")
+
+    def __init__(self, nome: str, ip: str):
+        self.nome = nome
+        self.ip = ip
+        self.estado = "down"
+        self.ultimo_hello: Optional[float] = None
+        self.desde = time.monotonic()
+        self.transicoes = 0
+        self.formatos: Optional[Tuple[str, ...]] = None # Formatos de LSA anunciados no Hello do vizinho
+        self.eco: Optional[Tuple[float, float]] = None # (marca de tempo do último Hello do vizinho, quando chegou)
+        self.rtt: Optional[float] = None # RTT suavizado (segundos)
+        self.custo: Optional[int] = None # Custo derivado do RTT, com histerese
+        self.prioridade = 1 # Prioridade na eleição de DR anunciada pelo vizinho
+        self.designados: Dict[str, List] = {} # Segmento -> [DR, BDR] na eleição do vizinho
+
+class ProtocoloHello:
+    """
+    Protocolo Hello sobre UDP, na mesma porta dos LSAs, para detectar vizinhos.
+
+    A cada intervalo o roteador envia um Hello para cada vizinho configurado com a
+    lista dos vizinhos que ele ouviu dentro do dead interval. A adjacência fica UP
+    quando o Hello do vizinho traz o nosso IP (comunicação bidirecional) e cai
+    quando nenhum Hello chega dentro do dead interval. Toda entrada ou saída do
+    estado UP chama ao_mudar, fora do lock.
+
+    Os Hellos também negociam o formato dos LSAs: cada lado anuncia os formatos
+    que entende, e Hellos sem o campo (versões antigas) valem como só JSON.
+
+    Cada Hello leva a marca de tempo de quem o enviou ("t") e devolve, para cada
+    vizinho, a última marca recebida dele com o tempo que ela ficou retida ("eco").
+    O eco do nosso IP dá uma amostra de RTT medida só com o relógio local; com
+    `metrica`, as amostras viram custo do enlace e ao_mudar_custo é chamado, fora
+    do lock, quando o custo anunciado de algum vizinho muda.
+
+    Os Hellos levam ainda a prioridade do roteador na eleição de DR e o resultado
+    da eleição que ele fez em cada segmento (`designados`, ver EleicaoDR).
+    """
+
+    def __init__(self, meu_ip: str, vizinhos: Dict[str, Tuple[str, int]], enviar: Callable[[bytes, str], None],
+                 ao_mudar: Callable[[], None], intervalo: float, dead: float, formatos: Tuple[str, ...] = FORMATOS_LSA,
+                 metrica: Optional[MetricaRTT] = None, ao_mudar_custo: Optional[Callable[[], None]] = None,
+                 prioridade: int = PRIORIDADE_DR):
+        self.meu_ip = meu_ip
+        self.prioridade = prioridade
+        self.designados: Dict[str, List] = {} # Preenchido pela eleição de DR do roteador
+        self.formatos = formatos
+        self.enviar = enviar
+        self.ao_mudar = ao_mudar
+        self.metrica = metrica
+        self.ao_mudar_custo = ao_mudar_custo
+        self.intervalo = intervalo
+        self.dead = dead
+        self.adjacencias: Dict[str, Adjacencia] = {ip: Adjacencia(nome, ip) for nome, (ip, _) in vizinhos.items()}
+        self.proximo_hello = 0.0
+        self.lock = threading.Lock()
+
+    def ativos(self) -> set:
+        with self.lock:
+            return {adj.nome for adj in self.adjacencias.values() if adj.estado == "up"}
+
+    def custos(self) -> Dict[str, int]:
+        """Custos derivados do RTT, por IP, dos vizinhos UP que já têm medida."""
+        with self.lock:
+            return {ip: adj.custo for ip, adj in self.adjacencias.items() if adj.estado == "up" and adj.custo is not None}
+
+    def prioridades(self) -> Dict[str, int]:
+        """Prioridades na eleição de DR, por IP, dos vizinhos UP."""
+        with self.lock:
+            return {ip: adj.prioridade for ip, adj in self.adjacencias.items() if adj.estado == "up"}
+
+    def concordam(self, segmento: str, membros: List[str], designado: Tuple[Optional[str], Optional[str]]) -> bool:
+        """True se todos os vizinhos do segmento anunciaram o mesmo DR e BDR que nós."""
+        with self.lock:
+            return all(tuple(self.adjacencias[ip].designados.get(segmento) or ()) == designado for ip in membros)
+
+    def montar_hello(self) -> bytes:
+        with self.lock:
+            agora = time.monotonic()
+            vistos = [ip for ip, adj in self.adjacencias.items() if adj.estado != "down"]
+            eco = {ip: [adj.eco[0], round(agora - adj.eco[1], 6)] for ip, adj in self.adjacencias.items()
+                   if adj.eco is not None and adj.estado != "down"}
+        return json.dumps({"tipo": "hello", "id": self.meu_ip, "vistos": vistos, "formatos": list(self.formatos),
+                           "t": agora, "eco": eco, "prioridade": self.prioridade, "designados": self.designados}).encode()
+
+    def caiu_em(self, ip: str) -> Optional[float]:
+        """Instante (time.monotonic) em que a adjacência saiu de UP, ou None se ela está UP."""
+        adj = self.adjacencias.get(ip)
+        if adj is None or adj.estado == "up":
+            return None
+        return adj.desde
+
+    def formato_lsa(self, ip: str) -> str:
+        """Formato dos LSAs enviados a um vizinho; JSON enquanto não houver Hello dele."""
+        adj = self.adjacencias.get(ip)
+        return protocolo.escolher_formato(self.formatos, adj.formatos if adj is not None else None)
+
+    def _transicao(self, adj: Adjacencia, estado: str, agora: float) -> bool:
+        """Muda o estado da adjacência. Retorna True se ela entrou ou saiu de UP."""
+        if adj.estado == estado:
+            return False
+        mudou_up = "up" in (adj.estado, estado)
+        log("adjacencias", f"Adjacência com {adj.nome} ({adj.ip}): {adj.estado.upper()} -> {estado.upper()}")
+        adj.estado = estado
+        adj.desde = agora
+        adj.transicoes += 1
+        if estado == "down": # O enlace que voltar começa a medição do zero
+            adj.eco = adj.rtt = adj.custo = None
+        return mudou_up
+
+    def receber_hello(self, mensagem: Dict):
+        agora = time.monotonic()
+        with self.lock:
+            adj = self.adjacencias.get(mensagem.get("id"))
+            if adj is None:
+                return # Hello de quem não é vizinho configurado
+            adj.ultimo_hello = agora
+            adj.formatos = tuple(mensagem.get("formatos", (protocolo.FORMATO_JSON,)))
+            adj.prioridade = int(mensagem.get("prioridade", 1))
+            adj.designados = mensagem.get("designados", {})
+            mudou = self._transicao(adj, "up" if self.meu_ip in mensagem.get("vistos", ()) else "init", agora)
+            mudou_custo = False
+            if "t" in mensagem:
+                adj.eco = (mensagem["t"], agora)
+                eco = mensagem.get("eco", {}).get(self.meu_ip)
+                if eco is not None and self.metrica is not None and adj.estado == "up":
+                    rtt = agora - eco[0] - eco[1]
+                    if 0 <= rtt < self.dead: # Eco de antes de reiniciar ou atrasado demais não é amostra
+                        mudou_custo = self.metrica.atualizar(adj, rtt)
+        if mudou:
+            self.ao_mudar()
+        elif mudou_custo and self.ao_mudar_custo is not None:
+            self.ao_mudar_custo() # Com a adjacência mudando, o novo LSA já leva o custo
+
+    def tick(self) -> float:
+        """
+        Envia os Hellos se o intervalo venceu e derruba adjacências sem Hello dentro do
+        dead interval. Retorna quantos segundos esperar até o próximo evento (Hello ou
+        vencimento de adjacência), para a queda ser detectada no dead interval exato.
+        """
+        agora = time.monotonic()
+        if agora >= self.proximo_hello:
+            self.proximo_hello = agora + self.intervalo
+            hello = self.montar_hello()
+            for adj in self.adjacencias.values():
+                try:
+                    self.enviar(hello, adj.ip)
+                except Exception as e:
+                    log("erros", f"Erro ao enviar Hello para {adj.nome} ({adj.ip}): {e}")
+
+        mudou = False
+        proximo_evento = self.proximo_hello
+        with self.lock:
+            for adj in self.adjacencias.values():
+                if adj.estado == "down":
+                    continue
+                vencimento = adj.ultimo_hello + self.dead
+                if agora >= vencimento:
+                    mudou = self._transicao(adj, "down", agora) or mudou
+                else:
+                    proximo_evento = min(proximo_evento, vencimento)
+        if mudou:
+            self.ao_mudar()
+        return max(0.005, proximo_evento - time.monotonic())
+
+    def loop(self):
+        while True:
+            espera = self.intervalo
+            try:
+                espera = self.tick()
+            except Exception as e:
+                log("erros", f"Erro no loop do protocolo Hello: {e}")
+            time.sleep(espera)
+
+    def estado(self) -> Dict:
+        agora = time.monotonic()
+        with self.lock:
+            return {
+                adj.nome: {
+                    "ip": adj.ip,
+                    "estado": adj.estado,
+                    "ha_s": round(agora - adj.desde, 3),
+                    "ultimo_hello_ha_s": round(agora - adj.ultimo_hello, 3) if adj.ultimo_hello is not None else None,
+                    "transicoes": adj.transicoes,
+                    "rtt_ms": round(adj.rtt * 1000, 3) if adj.rtt is not None else None,
+                    "custo_rtt": adj.custo,
+                }
+                for adj in self.adjacencias.values()
+            }
+
+CUSTO_MAXIMO = 0xFFFFFFFF # Custos vão no formato binário como inteiros de 32 bits sem sinal
+
+
+def validar_custo(custo) -> int:
+    """
+    Custo de enlace ou de resumo como int. Aceita floats inteiros (LSAs de versões que
+    usavam peso float); levanta ValueError para custos fracionários, negativos ou que
+    não caberiam no formato binário, em vez de truncá-los.
+    """
+    if isinstance(custo, float) and custo.is_integer():
+        custo = int(custo)
+    if not isinstance(custo, int) or isinstance(custo, bool) or not 0 <= custo <= CUSTO_MAXIMO:
+        raise ValueError(f"Custo inválido: {custo!r}")
+    return custo
+
+
 class LSA:
+    """
+    LSA guardado no LSDB, em formato compacto.
+
+    Os vizinhos ficam em colunas: nomes e IPs em tuplas, custos num array de
+    inteiros, nas mesmas posições; as sub-redes, numa tupla ordenada. IDs, nomes, IPs e sub-redes são internados:
+    a rede tem poucos valores distintos e eles se repetem em todos os LSAs, então
+    cada um existe uma vez só na memória. O SPF lê as colunas direto (ver
+    dycastra.enlaces_lsa); to_dict() só é usado para enviar e para depuração.
+
+    `assinatura` é um hash só do conteúdo que afeta as rotas (enlaces, sub-redes e
+    resumos): sequência, idade e nomes dos vizinhos ficam de fora, então um
+    refresh tem a mesma assinatura do LSA que ele substitui.
+    """
+
+    __slots__ = ("id", "seq", "nomes", "ips", "custos", "subnets", "idade", "resumos", "recebido_em", "assinatura")
+
     # Atenção: O tipo do peso em vizinhos mudou de float para int
-    def __init__(self, id: str, seq: int, vizinhos: Dict[str, Tuple[str, int]], subnets: set):
-        self.id = id
+    def __init__(self, id: str, seq: int, vizinhos: Dict[str, Tuple[str, int]], subnets: set, idade: int = 0,
+                 resumos: Optional[Dict[str, int]] = None):
+        self.id = sys.intern(id)
         self.seq = seq
-        self.vizinhos = vizinhos
-        self.subnets = subnets  # Sub-redes diretamente conectadas
+        self.nomes = tuple(sys.intern(nome) for nome in vizinhos)
+        self.ips = tuple(sys.intern(ip) for ip, _ in vizinhos.values())
+        self.custos = array("l", (validar_custo(custo) for _, custo in vizinhos.values()))
+        self.subnets = tuple(sorted(sys.intern(subnet) for subnet in subnets))  # Sub-redes diretamente conectadas
+        self.idade = idade # Idade (segundos) com que o LSA chegou ou foi originado
+        # Prefixos de outras áreas e custo, anunciados por um ABR, em ordem de prefixo
+        self.resumos = tuple(sorted((sys.intern(subnet), validar_custo(custo)) for subnet, custo in (resumos or {}).items()))
+        self.recebido_em = time.monotonic()
+        self.assinatura = hash((self.id, self.ips, self.custos.tobytes(), self.subnets, self.resumos))
+
+    @property
+    def vizinhos(self) -> Dict[str, Tuple[str, int]]:
+        return dict(zip(self.nomes, zip(self.ips, self.custos)))
+
+    def idade_atual(self, agora: Optional[float] = None) -> int:
+        """Idade com que chegou mais o tempo guardado aqui, sem passar da idade máxima."""
+        if agora is None:
+            agora = time.monotonic()
+        return min(LSA_IDADE_MAXIMA, self.idade + int(agora - self.recebido_em))
 
     def to_dict(self) -> Dict:
-        return {
+        lsa = {
             "id": self.id,
             "seq": self.seq,
             "vizinhos": self.vizinhos,
             "subnets": list(self.subnets)  # Converte o set para lista para serialização JSON
         }
+        if self.resumos:
+            lsa["resumos"] = [[subnet, custo] for subnet, custo in self.resumos]
+        return lsa
+
+    def para_envio(self) -> Dict:
+        """Dicionário enviado aos vizinhos: a idade avança um segundo a cada salto."""
+        return {**self.to_dict(), "idade": min(LSA_IDADE_MAXIMA, self.idade_atual() + 1)}
 
 class LSDB:
-    def __init__(self):
+    """
+    LSAs conhecidos, um por roteador de origem.
+
+    Cada LSA envelhece a partir da idade com que chegou. Ao atingir a idade máxima
+    (por tempo sem refresh, ou por ter chegado já com ela) ele sai da entrada do SPF
+    e fica só como registro por `retencao` segundos, para cópias antigas atrasadas
+    não o reinstalarem, e depois é apagado. Com `maximo` LSAs guardados, LSAs de
+    origens novas são recusados e contados.
+
+    Além do índice por ID de roteador, os LSAs que entram no SPF são indexados
+    por prefixo anunciado (`por_prefixo`). Quase todo prefixo tem um anunciante
+    só, então os IDs ficam numa tupla, bem menor que um set.
+
+    Para o roteador saber se precisa rodar o SPF sem percorrer o LSDB, cada mudança
+    no conteúdo que entra no SPF (LSA novo com outra assinatura, expirado ou
+    retirado) incrementa `geracao` e atualiza `impressao`, o XOR das assinaturas
+    dos LSAs do SPF. Um LSA que só troca sequência e idade (refresh) não muda
+    nenhum dos dois nem entra em `alterados`.
+    """
+
+    def __init__(self, idade_maxima: int = LSA_IDADE_MAXIMA, maximo: int = LSDB_MAXIMO, retencao: float = 60.0):
         self.lsas: Dict[str, LSA] = {}
+        self.alterados: set = set() # IDs de LSAs alterados desde o último exportar()
+        self.expirados: set = set() # IDs com idade máxima, fora do SPF
+        self.por_prefixo: Dict[str, Tuple[str, ...]] = {} # Sub-rede -> IDs que a anunciam (só LSAs do SPF)
+        self.geracao = 0   # Mudanças no conteúdo do SPF
+        self.impressao = 0 # XOR das assinaturas dos LSAs do SPF
+        self.idade_maxima = idade_maxima
+        self.maximo = maximo
+        self.retencao = retencao
+        self.lock = threading.Lock()
+        self.contadores = {
+            "instalados": 0,
+            "substituidos": 0,
+            "expirados": 0,           # Chegaram à idade máxima aqui
+            "retirados": 0,           # Chegaram já com a idade máxima (envelhecimento prematuro)
+            "removidos": 0,
+            "descartados_limite": 0,
+        }
 
     def atualizar_lsa(self, lsa: LSA):
-        if lsa.id not in self.lsas or lsa.seq > self.lsas[lsa.id].seq:
+        with self.lock:
+            atual = self.lsas.get(lsa.id)
+            if atual is not None and lsa.seq <= atual.seq:
+                return False
+            if atual is None:
+                if len(self.lsas) >= self.maximo:
+                    self.contadores["descartados_limite"] += 1
+                    log("lsa", "LSDB cheio (%d LSAs): LSA de %s descartado", len(self.lsas), lsa.id, nivel=AVISO)
+                    return False
+                self.contadores["instalados"] += 1
+            else:
+                self.contadores["substituidos"] += 1
+            anterior = atual.assinatura if atual is not None and atual.id not in self.expirados else None
+            if anterior is not None:
+                self.desindexar(atual)
             self.lsas[lsa.id] = lsa
-            log("lsa", f"Atualizou LSA de {lsa.id}, seq={lsa.seq}", ROTEADOR_NAME)
+            if lsa.idade >= self.idade_maxima:
+                self.expirados.add(lsa.id)
+                self.contadores["retirados"] += 1
+                nova = None
+            else:
+                self.expirados.discard(lsa.id)
+                self.indexar(lsa)
+                nova = lsa.assinatura
+            if nova != anterior:
+                self.impressao ^= (anterior or 0) ^ (nova or 0)
+                self.geracao += 1
+                self.alterados.add(lsa.id)
+            log("lsa", "Atualizou LSA de %s, seq=%s", lsa.id, lsa.seq, nivel=DEBUG)
             return True
-        return False
 
-class NetworkInterface:
-    @staticmethod
-    def get_connected_subnets() -> set:
-        """Retorna APENAS a sub-rede local principal do roteador."""
-        subnets = set()
-        my_main_ip = ROTEADOR_IP # IP principal do roteador
-        log("subnets_debug", f"[get_subnets] Iniciando busca pela sub-rede de {my_main_ip}", ROTEADOR_NAME)
+    def envelhecer(self) -> List[str]:
+        """Tira do SPF os LSAs que chegaram à idade máxima e apaga os retidos há mais de `retencao`. Retorna os que expiraram agora."""
+        agora = time.monotonic()
+        expirados = []
+        with self.lock:
+            for id, lsa in list(self.lsas.items()):
+                idade = lsa.idade + (agora - lsa.recebido_em)
+                # Sai do SPF antes de ser apagado, mesmo se passou da retenção entre duas chamadas
+                if idade >= self.idade_maxima and id not in self.expirados:
+                    self.expirados.add(id)
+                    self.desindexar(lsa)
+                    self.impressao ^= lsa.assinatura
+                    self.geracao += 1
+                    self.alterados.add(id)
+                    self.contadores["expirados"] += 1
+                    expirados.append(id)
+                if idade >= self.idade_maxima + self.retencao:
+                    del self.lsas[id]
+                    self.expirados.discard(id)
+                    self.contadores["removidos"] += 1
+        return expirados
+
+    def indexar(self, lsa: LSA):
+        for subnet in lsa.subnets:
+            self.por_prefixo[subnet] = self.por_prefixo.get(subnet, ()) + (lsa.id,)
+
+    def desindexar(self, lsa: LSA):
+        for subnet in lsa.subnets:
+            ids = tuple(id for id in self.por_prefixo.get(subnet, ()) if id != lsa.id)
+            if ids:
+                self.por_prefixo[subnet] = ids
+            else:
+                self.por_prefixo.pop(subnet, None)
+
+    def prefixos(self) -> Dict[str, Tuple[str, ...]]:
+        """Cópia do índice por prefixo: sub-rede -> IDs dos roteadores que a anunciam."""
+        with self.lock:
+            return dict(self.por_prefixo)
+
+    def conhecido(self, id: str, seq: int) -> bool:
+        """True se o LSDB já tem um LSA de id com sequência igual ou maior (cópia antiga ou repetida)."""
+        lsa = self.lsas.get(id) # Leitura sem lock: um get no dicionário é atômico
+        return lsa is not None and seq <= lsa.seq
+
+    def resumo(self) -> List[List]:
+        """Pares [id, seq] dos LSAs que entram no SPF, para a troca de LSDB com um vizinho."""
+        with self.lock:
+            return [[lsa.id, lsa.seq] for lsa in self.lsas.values() if lsa.id not in self.expirados]
+
+    def exportar(self) -> Tuple[Dict[str, LSA], set, int, int]:
+        """
+        Retorna os LSAs que entram no SPF, os IDs alterados desde a última exportação
+        e a geração e a impressão correspondentes. Os próprios LSAs vão para o SPF,
+        sem cópia: um LSA nunca muda depois de instalado (uma versão nova é outro objeto).
+        """
+        with self.lock:
+            if self.expirados:
+                lsas = {id: lsa for id, lsa in self.lsas.items() if id not in self.expirados}
+            else:
+                lsas = dict(self.lsas)
+            alterados, self.alterados = self.alterados, set()
+            return lsas, alterados, self.geracao, self.impressao
+
+    def estado(self) -> Dict:
+        with self.lock:
+            return {"lsas": len(self.lsas), "expirados_retidos": len(self.expirados), "maximo": self.maximo, "geracao": self.geracao,
+                    **self.contadores}
+
+class Area:
+    """
+    Estado de uma área: LSDB próprio e SPF só sobre os roteadores dela.
+
+    LSAs são inundados só dentro da área em que foram originados. Prefixos de outras
+    áreas chegam nos resumos dos roteadores de borda (ABR), que não entram no grafo
+    do SPF: a rota para um prefixo resumido sai pelo caminho até o ABR que o anuncia
+    (ver Router.calcular_rotas_entre_areas).
+    """
+
+    def __init__(self, id: str, spf: Union[SPFIncremental, SPFRemoto]):
+        self.id = id
+        self.lsdb = LSDB()
+        self.spf = spf
+        self.lsdb_spf: Dict[str, LSA] = {} # LSAs da última execução do SPF
+        self.geracao_spf: Optional[int] = None   # Geração do LSDB na última execução do SPF
+        self.impressao_spf: Optional[int] = None # Impressão do LSDB na última execução do SPF
+        self.resumos: Dict[str, int] = {} # Prefixos de outras áreas anunciados nesta (só em ABRs)
+        self.originado: Optional[tuple] = None # Conteúdo do último LSA originado nesta área
+
+    def estado(self) -> Dict:
+        return {"lsdb": self.lsdb.estado(), "resumos": len(self.resumos), "spf": self.spf.execucoes}
+
+
+class SubredesConectadas:
+    """
+    Cache das sub-redes diretamente conectadas ao roteador.
+
+    As interfaces só são varridas (netifaces) quando o cache é invalidado, pelas
+    notificações de interface/endereço do kernel (ver Router.monitorar_rotas), ou
+    depois de `validade` segundos, para o caso de o netlink não estar disponível.
+    A varredura compara os endereços encontrados com os da anterior e só recalcula
+    as sub-redes (e registra os logs) quando eles mudaram.
+    """
+
+    def __init__(self, ip_principal: str, anunciar_todas: bool = False, validade: float = 30.0):
+        self.ip_principal = ip_principal
+        self.anunciar_todas = anunciar_todas
+        self.validade = validade
+        self.lock = threading.Lock()
+        self.enderecos: Optional[frozenset] = None # (interface, ip, máscara) da última varredura
+        self.todas: frozenset = frozenset()
+        self.principal: frozenset = frozenset()
+        self.enderecos_locais: Dict[str, str] = {} # Sub-rede -> nosso endereço nela
+        self.invalido = True
+        self.ultima_varredura = 0.0
+        self.varreduras = 0
+
+    def invalidar(self):
+        self.invalido = True
+
+    def atualizar(self) -> bool:
+        """Varre as interfaces se o cache estiver inválido ou vencido. Retorna True se as sub-redes mudaram."""
+        with self.lock:
+            agora = time.monotonic()
+            if not self.invalido and agora - self.ultima_varredura < self.validade:
+                return False
+            self.invalido = False # Antes da varredura: uma invalidação durante ela não se perde
+            self.ultima_varredura = agora
+            self.varreduras += 1
+            enderecos = self.varrer()
+            if enderecos == self.enderecos:
+                return False
+            self.enderecos = enderecos
+            todas, principal, locais = self.calcular_subredes(enderecos)
+            mudou = todas != self.todas or principal != self.principal
+            self.todas, self.principal, self.enderecos_locais = todas, principal, locais
+        if mudou:
+            log("subnets", f"Sub-redes conectadas: {sorted(todas)} (principal: {sorted(principal)})")
+        return mudou
+
+    def varrer(self) -> frozenset:
+        enderecos = set()
         for iface in netifaces.interfaces():
-            log("subnets_debug", f"[get_subnets] Verificando interface: {iface}", ROTEADOR_NAME)
-            addrs = netifaces.ifaddresses(iface)
-            if netifaces.AF_INET in addrs:
-                for addr in addrs[netifaces.AF_INET]:
-                    ip = addr.get("addr")
-                    mask = addr.get("netmask")
-                    log("subnets_debug", f"[get_subnets]   - Encontrado IP: {ip}, Máscara: {mask}", ROTEADOR_NAME)
-                    if ip == my_main_ip:
-                        log("subnets_debug", f"[get_subnets]   - IP {ip} corresponde ao IP principal!", ROTEADOR_NAME)
-                        # Ignora loopback e endereços link-local (redundante, mas seguro)
-                        if ip.startswith("127.") or ip.startswith("169.254."):
-                            log("subnets_debug", f"[get_subnets]   - Ignorando IP de loopback/link-local.", ROTEADOR_NAME)
-                            continue
-                        if not mask:
-                            log("erros", f"[get_subnets] IP principal {ip} encontrado sem máscara na interface {iface}. Pulando.", ROTEADOR_NAME)
-                            continue
-                        try:
-                            # Calcula a rede usando o IP principal e sua máscara
-                            subnet = ipaddress.ip_network(f"{ip}/{mask}", strict=False)
-                            subnet_str = str(subnet)
-                            log("subnets_debug", f"[get_subnets]   - Sub-rede calculada: {subnet_str}", ROTEADOR_NAME)
-                            subnets.add(subnet_str)
-                            # Encontrou a sub-rede principal, pode parar a busca
-                            log("subnets_debug", f"[get_subnets] Sub-rede principal {subnet_str} encontrada e adicionada. Finalizando busca.", ROTEADOR_NAME)
-                            return subnets
-                        except ValueError:
-                            log("erros", f"[get_subnets] Endereço IP/Máscara inválido encontrado para IP principal: {ip}/{mask}", ROTEADOR_NAME)
-                        except Exception as e:
-                            log("erros", f"[get_subnets] Erro inesperado ao calcular sub-rede para {ip}/{mask}: {e}", ROTEADOR_NAME)
-                    # else: # Log opcional para IPs que não são o principal
-                    #    log("subnets_debug", f"[get_subnets]   - IP {ip} não é o principal ({my_main_ip}). Ignorando.", ROTEADOR_NAME)
-
-        if not subnets:
-            log("erros", f"[get_subnets] ATENÇÃO: Nenhuma sub-rede correspondente ao IP principal {my_main_ip} foi encontrada! Retornando conjunto vazio.", ROTEADOR_NAME)
-        return subnets
+            for addr in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+                ip = addr.get("addr")
+                mask = addr.get("netmask")
+                log("subnets_debug", "[get_subnets] Interface %s: IP %s, Máscara %s", iface, ip, mask)
+                # Ignora loopback e endereços link-local
+                if not ip or ip.startswith("127.") or ip.startswith("169.254."):
+                    continue
+                if not mask:
+                    log("erros", f"[get_subnets] IP {ip} encontrado sem máscara na interface {iface}. Pulando.")
+                    continue
+                enderecos.add((iface, ip, mask))
+        return frozenset(enderecos)
 
+    def calcular_subredes(self, enderecos: frozenset) -> Tuple[frozenset, frozenset, Dict[str, str]]:
+        todas, principal, locais = set(), set(), {}
+        for iface, ip, mask in enderecos:
+            try:
+                subnet = str(ipaddress.ip_network(f"{ip}/{mask}", strict=False))
+            except ValueError:
+                log("erros", f"[get_subnets] Endereço IP/Máscara inválido na interface {iface}: {ip}/{mask}")
+                continue
+            todas.add(subnet)
+            locais[subnet] = ip
+            if ip == self.ip_principal:
+                principal.add(subnet)
+        if not principal:
+            log("erros", f"[get_subnets] ATENÇÃO: Nenhuma sub-rede correspondente ao IP principal {self.ip_principal} foi encontrada!")
+        return frozenset(todas), frozenset(principal), locais
+
+    def conectadas(self) -> frozenset:
+        """Todas as sub-redes das interfaces do roteador (nunca recebem rotas via gateway)."""
+        self.atualizar()
+        return self.todas
+
+    def locais(self) -> Dict[str, str]:
+        """Nosso endereço em cada sub-rede conectada."""
+        self.atualizar()
+        return self.enderecos_locais
+
+    def anunciadas(self) -> frozenset:
+        """Sub-redes anunciadas no LSA: só a principal ou todas, conforme anunciar_subredes."""
+        self.atualizar()
+        return self.todas if self.anunciar_todas else self.principal
+
+    def estado(self) -> Dict:
+        return {"conectadas": len(self.todas), "anunciadas": len(self.todas if self.anunciar_todas else self.principal),
+                "varreduras": self.varreduras}
+
+
+class NetworkInterface:
     @staticmethod
-    def obter_rotas_existentes(rotas_calculadas: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
+    def obter_rotas_existentes(backend: fib.BackendFIB, rotas_calculadas: Dict[str, ProximosSaltos], connected_subnets: frozenset,
+                               destinos: Optional[set] = None) -> Tuple[Dict[str, ProximosSaltos], Dict[str, ProximosSaltos], Dict[str, ProximosSaltos]]:
+        """
+        Compara as rotas calculadas com as da FIB e separa o que adicionar, remover e substituir.
+        Sub-redes de qualquer interface do roteador (connected_subnets) nunca recebem rota via
+        gateway, para não substituir a rota conectada do kernel. Se destinos for informado, só
+        essas sub-redes são comparadas (cálculo parcial de rotas).
+        """
         rotas_existentes_kernel = {}
         rotas_adicionar = {}
         rotas_remover = {}
         rotas_substituir = {}
-        connected_subnets = NetworkInterface.get_connected_subnets()
-        log("rotas_debug", f"Sub-redes conectadas: {connected_subnets}", ROTEADOR_NAME)
-        log("rotas_debug", f"Rotas calculadas por Dijkstra (válidas): {rotas_calculadas}", ROTEADOR_NAME)
+        log("rotas_debug", "Sub-redes conectadas: %s", connected_subnets)
+        log("rotas_debug", "Rotas calculadas por Dijkstra (válidas): %s", rotas_calculadas)
 
-        # 1. Obter rotas atuais do kernel
+        # 1. Obter rotas atuais do kernel (o backend já ignora default, conectadas e link local)
         try:
-            resultado = subprocess.run(
-                ["ip", "route", "show"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            for linha in resultado.stdout.splitlines():
-                partes = linha.split()
-                # Ignora rotas default, rotas diretamente conectadas (sem 'via'), rotas de link local
-                if partes[0] == "default" or "via" not in partes or partes[0].startswith("169.254"):
+            for rede, proximos_saltos in backend.listar().items():
+                if destinos is not None and rede not in destinos:
                     continue
-                rede = partes[0]
-                proximo_salto = partes[partes.index("via") + 1]
-                rotas_existentes_kernel[rede] = proximo_salto
-            log("rotas_debug", f"Rotas existentes no kernel (filtradas): {rotas_existentes_kernel}", ROTEADOR_NAME)
+                rotas_existentes_kernel[rede] = proximos_saltos
+            log("rotas_debug", "Rotas existentes no kernel (filtradas): %s", rotas_existentes_kernel)
         except Exception as e:
-            log("erros", f"Erro ao obter rotas existentes do kernel: {e}", ROTEADOR_NAME)
+            log("erros", f"Erro ao obter rotas existentes do kernel: {e}")
             return {}, {}, {}
 
         # 2. Comparar rotas calculadas com as existentes
         for destino_calc, prox_salto_calc in rotas_calculadas.items():
+            if destinos is not None and destino_calc not in destinos:
+                continue
             # Ignora rotas para sub-redes diretamente conectadas
             if destino_calc in connected_subnets:
-                log("rotas_debug", f"Ignorando rota calculada para sub-rede conectada: {destino_calc}", ROTEADOR_NAME)
+                log("rotas_debug", "Ignorando rota calculada para sub-rede conectada: %s", destino_calc)
                 continue
 
             if destino_calc in rotas_existentes_kernel:
@@ -190,294 +755,1603 @@ class NetworkInterface:
                 if prox_salto_kernel != prox_salto_calc:
                     # Rota existe, mas próximo salto é diferente -> Substituir
                     rotas_substituir[destino_calc] = prox_salto_calc
-                    log("rotas_debug", f"Marcando para SUBSTITUIR: {destino_calc} via {prox_salto_calc} (era via {prox_salto_kernel})", ROTEADOR_NAME)
+                    log("rotas_debug", "Marcando para SUBSTITUIR: %s via %s (era via %s)", destino_calc, prox_salto_calc, prox_salto_kernel)
                 # else: Rota já existe e está correta -> Não fazer nada
-                #    log("rotas_debug", f"Rota para {destino_calc} via {prox_salto_calc} já existe e está correta.", ROTEADOR_NAME)
+                #    log("rotas_debug", f"Rota para {destino_calc} via {prox_salto_calc} já existe e está correta.")
             else:
                 # Rota não existe no kernel -> Adicionar
                 rotas_adicionar[destino_calc] = prox_salto_calc
-                log("rotas_debug", f"Marcando para ADICIONAR: {destino_calc} via {prox_salto_calc}", ROTEADOR_NAME)
+                log("rotas_debug", "Marcando para ADICIONAR: %s via %s", destino_calc, prox_salto_calc)
 
         # 3. Identificar rotas a remover (existem no kernel, mas não nas calculadas)
         for destino_kernel, prox_salto_kernel in rotas_existentes_kernel.items():
-            if destino_kernel not in rotas_calculadas:
-                # Rota existe no kernel, mas não foi calculada (e não é conectada) -> Remover
-                if destino_kernel not in connected_subnets:
-                     rotas_remover[destino_kernel] = prox_salto_kernel # Guardamos o prox_salto só por log
-                     log("rotas_debug", f"Marcando para REMOVER: {destino_kernel} via {prox_salto_kernel} (não calculada)", ROTEADOR_NAME)
+            if destino_kernel not in rotas_calculadas or destino_kernel in connected_subnets:
+                # Rota nossa no kernel, mas não foi calculada ou a sub-rede passou a ser conectada -> Remover
+                # (a remoção casa só rotas do nosso protocolo, a rota conectada do kernel fica)
+                rotas_remover[destino_kernel] = prox_salto_kernel # Guardamos o prox_salto só por log
+                log("rotas_debug", "Marcando para REMOVER: %s via %s (não calculada ou conectada)", destino_kernel, prox_salto_kernel)
 
         return rotas_adicionar, rotas_remover, rotas_substituir
 
     @staticmethod
-    def adicionar_interface(destino: str, proximo_salto: str) -> bool:
-        comando = ["ip", "route", "add", destino, "via", proximo_salto]
-        log("rotas_cmd", f"Executando comando: {' '.join(comando)}", ROTEADOR_NAME) # LOG ADICIONADO
+    def aplicar_rotas(fib_sombra: fib.FIBSombra, rotas_adicionar: Dict[str, ProximosSaltos], rotas_remover: Dict[str, ProximosSaltos],
+                      rotas_substituir: Dict[str, ProximosSaltos], caiu_em: Callable[[str], Optional[float]]) -> Tuple[int, Dict[str, float]]:
+        """
+        Aplica as mudanças de um recálculo numa transação make-before-break (ver fib.FIBSombra.transacao).
+        Vão primeiro as substituições de prefixos com algum próximo salto caído (estão descartando
+        tráfego agora), depois as demais substituições (prefixos em uso), depois as adições e só
+        então as remoções. Retorna o número de rotas com erro e, para cada prefixo que ficou sem
+        caminho válido, quantos segundos se passaram entre a queda do próximo salto e a rota nova.
+        """
+        def queda(saltos: Optional[ProximosSaltos]) -> Optional[float]:
+            quedas = [instante for instante in map(caiu_em, saltos or ()) if instante is not None]
+            return min(quedas) if quedas else None
+
+        anteriores = fib_sombra.listar() if rotas_substituir else {}
+        substituir = sorted(rotas_substituir.items(), key=lambda item: queda(anteriores.get(item[0])) is None)
+        operacoes = [("replace", destino, proximos_saltos) for destino, proximos_saltos in substituir]
+        operacoes += [("add", destino, proximos_saltos) for destino, proximos_saltos in rotas_adicionar.items()]
+        operacoes += [("del", destino, None) for destino in rotas_remover]
+        if not operacoes:
+            return 0, {}
+        log("rotas_cmd", "Aplicando transação de %d operação(ões): %s", len(operacoes), operacoes, nivel=DEBUG)
         try:
-            resultado = subprocess.run(
-                comando,
-                check=True,
-                capture_output=True, # Captura stdout/stderr
-                text=True # Decodifica stdout/stderr
-            )
-            log("rotas", f"Rota adicionada: {destino} via {proximo_salto}", ROTEADOR_NAME)
-            return True
-        except subprocess.CalledProcessError as e:
-            # Log mais detalhado do erro
-            log("erros", f"Erro ao adicionar rota {destino} via {proximo_salto}. Comando: {' '.join(comando)}. Erro: {e.stderr.strip()}", ROTEADOR_NAME)
-            return False
+            transacao = fib_sombra.transacao(operacoes, FIB_REPETICOES, FIB_TRANSACAO == "atomica")
         except Exception as e:
-            log("erros", f"Erro inesperado ao adicionar rota {destino} via {proximo_salto}: {e}", ROTEADOR_NAME)
-            return False
+            log("erros", f"Erro inesperado ao aplicar transação de {len(operacoes)} rota(s) na FIB: {e}")
+            return len(operacoes), {}
+
+        erros = 0
+        descricoes = {"add": ("adicionar", "adicionada"), "del": ("remover", "removida"), "replace": ("substituir/adicionar", "substituída/adicionada")}
+        for (acao, destino, proximos_saltos), erro in zip(operacoes, transacao.resultados):
+            verbo, participio = descricoes[acao]
+            via = f" via {fib.formatar_saltos(proximos_saltos)}" if proximos_saltos else ""
+            if erro is None:
+                log("rotas", f"Rota {participio}: {destino}{via}")
+            else:
+                erros += 1
+                log("erros", f"Erro ao {verbo} rota {destino}{via}. Erro: {erro}")
+        if transacao.tentativas or transacao.revertida:
+            log("rotas", f"Transação com {transacao.tentativas} repetição(ões){', REVERTIDA' if transacao.revertida else ''}")
+
+        # Janela sem rota: da queda do próximo salto antigo até o ack da rota nova
+        janelas = {}
+        for destino, instalada_em in transacao.instaladas_em.items():
+            instante = queda(transacao.anteriores.get(destino))
+            if instante is not None and instante <= instalada_em:
+                janelas[destino] = instalada_em - instante
+        if janelas:
+            log("rotas", "Janela sem rota por prefixo (ms): %s",
+                lambda: {destino: round(janela * 1000, 1) for destino, janela in sorted(janelas.items(), key=lambda item: -item[1])})
+        log("rotas", "Transação de %d operação(ões) em %.1f ms", len(operacoes), transacao.duracao * 1000, nivel=DEBUG)
+        return erros, janelas
 
     @staticmethod
-    def remover_interfaces(destino: str) -> bool:
-        comando = ["ip", "route", "del", destino]
-        log("rotas_cmd", f"Executando comando: {' '.join(comando)}", ROTEADOR_NAME) # LOG ADICIONADO
+    def salvar_lsdb_rotas_arquivo(lsdb: Dict[str, Dict], rotas: Dict[str, ProximosSaltos]):
         try:
-            resultado = subprocess.run(
-                comando,
-                check=True,
-                capture_output=True, # Captura stdout/stderr
-                text=True # Decodifica stdout/stderr
-            )
-            log("rotas", f"Rota removida: {destino}", ROTEADOR_NAME)
-            return True
-        except subprocess.CalledProcessError as e:
-            # Log mais detalhado do erro, verifica se a rota já não existe
-            if "No such process" in e.stderr or "Network is unreachable" in e.stderr or "Cannot find device" in e.stderr:
-                 log("rotas_debug", f"Tentativa de remover rota inexistente {destino}. Ignorando erro.", ROTEADOR_NAME)
-                 return True # Considera sucesso se a rota já não existe
-            log("erros", f"Erro ao remover rota {destino}. Comando: {' '.join(comando)}. Erro: {e.stderr.strip()}", ROTEADOR_NAME)
-            return False
+            with open(f"{LOG_BASE_DIR}/lsdb_latest.json", "w") as f:
+                json.dump(lsdb, f, indent=4)
+            with open(f"{LOG_BASE_DIR}/rotas_latest.json", "w") as f:
+                json.dump(rotas, f, indent=4)
+            # log("rotas", "LSDB e rotas salvos em arquivos JSON")
         except Exception as e:
-            log("erros", f"Erro inesperado ao remover rota {destino}: {e}", ROTEADOR_NAME)
-            return False
+            log("erros", f"Erro ao salvar LSDB/rotas em JSON: {e}")
 
-    @staticmethod
-    def replase_interface(destino: str, proximo_salto: str) -> bool:
-        comando = ["ip", "route", "replace", destino, "via", proximo_salto]
-        log("rotas_cmd", f"Executando comando: {' '.join(comando)}", ROTEADOR_NAME) # LOG ADICIONADO
+class AgendadorSPF:
+    """
+    Agenda o recálculo de rotas com atraso inicial, hold-down e backoff exponencial.
+
+    A primeira mudança após um período calmo dispara o SPF depois de atraso_inicial.
+    Mudanças seguintes esperam pelo menos espera_atual desde a última execução, e
+    espera_atual dobra a cada execução até espera_maxima. Sem mudanças por
+    2 * espera_maxima, o backoff volta ao início. Qualquer quantidade de mudanças
+    dentro da janela resulta em uma única execução (SPF + atualização da FIB).
+    """
+
+    def __init__(self, executar: Callable[[], None], atraso_inicial: float, espera_minima: float, espera_maxima: float):
+        self.executar = executar
+        self.atraso_inicial = atraso_inicial
+        self.espera_minima = espera_minima
+        self.espera_maxima = espera_maxima
+        self.espera_atual = espera_minima
+        self.pendente = False
+        self.prazo: Optional[float] = None           # time.monotonic() da próxima execução
+        self.ultima_execucao: Optional[float] = None
+        self.duracao_ultima_execucao = 0.0
+        self.mudancas_pendentes = 0                  # Mudanças agrupadas na janela atual
+        self.mudancas_agrupadas = 0                  # Total de mudanças absorvidas por uma execução já agendada
+        self.execucoes = 0
+        self.backoff_reiniciado = True
+        self.cond = threading.Condition()
+
+    def agendar(self):
+        """Registra uma mudança no LSDB; agenda o SPF se ainda não houver execução pendente."""
+        with self.cond:
+            self.mudancas_pendentes += 1
+            if self.pendente:
+                self.mudancas_agrupadas += 1
+                return
+            self.pendente = True
+            self.prazo = self.calcular_prazo(time.monotonic())
+            self.notificar()
+
+    def notificar(self):
+        """Avisa o driver do agendador que há um novo prazo (chamado com o lock adquirido)."""
+        self.cond.notify()
+
+    def calcular_prazo(self, agora: float) -> float:
+        if self.ultima_execucao is None or agora - self.ultima_execucao >= 2 * self.espera_maxima:
+            # Rede estava calma: reinicia o backoff e usa só o atraso inicial
+            self.espera_atual = self.espera_minima
+            self.backoff_reiniciado = True
+            return agora + self.atraso_inicial
+        self.backoff_reiniciado = False
+        return max(agora + self.atraso_inicial, self.ultima_execucao + self.espera_atual)
+
+    def iniciar_execucao(self, agora: float):
+        """Consome a janela pendente; novas mudanças a partir daqui agendam outra execução."""
+        self.pendente = False
+        self.prazo = None
+        self.mudancas_pendentes = 0
+        if not self.backoff_reiniciado:
+            self.espera_atual = min(self.espera_atual * 2, self.espera_maxima)
+        self.ultima_execucao = agora
+
+    def estado(self) -> Dict:
+        with self.cond:
+            agora = time.monotonic()
+            return {
+                "pendente": self.pendente,
+                "executa_em_s": round(self.prazo - agora, 3) if self.prazo is not None else None,
+                "mudancas_pendentes": self.mudancas_pendentes,
+                "ultima_execucao_ha_s": round(agora - self.ultima_execucao, 3) if self.ultima_execucao is not None else None,
+                "duracao_ultima_execucao_s": round(self.duracao_ultima_execucao, 4),
+                "espera_atual_s": self.espera_atual,
+                "execucoes": self.execucoes,
+                "mudancas_agrupadas": self.mudancas_agrupadas,
+                "config": {
+                    "atraso_inicial_s": self.atraso_inicial,
+                    "espera_minima_s": self.espera_minima,
+                    "espera_maxima_s": self.espera_maxima,
+                },
+            }
+
+    def loop(self):
+        """Thread que espera o prazo e executa o SPF fora do lock do agendador."""
+        while True:
+            with self.cond:
+                while not self.pendente or time.monotonic() < self.prazo:
+                    self.cond.wait(None if not self.pendente else self.prazo - time.monotonic())
+                self.iniciar_execucao(time.monotonic())
+            inicio = time.monotonic()
+            try:
+                self.executar()
+            except Exception as e:
+                log("erros", f"Erro na execução agendada do SPF: {e}")
+            self.finalizar_execucao(inicio)
+            self.salvar_estado()
+
+    def finalizar_execucao(self, inicio: float):
+        with self.cond:
+            self.execucoes += 1
+            self.duracao_ultima_execucao = time.monotonic() - inicio
+
+    def salvar_estado(self):
+        estado = self.estado()
+        log("spf", f"SPF executado em {estado['duracao_ultima_execucao_s']}s, próxima espera mínima {estado['espera_atual_s']}s, "
+                   f"mudanças agrupadas até agora: {estado['mudancas_agrupadas']}")
         try:
-            resultado = subprocess.run(
-                comando,
-                check=True,
-                capture_output=True, # Captura stdout/stderr
-                text=True # Decodifica stdout/stderr
-            )
-            log("rotas", f"Rota substituída/adicionada: {destino} via {proximo_salto}", ROTEADOR_NAME)
+            with open(f"{LOG_BASE_DIR}/spf_agendador.json", "w") as f:
+                json.dump(estado, f, indent=4)
+        except Exception as e:
+            log("erros", f"Erro ao salvar estado do agendador do SPF: {e}")
+
+
+class AgendadorSPFAsyncio(AgendadorSPF):
+    """
+    Mesma política do AgendadorSPF, com o prazo controlado por um timer do event loop.
+    O recálculo (que chama o `ip route`) roda no executor para não bloquear o loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *args):
+        super().__init__(*args)
+        self.loop = loop
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.executando = False
+
+    def notificar(self):
+        self.timer = self.loop.call_later(max(0.0, self.prazo - time.monotonic()), self.disparar)
+
+    def disparar(self):
+        self.timer = None
+        if self.executando:
+            return # _executar reagenda ao terminar
+        with self.cond:
+            self.iniciar_execucao(time.monotonic())
+        self.executando = True
+        self.loop.create_task(self._executar())
+
+    async def _executar(self):
+        inicio = time.monotonic()
+        try:
+            await self.loop.run_in_executor(None, self.executar)
+        except Exception as e:
+            log("erros", f"Erro na execução agendada do SPF: {e}")
+        self.finalizar_execucao(inicio)
+        self.executando = False
+        await self.loop.run_in_executor(None, self.salvar_estado)
+        if self.pendente and self.timer is None:
+            self.notificar() # Mudanças chegaram durante a execução e o prazo já venceu
+
+
+class FilaIngestaoLSA:
+    """
+    Fila limitada de LSAs recebidos, consumida por um número fixo de workers.
+
+    A fila guarda no máximo um LSA por área e roteador de origem: se chega uma cópia mais
+    nova de um LSA que ainda não foi processado, ela substitui a antiga no mesmo
+    lugar da fila; cópias mais antigas ou repetidas são descartadas. Com a fila
+    cheia, o pacote novo é descartado e contabilizado.
+    """
+
+    def __init__(self, processar: Callable, capacidade: int, num_workers: int):
+        self.processar = processar
+        self.capacidade = capacidade
+        self.num_workers = num_workers
+        self.pendentes: "OrderedDict[Tuple[str, str], Tuple[int, tuple]]" = OrderedDict() # (área, id de origem) -> (seq, args)
+        self.cond = threading.Condition()
+        self.contadores = {
+            "recebidos": 0,
+            "processados": 0,
+            "substituidos": 0,           # Cópia mais nova substituiu uma pendente
+            "descartados_obsoletos": 0,  # Cópia igual ou mais antiga que a pendente
+            "descartados_fila_cheia": 0,
+            "descartados_lsdb": 0,       # Já conhecido no LSDB, descartado só pelo cabeçalho
+            "erros": 0,
+        }
+
+    def registrar_descarte(self, motivo: str):
+        """Conta um pacote descartado antes de chegar à fila."""
+        with self.cond:
+            self.contadores["recebidos"] += 1
+            self.contadores[motivo] += 1
+
+    def enfileirar(self, chave: Tuple[str, str], seq: int, *args) -> bool:
+        with self.cond:
+            self.contadores["recebidos"] += 1
+            pendente = self.pendentes.get(chave)
+            if pendente is not None:
+                if seq <= pendente[0]:
+                    self.contadores["descartados_obsoletos"] += 1
+                    return False
+                self.pendentes[chave] = (seq, args)
+                self.contadores["substituidos"] += 1
+                return True
+            if len(self.pendentes) >= self.capacidade:
+                self.contadores["descartados_fila_cheia"] += 1
+                return False
+            self.pendentes[chave] = (seq, args)
+            self.cond.notify()
             return True
-        except subprocess.CalledProcessError as e:
-            # Log mais detalhado do erro
-            log("erros", f"Erro ao substituir/adicionar rota {destino} via {proximo_salto}. Comando: {' '.join(comando)}. Erro: {e.stderr.strip()}", ROTEADOR_NAME)
-            return False
+
+    def processar_proximo(self) -> bool:
+        """Processa o LSA pendente mais antigo. Retorna False se a fila estiver vazia."""
+        with self.cond:
+            if not self.pendentes:
+                return False
+            _, (_, args) = self.pendentes.popitem(last=False)
+        try:
+            self.processar(*args)
         except Exception as e:
-            log("erros", f"Erro inesperado ao substituir/adicionar rota {destino} via {proximo_salto}: {e}", ROTEADOR_NAME)
+            log("erros", f"Erro ao processar LSA da fila de ingestão: {e}")
+            with self.cond:
+                self.contadores["erros"] += 1
+        with self.cond:
+            self.contadores["processados"] += 1
+        return True
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.pendentes:
+                    self.cond.wait()
+            self.processar_proximo()
+
+    def iniciar(self):
+        for i in range(self.num_workers):
+            threading.Thread(target=self.worker, daemon=True, name=f"ingestao_lsa_{i}").start()
+
+    def estado(self) -> Dict:
+        with self.cond:
+            return {
+                "pendentes": len(self.pendentes),
+                "capacidade": self.capacidade,
+                "workers": self.num_workers,
+                **self.contadores,
+            }
+
+
+class EleicaoDR:
+    """
+    Eleição de DR e BDR nos segmentos multiacesso, como no OSPF.
+
+    Um segmento é uma sub-rede conectada com dois ou mais vizinhos UP: numa LAN
+    com N roteadores, sincronizar e inundar com todos os pares seria O(N²). O DR
+    e o BDR são os dois maiores (prioridade, IP) entre os membros e o próprio
+    roteador; prioridade 0 nunca é eleita. A eleição é determinística (um
+    roteador de prioridade maior que chega assume o DR), então todos os membros
+    chegam ao mesmo resultado assim que tiverem a mesma visão do segmento.
+
+    Só há adjacência completa (troca de LSDB e inundação) com o DR e o BDR; eles
+    têm adjacência completa com todos os membros. O estado é trocado por inteiro
+    a cada eleição, então as consultas não precisam de lock.
+    """
+
+    def __init__(self, meu_ip: str, prioridade: int):
+        self.meu_ip = meu_ip
+        self.prioridade = prioridade
+        self.segmentos: Dict[str, Tuple[List[str], Tuple[Optional[str], Optional[str]]]] = {} # Sub-rede -> (membros, (DR, BDR))
+        self.eleicoes = 0
+
+    def eleger(self, locais: Dict[str, str], prioridades: Dict[str, int]) -> bool:
+        """Recalcula os segmentos a partir das sub-redes conectadas e dos vizinhos UP. Retorna True se algo mudou."""
+        segmentos = {}
+        for subnet in locais:
+            rede = ipaddress.ip_network(subnet)
+            membros = sorted(ip for ip in prioridades if ipaddress.ip_address(ip) in rede)
+            if len(membros) < 2:
+                continue # Enlace ponto a ponto: adjacência completa com o vizinho, sem eleição
+            candidatos = sorted(((prioridades[ip], ipaddress.ip_address(ip), ip) for ip in membros if prioridades[ip] > 0),
+                                reverse=True)
+            if self.prioridade > 0:
+                candidatos = sorted(candidatos + [(self.prioridade, ipaddress.ip_address(self.meu_ip), self.meu_ip)],
+                                    reverse=True)
+            eleitos = [ip for _, _, ip in candidatos[:2]] + [None, None]
+            segmentos[subnet] = (membros, (eleitos[0], eleitos[1]))
+        mudou = segmentos != self.segmentos
+        if mudou:
+            self.eleicoes += 1
+            self.segmentos = segmentos
+        return mudou
+
+    def adjacencia_completa(self, ip: str) -> bool:
+        """Troca de LSDB e inundação com o vizinho: fora de segmentos, ou se um dos dois é DR/BDR."""
+        for membros, designados in self.segmentos.values():
+            if ip in membros:
+                return self.meu_ip in designados or ip in designados
+        return True
+
+    def anuncio(self) -> Dict[str, List]:
+        """Resultado da eleição como vai nos Hellos: sub-rede -> [DR, BDR]."""
+        return {subnet: list(designados) for subnet, (_, designados) in self.segmentos.items()}
+
+    def estado(self) -> Dict:
+        return {"eleicoes": self.eleicoes,
+                "segmentos": {subnet: {"membros": len(membros), "dr": dr, "bdr": bdr}
+                              for subnet, (membros, (dr, bdr)) in self.segmentos.items()}}
+
+
+class InundacaoConfiavel:
+    """
+    Inundação confiável dos LSAs.
+
+    Todo LSA enviado a um vizinho entra na lista de retransmissão dele e é reenviado
+    a cada `retransmissao` segundos até ser confirmado, explicitamente (mensagem
+    "ack" com os pares [id, seq]) ou implicitamente (o vizinho nos manda a mesma
+    cópia ou uma mais nova). O reenvio usa a cópia atual do LSDB, pedida a
+    `transmitir`, que retorna a seq enviada ou None se o LSA não existe mais.
+
+    Quem recebe um LSA novo o confirma na hora. Cópias repetidas também são
+    confirmadas (o ack anterior pode ter se perdido), no máximo uma vez a cada
+    meia retransmissão por LSA, para os fragmentos de um mesmo reenvio não
+    gerarem um ack cada. A lista de um vizinho é descartada quando a adjacência cai.
+    """
+
+    LIMITE_ACKS_REPETIDOS = 4096
+
+    def __init__(self, meu_ip: str, enviar: Callable[[bytes, str], None], transmitir: Callable[[str, str], Optional[int]],
+                 retransmissao: float):
+        self.meu_ip = meu_ip
+        self.enviar = enviar
+        self.transmitir = transmitir
+        self.retransmissao = retransmissao
+        self.pendentes: Dict[str, Dict[str, List]] = {} # IP do vizinho -> {id de origem -> [seq, prazo do reenvio]}
+        self.acks_repetidos: Dict[Tuple[str, str], Tuple[int, float]] = {} # (vizinho, origem) -> (seq, instante)
+        self.lock = threading.Lock()
+        self.contadores = {
+            "enviados": 0,
+            "retransmitidos": 0,
+            "confirmados": 0,
+            "confirmados_implicitamente": 0,
+            "acks_enviados": 0,
+            "acks_recebidos": 0,
+        }
+
+    def registrar(self, ip: str, origem_id: str, seq: int):
+        """Coloca na lista de retransmissão do vizinho um LSA que acabou de ser enviado a ele."""
+        with self.lock:
+            self.pendentes.setdefault(ip, {})[origem_id] = [seq, time.monotonic() + self.retransmissao]
+            self.contadores["enviados"] += 1
+
+    def enviar_lsa(self, ip: str, origem_id: str) -> bool:
+        """Envia a cópia atual do LSA de origem_id ao vizinho e espera a confirmação."""
+        seq = self.transmitir(ip, origem_id)
+        if seq is None:
             return False
+        self.registrar(ip, origem_id, seq)
+        return True
 
-    @staticmethod
-    def salvar_lsdb_rotas_arquivo(lsdb: Dict[str, Dict], rotas: Dict[str, str]):
+    def responder_antigo(self, ip: str, origem_id: str, seq: int):
+        """O vizinho mandou uma cópia mais antiga que a nossa (seq): manda a nossa, se ainda não estiver a caminho."""
+        with self.lock:
+            item = self.pendentes.get(ip, {}).get(origem_id)
+            if item is not None and item[0] >= seq:
+                return
+        self.enviar_lsa(ip, origem_id)
+
+    def recebido(self, ip: str, origem_id: str, seq: int):
+        """O vizinho nos mandou (origem_id, seq): confirma as cópias iguais ou mais antigas enviadas a ele."""
+        with self.lock:
+            pendentes = self.pendentes.get(ip)
+            item = pendentes.get(origem_id) if pendentes else None
+            if item is not None and item[0] <= seq:
+                del pendentes[origem_id]
+                self.contadores["confirmados_implicitamente"] += 1
+
+    def confirmar(self, ip: str, origem_id: str, seq: int, repetido: bool = False):
+        if repetido:
+            agora = time.monotonic()
+            with self.lock:
+                anterior = self.acks_repetidos.get((ip, origem_id))
+                if anterior is not None and anterior[0] == seq and agora - anterior[1] < self.retransmissao / 2:
+                    return
+                if len(self.acks_repetidos) >= self.LIMITE_ACKS_REPETIDOS:
+                    self.acks_repetidos.clear()
+                self.acks_repetidos[(ip, origem_id)] = (seq, agora)
         try:
-            with open(f"{LOG_BASE_DIR}/lsdb_latest.json", "w") as f:
-                json.dump(lsdb, f, indent=4)
-            with open(f"{LOG_BASE_DIR}/rotas_latest.json", "w") as f:
-                json.dump(rotas, f, indent=4)
-            # log("rotas", "LSDB e rotas salvos em arquivos JSON", ROTEADOR_NAME)
+            self.enviar(json.dumps({"tipo": "ack", "id": self.meu_ip, "lsas": [[origem_id, seq]]}).encode(), ip)
         except Exception as e:
-            log("erros", f"Erro ao salvar LSDB/rotas em JSON: {e}", ROTEADOR_NAME)
+            log("erros", f"Erro ao enviar ack do LSA de {origem_id} para {ip}: {e}")
+            return
+        with self.lock:
+            self.contadores["acks_enviados"] += 1
+
+    def receber_ack(self, mensagem: Dict):
+        with self.lock:
+            self.contadores["acks_recebidos"] += 1
+            pendentes = self.pendentes.get(mensagem.get("id"))
+            if not pendentes:
+                return
+            for origem_id, seq in mensagem.get("lsas", ()):
+                item = pendentes.get(origem_id)
+                if item is not None and item[0] <= seq:
+                    del pendentes[origem_id]
+                    self.contadores["confirmados"] += 1
+
+    def esquecer(self, ip: str):
+        """A adjacência caiu: o vizinho recebe o LSDB de novo quando ela voltar."""
+        with self.lock:
+            self.pendentes.pop(ip, None)
+
+    def tick(self) -> float:
+        """
+        Reenvia os LSAs cujo prazo venceu. Retorna quantos segundos esperar até o
+        próximo prazo (no máximo meia retransmissão, para pegar os LSAs registrados
+        enquanto esperava).
+        """
+        agora = time.monotonic()
+        vencidos = []
+        proximo = agora + self.retransmissao / 2
+        with self.lock:
+            for ip, pendentes in self.pendentes.items():
+                for origem_id, item in pendentes.items():
+                    if item[1] <= agora:
+                        item[1] = agora + self.retransmissao
+                        vencidos.append((ip, origem_id))
+                    proximo = min(proximo, item[1])
+        for ip, origem_id in vencidos:
+            try:
+                seq = self.transmitir(ip, origem_id)
+            except Exception as e:
+                log("erros", f"Erro ao retransmitir LSA de {origem_id} para {ip}: {e}")
+                continue
+            with self.lock:
+                pendentes = self.pendentes.get(ip, {})
+                item = pendentes.get(origem_id)
+                if item is None:
+                    continue # Confirmado enquanto era reenviado
+                if seq is None:
+                    del pendentes[origem_id]
+                    continue
+                item[0] = max(item[0], seq)
+                self.contadores["retransmitidos"] += 1
+            log("lsa", "Retransmitiu LSA de %s (seq %s) para %s", origem_id, seq, ip, nivel=DEBUG)
+        return max(0.005, proximo - time.monotonic())
+
+    def estado(self) -> Dict:
+        with self.lock:
+            return {"pendentes": sum(len(pendentes) for pendentes in self.pendentes.values()), **self.contadores}
+
+
+class TrocaLSDB:
+    """Estado da troca de descrições do LSDB com um vizinho."""
+
+    __slots__ = ("pacotes", "confirmada", "recebidos", "total", "completa", "pedidos", "prazo")
+
+    def __init__(self, pacotes: List[bytes], prazo: float):
+        self.pacotes = pacotes # Nosso resumo (DD), já codificado
+        self.confirmada = False # O vizinho recebeu todo o nosso resumo
+        self.recebidos: set = set() # Índices dos pacotes de resumo do vizinho já recebidos
+        self.total: Optional[int] = None
+        self.completa = False # Recebemos todo o resumo do vizinho
+        self.pedidos: Dict[str, List[int]] = {} # id de origem -> [seq mínima esperada, tentativas]
+        self.prazo = prazo
+
+
+class SincronizacaoLSDB:
+    """
+    Sincronização do LSDB com um vizinho quando a adjacência sobe.
+
+    Cada lado manda ao vizinho o resumo ([id, seq]) dos seus LSAs em pacotes "dd" de
+    até `por_pacote` entradas, e pede ("lsr") só os LSAs que faltam no próprio LSDB
+    ou que o vizinho tem mais novos. Quem recebe um pedido manda os LSAs de uma vez
+    por `atender` (a inundação confiável, que cuida da entrega). Quem recebeu todos
+    os pacotes do resumo avisa com "dd_ok". Até lá, o resumo é reenviado a cada
+    `retransmissao` segundos, e os pedidos até os LSAs chegarem (no máximo
+    `tentativas` vezes cada). LSAs com idade máxima não entram no resumo.
+    """
+
+    TENTATIVAS = 10
+
+    def __init__(self, meu_ip: str, enviar: Callable[[bytes, str], None], lsdb_de: Callable[[str], "LSDB"],
+                 atender: Callable[[str, str], bool], retransmissao: float, por_pacote: int = 32):
+        self.meu_ip = meu_ip
+        self.enviar = enviar
+        self.lsdb_de = lsdb_de # LSDB da área do enlace com cada vizinho
+        self.atender = atender
+        self.retransmissao = retransmissao
+        self.por_pacote = por_pacote
+        self.trocas: Dict[str, TrocaLSDB] = {} # IP do vizinho -> troca em andamento
+        self.concluidas: set = set() # Vizinhos já sincronizados, enquanto a adjacência durar
+        self.lock = threading.Lock()
+        self.contadores = {"trocas": 0, "concluidas": 0, "dd_enviados": 0, "lsas_pedidos": 0, "lsas_atendidos": 0, "pedidos_abandonados": 0}
+
+    def montar_resumo(self, ip: str) -> List[bytes]:
+        resumo = self.lsdb_de(ip).resumo()
+        total = max(1, -(-len(resumo) // self.por_pacote))
+        return [
+            json.dumps({"tipo": "dd", "id": self.meu_ip, "indice": indice, "total": total,
+                        "lsas": resumo[indice * self.por_pacote:(indice + 1) * self.por_pacote]}).encode()
+            for indice in range(total)
+        ]
+
+    def iniciar(self, ip: str) -> Optional[TrocaLSDB]:
+        """
+        Começa a troca com o vizinho e manda o nosso resumo. Não faz nada se ela já
+        começou (o resumo do vizinho pode chegar antes de a adjacência subir aqui) ou
+        já terminou; a adjacência cair é que zera o estado.
+        """
+        with self.lock:
+            troca = self.trocas.get(ip)
+            if troca is not None or ip in self.concluidas:
+                return troca
+            troca = self.trocas[ip] = TrocaLSDB(self.montar_resumo(ip), time.monotonic() + self.retransmissao)
+            self.contadores["trocas"] += 1
+        self.enviar_pacotes(troca.pacotes, ip)
+        log("lsa", "Troca de LSDB com %s iniciada: %d pacote(s) de resumo", ip, len(troca.pacotes))
+        return troca
+
+    def esquecer(self, ip: str):
+        with self.lock:
+            self.trocas.pop(ip, None)
+            self.concluidas.discard(ip)
+
+    def enviar_pacotes(self, pacotes: List[bytes], ip: str):
+        for pacote in pacotes:
+            try:
+                self.enviar(pacote, ip)
+            except Exception as e:
+                log("erros", f"Erro ao enviar troca de LSDB para {ip}: {e}")
+                return
+        with self.lock:
+            self.contadores["dd_enviados"] += len(pacotes)
+
+    def pedir(self, ip: str, ids: List[str]):
+        for inicio in range(0, len(ids), self.por_pacote * 2):
+            self.enviar_pacotes([json.dumps({"tipo": "lsr", "id": self.meu_ip, "lsas": ids[inicio:inicio + self.por_pacote * 2]}).encode()], ip)
+
+    def receber_dd(self, mensagem: Dict):
+        ip = mensagem.get("id")
+        with self.lock:
+            concluida = ip in self.concluidas
+            troca = self.trocas.get(ip)
+        if concluida:
+            # O vizinho ainda reenvia o resumo: o nosso dd_ok se perdeu
+            self.enviar_pacotes([json.dumps({"tipo": "dd_ok", "id": self.meu_ip}).encode()], ip)
+            return
+        if troca is None:
+            troca = self.iniciar(ip) # O vizinho viu a adjacência subir antes de nós
+        lsdb = self.lsdb_de(ip)
+        faltando = [(id, seq) for id, seq in mensagem.get("lsas", ()) if not lsdb.conhecido(id, seq)]
+        with self.lock:
+            for id, seq in faltando:
+                pedido = troca.pedidos.get(id)
+                if pedido is None or pedido[0] < seq:
+                    troca.pedidos[id] = [seq, 1]
+            troca.recebidos.add(mensagem.get("indice", 0))
+            troca.total = mensagem.get("total", 1)
+            troca.completa = len(troca.recebidos) >= troca.total
+            self.contadores["lsas_pedidos"] += len(faltando)
+        if faltando:
+            self.pedir(ip, [id for id, _ in faltando])
+        if troca.completa:
+            self.enviar_pacotes([json.dumps({"tipo": "dd_ok", "id": self.meu_ip}).encode()], ip)
+        self.concluir(ip)
+
+    def receber_dd_ok(self, mensagem: Dict):
+        ip = mensagem.get("id")
+        with self.lock:
+            troca = self.trocas.get(ip)
+            if troca is not None:
+                troca.confirmada = True
+        self.concluir(ip)
+
+    def receber_lsr(self, mensagem: Dict):
+        ip = mensagem.get("id")
+        atendidos = sum(1 for id in mensagem.get("lsas", ()) if self.atender(ip, id))
+        with self.lock:
+            self.contadores["lsas_atendidos"] += atendidos
+
+    def concluir(self, ip: str):
+        """Encerra a troca quando os dois resumos chegaram e não falta nenhum LSA pedido."""
+        with self.lock:
+            troca = self.trocas.get(ip)
+            if troca is None or not (troca.confirmada and troca.completa):
+                return
+            lsdb = self.lsdb_de(ip)
+            for id in [id for id, (seq, _) in troca.pedidos.items() if lsdb.conhecido(id, seq)]:
+                del troca.pedidos[id]
+            if troca.pedidos:
+                return
+            del self.trocas[ip]
+            self.concluidas.add(ip)
+            self.contadores["concluidas"] += 1
+        log("lsa", "Troca de LSDB com %s concluída", ip)
+
+    def tick(self) -> float:
+        """Reenvia resumos não confirmados e pedidos não atendidos. Retorna a espera até o próximo prazo."""
+        agora = time.monotonic()
+        reenvios = []
+        proximo = agora + self.retransmissao
+        with self.lock:
+            for ip, troca in self.trocas.items():
+                if troca.prazo > agora:
+                    proximo = min(proximo, troca.prazo)
+                    continue
+                troca.prazo = agora + self.retransmissao
+                for id, pedido in list(troca.pedidos.items()):
+                    if self.lsdb_de(ip).conhecido(id, pedido[0]):
+                        del troca.pedidos[id]
+                    elif pedido[1] >= self.TENTATIVAS:
+                        del troca.pedidos[id]
+                        self.contadores["pedidos_abandonados"] += 1
+                    else:
+                        pedido[1] += 1
+                reenvios.append((ip, [] if troca.confirmada else troca.pacotes, list(troca.pedidos)))
+        for ip, pacotes, pedidos in reenvios:
+            self.enviar_pacotes(pacotes, ip)
+            if pedidos:
+                self.pedir(ip, pedidos)
+            self.concluir(ip)
+        return max(0.005, proximo - time.monotonic())
+
+    def estado(self) -> Dict:
+        with self.lock:
+            return {"em_andamento": len(self.trocas), **self.contadores}
+
 
 class Router:
     def __init__(self):
         self.id = ROTEADOR_NAME
         self.ip = ROTEADOR_IP
         self.vizinhos = VIZINHOS # Vizinhos configurados inicialmente
-        self.vizinhos_ativos = {} # Vizinhos que responderam ao último ping
-        self.lsdb = LSDB()
+        self.vizinhos_ativos = {} # Vizinhos com adjacência UP no protocolo Hello
+        self.processo_spf = self.criar_processo_spf() # Antes de qualquer thread: o processo é criado por fork
+        ids_areas = sorted({AREA, *AREAS_VIZINHOS.values()})
+        self.abr = len(ids_areas) > 1 # Roteador de borda: resume os prefixos de cada área para as outras
+        self.areas: Dict[str, Area] = {area: Area(area, self.criar_spf(area)) for area in ids_areas}
+        self.area_do_vizinho: Dict[str, str] = {ip: AREAS_VIZINHOS[nome] for nome, (ip, _) in self.vizinhos.items()}
+        self.rotas_entre_areas: Dict[str, ProximosSaltos] = {} # Rotas pelos resumos dos ABRs no último recálculo
+        self.custos_entre_areas: Dict[str, float] = {}
         self.seq = 0
         self.lsa_send_lock = threading.Lock()
         self.route_calc_lock = threading.Lock()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.last_lsdb_hash = None
+        # Envios para o grupo multicast dos segmentos: a interface é escolhida a cada envio, sob o lock
+        self.socket_multicast = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_multicast.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.socket_multicast.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 0)
+        self.multicast_lock = threading.Lock()
+        self.grupos_assinados: set = set() # Endereços locais em que o socket entrou no grupo multicast
+        self.eleicao = EleicaoDR(self.ip, PRIORIDADE_DR)
+        self.agendador_spf = AgendadorSPF(self.recalcular_rotas, SPF_ATRASO_INICIAL, SPF_ESPERA_MINIMA, SPF_ESPERA_MAXIMA)
+        self.fila_lsa = FilaIngestaoLSA(self.propagar_lsa, LSA_FILA_CAPACIDADE, LSA_WORKERS)
+        self.inundacao = InundacaoConfiavel(self.ip, self.enviar_pacote, self.transmitir_lsa, LSA_RETRANSMISSAO)
+        self.sincronizacao = SincronizacaoLSDB(self.ip, self.enviar_pacote, self.lsdb_de, self.inundacao.enviar_lsa, LSA_RETRANSMISSAO)
+        self.lsa_originado_em: Optional[float] = None # time.monotonic() do último LSA originado, para o refresh
+        metrica = MetricaRTT(RTT_ALFA, RTT_UNIDADE, RTT_HISTERESE) if METRICA == "rtt" else None
+        self.hello = ProtocoloHello(self.ip, self.vizinhos, self.enviar_pacote, self.adjacencia_mudou, HELLO_INTERVALO, DEAD_INTERVALO,
+                                    metrica=metrica, ao_mudar_custo=self.custo_mudou)
+        self.subredes = SubredesConectadas(self.ip, ANUNCIAR_SUBREDES == "todas", SUBREDES_VALIDADE)
+        self.subredes_anunciadas: frozenset = frozenset() # Sub-redes do último LSA originado
+        self.fib = fib.FIBSombra(self.criar_backend_fib())
+        self.reconciliar_fib = False
+        self.ips_ativos: set = set() # IPs dos vizinhos com adjacência UP na última mudança
+        self.adjacencias_lock = threading.Lock()
+        self.janelas_sem_rota = {"prefixos": 0, "ultima_maxima_ms": 0.0, "maxima_ms": 0.0} # Da queda do próximo salto à rota nova
+        try:
+            log("init", "FIB sombra preenchida com %d rota(s) do roteador já instaladas", lambda: len(self.fib.semear()))
+        except OSError as e:
+            log("erros", f"Erro ao ler as rotas do kernel para a FIB sombra: {e}")
+        self.remontagem = protocolo.Remontagem() # Usada só pelo caminho de recepção
+        self.buffer_recepcao = bytearray(protocolo.TAMANHO_MAXIMO_UDP) # Reaproveitado a cada recvfrom_into
         os.makedirs(LOG_BASE_DIR, exist_ok=True)
-        log("init", f"Roteador inicializado com IP: {self.ip}, Vizinhos Config: {self.vizinhos}", self.id)
+        log("init", f"Roteador inicializado com IP: {self.ip}, Vizinhos Config: {self.vizinhos}, Áreas: {sorted(self.areas)}"
+                    f"{' (ABR)' if self.abr else ''}")
 
-    def criar_lsa(self) -> LSA:
-        self.seq += 1
-        connected_subnets = NetworkInterface.get_connected_subnets()
+    def criar_processo_spf(self) -> Optional[ProcessoSPF]:
+        if not SPF_PROCESSO:
+            return None
+        try:
+            return ProcessoSPF(self.ip, ISPF_LIMITE_AFETADOS, LFA, ECMP_MAXIMO_CAMINHOS, SPF_PROCESSO_PRAZO)
+        except OSError as e:
+            log("erros", f"Erro ao criar o processo do SPF, o SPF vai rodar no roteador: {e}")
+            return None
+
+    def criar_spf(self, area: str) -> Union[SPFIncremental, SPFRemoto]:
+        """SPF de uma área, no processo do SPF quando há um. ABRs precisam das distâncias até todos os roteadores."""
+        if self.processo_spf is None:
+            return SPFIncremental(self.ip, ISPF_LIMITE_AFETADOS, LFA, ECMP_MAXIMO_CAMINHOS)
+        return SPFRemoto(self.processo_spf, area, todos_caminhos=self.abr)
+
+    def area_de(self, ip: str) -> Area:
+        """Área do enlace com o vizinho (a principal para quem não é vizinho configurado)."""
+        return self.areas[self.area_do_vizinho.get(ip, AREA)]
+
+    def lsdb_de(self, ip: str) -> LSDB:
+        return self.area_de(ip).lsdb
+
+    def criar_backend_fib(self) -> fib.BackendFIB:
+        try:
+            backend = fib.criar_backend(FIB_BACKEND)
+        except OSError as e:
+            log("erros", f"Backend de FIB '{FIB_BACKEND}' indisponível ({e}), usando FIB em memória")
+            backend = fib.BackendMemoria()
+        log("init", f"Backend de FIB: {type(backend).__name__}")
+        return backend
+
+    def monitorar_rotas(self):
+        """
+        Mantém a FIB sombra (só com o backend netlink) e o cache de sub-redes conectadas
+        em dia com as notificações de rota, interface e endereço do kernel.
+        """
+        try:
+            monitor = fib.MonitorRotas()
+        except OSError as e:
+            log("erros", f"Não foi possível assinar as notificações de rota do kernel: {e}")
+            return
+        ao_evento = self.rota_mudou if isinstance(self.fib.backend, fib.BackendNetlink) else None
+        try:
+            monitor.loop(ao_evento, self.notificacoes_perdidas, self.interfaces_mudaram)
+        except Exception as e:
+            log("erros", f"Erro no monitor de rotas do kernel: {e}")
+
+    def rota_mudou(self, tipo: int, destino: str, proximos_saltos: ProximosSaltos, protocolo: int):
+        descricao = self.fib.evento(tipo, destino, proximos_saltos, protocolo)
+        if descricao is None:
+            return # Eco de um lote aplicado pelo próprio roteador
+        log("rotas", f"Evento de rota do kernel: {descricao}")
+        if protocolo == fib.RTPROT_ROTEADOR:
+            self.reconciliar_fib = True
+            self.executar_externo(self.agendador_spf.agendar)
+
+    def notificacoes_perdidas(self):
+        log("erros", "Notificações do kernel perdidas (ENOBUFS), relendo as rotas do roteador e as interfaces")
+        self.fib.ressincronizar()
+        self.subredes.invalidar()
+        self.reconciliar_fib = True
+        self.executar_externo(self.verificar_subredes)
+        self.executar_externo(self.agendador_spf.agendar)
+
+    def interfaces_mudaram(self):
+        self.subredes.invalidar()
+        self.executar_externo(self.verificar_subredes)
+
+    def verificar_subredes(self):
+        """Revarre as interfaces; se as sub-redes mudaram, reconcilia a FIB e, se preciso, reorigina o LSA."""
+        if not self.subredes.atualizar():
+            return
+        self.reconciliar_fib = True
+        self.agendador_spf.agendar()
+        if self.subredes.anunciadas() != self.subredes_anunciadas:
+            log("lsa", f"Sub-redes anunciadas mudaram ({sorted(self.subredes.anunciadas())}), originando novo LSA")
+            self.enviar_lsa()
+        self.eleger_designados() # Os segmentos dependem das sub-redes conectadas
+
+    def executar_externo(self, funcao: Callable[[], None]):
+        """Executa funcao pedida por uma thread auxiliar (monitor de rotas, recálculo de rotas) no contexto do runtime."""
+        funcao()
+
+    def criar_lsa(self, area: Area) -> LSA:
+        """LSA da área com os vizinhos ativos nela; as sub-redes conectadas vão só no LSA da área principal."""
         # Usa self.vizinhos_ativos (agora com pesos aleatórios) para o LSA
-        lsa = LSA(self.ip, self.seq, self.vizinhos_ativos, connected_subnets)
-        log("lsa", f"Criou LSA seq={self.seq}, vizinhos_ativos={self.vizinhos_ativos}, subnets={connected_subnets}", self.id)
-        return lsa
+        vizinhos = {nome: viz for nome, viz in self.vizinhos_ativos.items() if self.area_do_vizinho.get(viz[0], AREA) == area.id}
+        subnets = self.subredes_anunciadas if area.id == AREA else frozenset()
+        return LSA(self.ip, self.seq, vizinhos, subnets, resumos=dict(area.resumos))
+
+    def enviar_pacote(self, data: bytes, ip: str):
+        self.socket.sendto(data, (ip, PORTA))
 
-    def enviar_lsa(self):
+    def enviar_lsa(self, forcar: bool = False):
         with self.lsa_send_lock:
             # Atualiza a lista de vizinhos ativos e seus pesos ANTES de criar o LSA
-            self.vizinhos_ativos = NetworkUtils.determinar_vizinhos_ativos_e_pesos(self.vizinhos) # Atualizado
-            if not self.vizinhos_ativos:
-                log("lsa", "Nenhum vizinho ativo detectado por ping", self.id)
-                # Mesmo sem vizinhos ativos, cria e envia LSA com subnets locais
+            self.vizinhos_ativos = NetworkUtils.determinar_vizinhos_ativos_e_pesos(self.vizinhos, self.hello.ativos(), self.hello.custos())
+            self.originar_lsa(forcar)
 
-            lsa = self.criar_lsa() # Agora usa self.vizinhos_ativos com pesos aleatórios
-            lsa_json = json.dumps(lsa.to_dict()).encode()
+    def custo_mudou(self):
+        """O custo medido de um enlace saiu da faixa de histerese: o novo custo vai num LSA na hora."""
+        log("lsa", "Custo de enlace medido pelo RTT mudou, originando novo LSA")
+        self.enviar_lsa()
 
-            # Envia para TODOS os vizinhos configurados inicialmente
-            # Isso garante que mesmo vizinhos temporariamente inativos recebam o LSA quando voltarem
-            for viz_id, (ip, _) in self.vizinhos.items():
-                try:
-                    self.socket.sendto(lsa_json, (ip, PORTA))
-                    log("lsa", f"Enviou LSA para vizinho configurado {viz_id} ({ip})", self.id)
-                except Exception as e:
-                    log("erros", f"Erro ao enviar LSA para {viz_id}: {e}", self.id)
+    def adjacencia_mudou(self):
+        """
+        Uma adjacência entrou ou saiu de UP: se alguma caiu, os prefixos que usavam o
+        vizinho passam na hora para os alternativos (LFA); depois origina um novo LSA.
+        Refaz a eleição de DR e, com os vizinhos que acabaram de subir e com quem há
+        adjacência completa, começa a troca de resumos do LSDB.
+        """
+        ativos = self.hello.ativos()
+        ips_ativos = {self.vizinhos[nome][0] for nome in ativos}
+        with self.adjacencias_lock: # Hellos recebidos e o tick do Hello podem chamar ao mesmo tempo
+            caidos, novos, self.ips_ativos = self.ips_ativos - ips_ativos, ips_ativos - self.ips_ativos, ips_ativos
+        for ip in caidos:
+            self.inundacao.esquecer(ip)
+            self.sincronizacao.esquecer(ip)
+        if caidos and LFA:
+            self.reroteamento_rapido(caidos, ips_ativos)
+        self.eleger_designados() # Antes do LSA, que é inundado conforme a eleição
+        log("lsa", f"Adjacências mudaram ({ativos}), originando novo LSA")
+        self.enviar_lsa()
+        for ip in novos:
+            if self.eleicao.adjacencia_completa(ip):
+                self.sincronizacao.iniciar(ip)
+
+    def eleger_designados(self):
+        """
+        Refaz a eleição de DR/BDR dos segmentos multiacesso. Se o resultado mudou, ele
+        passa a ir nos Hellos, o socket entra no grupo multicast dos segmentos novos e
+        começa a troca de LSDB com quem passou a ter adjacência completa (iniciar não
+        repete trocas já feitas).
+        """
+        if not DR:
+            return
+        locais = self.subredes.locais()
+        with self.adjacencias_lock:
+            if not self.eleicao.eleger(locais, self.hello.prioridades()):
+                return
+            segmentos = self.eleicao.segmentos
+            self.hello.designados = self.eleicao.anuncio()
+            for subnet in segmentos:
+                self.assinar_grupo(locais[subnet])
+        log("adjacencias", f"Eleição de DR/BDR: {self.eleicao.estado()['segmentos']}")
+        for membros, _ in segmentos.values():
+            for ip in membros:
+                if self.eleicao.adjacencia_completa(ip):
+                    self.sincronizacao.iniciar(ip)
+
+    def assinar_grupo(self, endereco: str):
+        if endereco in self.grupos_assinados:
+            return
+        try:
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                   socket.inet_aton(GRUPO_MULTICAST) + socket.inet_aton(endereco))
+            self.grupos_assinados.add(endereco)
+            log("adjacencias", f"Entrou no grupo {GRUPO_MULTICAST} pelo endereço {endereco}")
+        except OSError as e:
+            log("erros", f"Erro ao entrar no grupo {GRUPO_MULTICAST} pelo endereço {endereco}: {e}")
+
+    def enviar_multicast(self, data: bytes, endereco: str):
+        with self.multicast_lock:
+            self.socket_multicast.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(endereco))
+            self.socket_multicast.sendto(data, (GRUPO_MULTICAST, PORTA))
+
+    def reroteamento_rapido(self, caidos: set, ips_ativos: set):
+        """
+        Tira os próximos saltos que caíram das rotas que passavam por eles, antes do novo SPF.
+        Rotas ECMP ficam com os caminhos restantes; rotas sem outro caminho vão para o
+        alternativo (LFA) já calculado no último SPF. A tabela de proteção é agrupada por
+        próximo salto, então cada vizinho caído é uma única consulta, e a troca vai num só lote.
+        """
+        substituir: Dict[str, ProximosSaltos] = {}
+        for ip in caidos:
+            spf = self.area_de(ip).spf
+            tabela, protecao, alternativos = spf.tabela, spf.protecao, spf.alternativos
+            for subnet in protecao.get(ip, ()):
+                restantes = tuple(salto for salto in tabela.get(subnet, ()) if salto not in caidos and salto in ips_ativos)
+                if not restantes and alternativos.get(subnet) in ips_ativos:
+                    restantes = (alternativos[subnet],)
+                if restantes:
+                    substituir[subnet] = restantes
+        # Rotas para outras áreas ficam só com os caminhos ECMP restantes (não há LFA para elas)
+        for subnet, saltos in self.rotas_entre_areas.items():
+            if caidos.intersection(saltos):
+                restantes = tuple(salto for salto in saltos if salto not in caidos and salto in ips_ativos)
+                if restantes:
+                    substituir[subnet] = restantes
+        if not substituir:
+            return
+        inicio = time.monotonic()
+        erros, janelas = NetworkInterface.aplicar_rotas(self.fib, {}, {}, substituir, self.hello.caiu_em)
+        self.registrar_janelas(janelas)
+        log("rotas", f"Reroteamento rápido: {len(substituir)} prefixo(s) de {sorted(caidos)} trocados para caminhos "
+                     f"restantes (ECMP) ou alternativos (LFA) em {(time.monotonic() - inicio) * 1000:.1f} ms ({erros} erro(s))")
+
+    def registrar_janelas(self, janelas: Dict[str, float]):
+        if not janelas:
+            return
+        maxima_ms = round(max(janelas.values()) * 1000, 1)
+        self.janelas_sem_rota["prefixos"] += len(janelas)
+        self.janelas_sem_rota["ultima_maxima_ms"] = maxima_ms
+        self.janelas_sem_rota["maxima_ms"] = max(self.janelas_sem_rota["maxima_ms"], maxima_ms)
+
+    def originar_lsa(self, forcar: bool = False):
+        """
+        Cria o LSA de cada área a partir de self.vizinhos_ativos, atualiza o LSDB da área
+        e o envia aos vizinhos dela. Sem forcar (refresh, cópia nossa mais nova vinda da
+        rede), áreas em que o LSA não mudou continuam com o anterior.
+        """
+        if not self.vizinhos_ativos:
+            log("lsa", "Nenhum vizinho ativo detectado pelo protocolo Hello")
+            # Mesmo sem vizinhos ativos, cria e envia LSA com subnets locais
+
+        self.subredes_anunciadas = self.subredes.anunciadas()
+        mudaram = []
+        for area in self.areas.values():
+            lsa = self.criar_lsa(area)
+            conteudo = (sorted(zip(lsa.ips, lsa.custos)), sorted(lsa.subnets), lsa.resumos)
+            if forcar or conteudo != area.originado:
+                mudaram.append((area, lsa, conteudo))
+        if not mudaram:
+            return
+        self.seq += 1
+        self.lsa_originado_em = time.monotonic()
+
+        for area, lsa, conteudo in mudaram:
+            lsa.seq = self.seq
+            area.originado = conteudo
+            log("lsa", "Criou LSA seq=%s, área %s, vizinhos_ativos=%s, subnets=%s, resumos=%d", lsa.seq, area.id, lambda: lsa.vizinhos,
+                lambda: sorted(lsa.subnets), len(lsa.resumos))
+            # Atualiza o próprio LSDB com o LSA recém-criado (as retransmissões saem dele)
+            geracao = area.lsdb.geracao
+            area.lsdb.atualizar_lsa(lsa)
+            if area.lsdb.geracao != geracao:
+                self.agendador_spf.agendar() # Agenda o recálculo de rotas se o conteúdo do próprio LSA mudou
+
+            # Envia para os vizinhos com adjacência UP, que confirmam o recebimento. Os demais
+            # recebem o LSDB inteiro quando a adjacência subir
+            self.inundar(lsa.para_envio(), None, {}, area.id)
+
+    def destinos_inundacao(self, origem_ip: Optional[str], area: str) -> Tuple[List[Tuple[str, str, List[str]]], List[str]]:
+        """
+        Para onde inundar um LSA da área vindo de origem_ip (None para o próprio): segmentos
+        em que somos DR, como (sub-rede, endereço local, membros), e IPs para envio unicast.
+        Só vizinhos com enlace na mesma área recebem o LSA.
 
-            # Atualiza o próprio LSDB com o LSA recém-criado
-            if self.lsdb.atualizar_lsa(lsa):
-                 self.recalcular_rotas() # Recalcula rotas se o próprio LSA mudou
+        Num segmento, o DR inunda por multicast a todos os membros, inclusive de volta
+        ao segmento de onde o LSA veio; BDR e DROthers só mandam ao DR e ao BDR o que
+        chegou de fora dele. Enquanto algum membro anunciar outro DR/BDR, o segmento
+        é tratado como enlaces ponto a ponto.
+        """
+        segmentos = self.eleicao.segmentos
+        locais = self.subredes.locais() if segmentos else {}
+        grupos, unicast, em_segmento = [], [], set()
+        for subnet, (membros, designados) in segmentos.items():
+            em_segmento.update(membros)
+            if designados[0] is None or subnet not in locais or not self.hello.concordam(subnet, membros, designados):
+                unicast.extend(membros)
+            elif designados[0] == self.ip:
+                grupos.append((subnet, locais[subnet], membros))
+            elif origem_ip not in membros:
+                unicast.extend(ip for ip in designados if ip is not None and ip != self.ip)
+        unicast.extend(ip for ip, _ in self.vizinhos_ativos.values() if ip not in em_segmento)
+        na_area = lambda ip: self.area_do_vizinho.get(ip, AREA) == area
+        return ([grupo for grupo in grupos if na_area(grupo[2][0])],
+                [ip for ip in unicast if ip != origem_ip and na_area(ip)])
 
-    def propagar_lsa(self, lsa_data: bytes, origem_ip: str):
+    def inundar(self, lsa_dict: Dict, origem_ip: Optional[str], codificados: Dict[str, List[bytes]], area: str):
+        """Envia o LSA conforme destinos_inundacao e registra cada destino para retransmissão até o ack."""
+        id, seq = lsa_dict["id"], lsa_dict["seq"]
+        grupos, unicast = self.destinos_inundacao(origem_ip, area)
+        for subnet, endereco, membros in grupos:
+            try:
+                # Um só datagrama para o segmento: binário só se todos os membros o negociaram
+                binario = all(self.hello.formato_lsa(ip) == protocolo.FORMATO_BINARIO for ip in membros)
+                formato = protocolo.FORMATO_BINARIO if binario else protocolo.FORMATO_JSON
+                for datagrama in self.codificar_lsa(lsa_dict, subnet, codificados, formato):
+                    self.enviar_multicast(datagrama, endereco)
+                for ip in membros:
+                    if ip != origem_ip:
+                        self.inundacao.registrar(ip, id, seq)
+                log("lsa", "Inundou LSA de %s no segmento %s (%d membros)", id, subnet, len(membros), nivel=DEBUG)
+            except Exception as e:
+                log("erros", f"Erro ao inundar LSA no segmento {subnet}: {e}")
+        for ip in unicast:
+            try:
+                for datagrama in self.codificar_lsa(lsa_dict, ip, codificados):
+                    self.enviar_pacote(datagrama, ip)
+                self.inundacao.registrar(ip, id, seq)
+                log("lsa", "Inundou LSA de %s para o vizinho %s", id, ip, nivel=DEBUG)
+            except Exception as e:
+                log("erros", f"Erro ao enviar LSA de {id} para {ip}: {e}")
+
+    def transmitir_lsa(self, ip: str, origem_id: str) -> Optional[int]:
+        """Envia ao vizinho a cópia do LSDB do LSA de origem_id. Retorna a seq enviada, ou None se não há LSA."""
+        lsa = self.lsdb_de(ip).lsas.get(origem_id)
+        if lsa is None:
+            return None
+        for datagrama in self.codificar_lsa(lsa.para_envio(), ip, {}):
+            self.enviar_pacote(datagrama, ip)
+        return lsa.seq
+
+    def lsa_repetido(self, origem_id: str, seq: int, origem_ip: str):
+        """
+        Um vizinho mandou uma cópia que não é mais nova que a do LSDB: a mesma cópia é
+        confirmada (o ack anterior pode ter se perdido); para uma mais antiga, o vizinho
+        recebe a nossa.
+        """
+        self.inundacao.recebido(origem_ip, origem_id, seq)
+        atual = self.lsdb_de(origem_ip).lsas.get(origem_id)
+        if atual is None:
+            return
+        if seq == atual.seq:
+            self.inundacao.confirmar(origem_ip, origem_id, seq, repetido=True)
+        elif seq < atual.seq:
+            self.inundacao.responder_antigo(origem_ip, origem_id, atual.seq)
+
+    def codificar_lsa(self, lsa_dict: Dict, ip: str, codificados: Dict[str, List[bytes]],
+                      formato: Optional[str] = None) -> List[bytes]:
+        """
+        Codifica o LSA no formato negociado com o vizinho (ou no formato dado) e o divide
+        em datagramas de até LSA_TAMANHO_DATAGRAMA bytes, reaproveitando codificações já feitas.
+        """
+        formato = formato or self.hello.formato_lsa(ip)
+        if formato not in codificados:
+            try:
+                data = protocolo.codificar(lsa_dict, formato)
+            except ValueError as e:
+                log("erros", f"LSA de {lsa_dict['id']} enviado em JSON para {ip}: {e}")
+                formato = protocolo.FORMATO_JSON
+                if formato in codificados:
+                    return codificados[formato]
+                data = protocolo.codificar(lsa_dict, formato)
+            codificados[formato] = protocolo.fragmentar(data, lsa_dict["id"], lsa_dict["seq"], LSA_TAMANHO_DATAGRAMA)
+        return codificados[formato]
+
+    def propagar_lsa(self, lsa_data: bytes, origem_ip: str, lsa_dict: Optional[Dict] = None):
         try:
-            lsa_dict = json.loads(lsa_data.decode())
+            if lsa_dict is None:
+                lsa_dict = protocolo.decodificar(lsa_data)
             subnets = set(lsa_dict.get("subnets", []))
             # Recria vizinhos como dicionário para consistência
             vizinhos_lsa = lsa_dict.get("vizinhos", {})
             # Atenção: O tipo do peso em vizinhos mudou de float para int
-            lsa = LSA(lsa_dict["id"], lsa_dict["seq"], vizinhos_lsa, subnets)
+            lsa = LSA(lsa_dict["id"], lsa_dict["seq"], vizinhos_lsa, subnets, int(lsa_dict.get("idade", 0)),
+                      {subnet: custo for subnet, custo in lsa_dict.get("resumos", ())})
+            area = self.area_de(origem_ip) # O LSA pertence à área do enlace por onde chegou
+
+            if lsa.id == self.ip and lsa.seq > self.seq:
+                # Cópia do nosso LSA de antes de reiniciar: confirma e origina um com seq maior
+                self.inundacao.confirmar(origem_ip, lsa.id, lsa.seq)
+                log("lsa", "Recebeu o próprio LSA com seq %s > %s de %s, originando um mais novo", lsa.seq, self.seq, origem_ip)
+                with self.lsa_send_lock:
+                    self.seq = max(self.seq, lsa.seq)
+                self.enviar_lsa(forcar=True)
+                return
+            if lsa.idade >= LSA_IDADE_MAXIMA and lsa.id not in area.lsdb.lsas:
+                self.inundacao.confirmar(origem_ip, lsa.id, lsa.seq) # Retirada de um LSA que não conhecemos
+                return
 
             # Atualiza LSDB e verifica se houve mudança
-            if self.lsdb.atualizar_lsa(lsa):
-                log("lsa", f"LSDB atualizado com LSA de {lsa.id} (seq {lsa.seq}) vindo de {origem_ip}", self.id)
-                # Propaga para vizinhos ativos, exceto a origem do LSA
-                for viz_id, (ip, _) in self.vizinhos_ativos.items():
-                    if ip != origem_ip:
-                        try:
-                            self.socket.sendto(lsa_data, (ip, PORTA))
-                            log("lsa", f"Propagou LSA de {lsa.id} para vizinho ativo {viz_id} ({ip})", self.id)
-                        except Exception as e:
-                            log("erros", f"Erro ao propagar LSA para {viz_id}: {e}", self.id)
-                # Recalcula rotas APÓS atualizar LSDB
-                self.recalcular_rotas()
-            # else: # Opcional: Logar se LSA recebido for antigo/duplicado
-            #    log("lsa_debug", f"LSA de {lsa.id} (seq {lsa.seq}) vindo de {origem_ip} ignorado (antigo ou duplicado).", self.id)
-
-        except json.JSONDecodeError:
-            log("erros", f"Erro ao decodificar LSA JSON recebido de {origem_ip}", self.id)
+            geracao = area.lsdb.geracao
+            if area.lsdb.atualizar_lsa(lsa):
+                log("lsa", "LSDB da área %s atualizado com LSA de %s (seq %s) vindo de %s", area.id, lsa.id, lsa.seq, origem_ip, nivel=DEBUG)
+                self.inundacao.recebido(origem_ip, lsa.id, lsa.seq)
+                self.inundacao.confirmar(origem_ip, lsa.id, lsa.seq)
+                # Propaga para vizinhos ativos, exceto a origem do LSA. Quem usa binário recebe os
+                # bytes originais só com a idade trocada; os demais, o LSA recodificado
+                envio = lsa.para_envio()
+                codificados = {}
+                if protocolo.eh_binario(lsa_data):
+                    codificados[protocolo.FORMATO_BINARIO] = protocolo.fragmentar(
+                        protocolo.definir_idade(lsa_data, envio["idade"]), lsa.id, lsa.seq, LSA_TAMANHO_DATAGRAMA)
+                self.inundar(envio, origem_ip, codificados, area.id)
+                # Agenda o recálculo de rotas APÓS atualizar LSDB (mudanças em rajada são agrupadas).
+                # Um refresh (mesmo conteúdo, só seq e idade novas) não muda a geração e não agenda
+                if area.lsdb.geracao != geracao:
+                    self.agendador_spf.agendar()
+            else:
+                self.lsa_repetido(lsa.id, lsa.seq, origem_ip) # Outra cópia chegou ao LSDB antes desta
+
+        except ValueError as e:
+            log("erros", f"Erro ao decodificar LSA recebido de {origem_ip}: {e}")
         except KeyError as e:
-             log("erros", f"Campo faltando no LSA recebido de {origem_ip}: {e}", self.id)
+             log("erros", f"Campo faltando no LSA recebido de {origem_ip}: {e}")
         except Exception as e:
-            log("erros", f"Erro geral ao processar/propagar LSA de {origem_ip}: {e}", self.id)
+            log("erros", f"Erro geral ao processar/propagar LSA de {origem_ip}: {e}")
 
     def recalcular_rotas(self):
         with self.route_calc_lock:
-            log("rotas", "Iniciando recálculo de rotas...", self.id)
-            # Formata o LSDB para o Dijkstra (incluindo subnets)
-            lsdb_formatted = {lsa.id: lsa.to_dict() for lsa in self.lsdb.lsas.values()}
-
-            # Verifica se o LSDB mudou desde a última execução
-            lsdb_hash = json.dumps(lsdb_formatted, sort_keys=True)
-            if self.last_lsdb_hash == lsdb_hash:
-                log("rotas", "LSDB não mudou, pulando recálculo.", self.id)
+            log("rotas", "Iniciando recálculo de rotas...", nivel=DEBUG)
+            # Uma rota do roteador mudada por fora obriga a comparar de novo, mesmo com o LSDB igual
+            reconciliar, self.reconciliar_fib = self.reconciliar_fib, False
+            mudaram = []
+            for area in self.areas.values():
+                # Sem mudança de conteúdo desde a última execução (refreshes não contam), nem exporta
+                if area.lsdb.geracao == area.geracao_spf:
+                    continue
+                # LSAs da área para o Dijkstra (lidos direto, sem conversão) junto com os alterados
+                lsdb_spf, alterados, area.geracao_spf, impressao = area.lsdb.exportar()
+                if impressao == area.impressao_spf and list(lsdb_spf) == list(area.lsdb_spf):
+                    # Mudanças que se desfizeram (ex.: enlace que caiu e voltou com o mesmo custo):
+                    # o SPF anterior continua valendo para este conteúdo. A impressão não vê a ordem
+                    # do LSDB, que decide o custo de enlaces assimétricos (ver GrafoSPF.do_lsdb), então
+                    # um LSA apagado e instalado de novo, que vai para o fim, obriga a rodar o SPF
+                    log("rotas_debug", "LSDB da área %s voltou ao conteúdo do último SPF (geração %s)", area.id, area.geracao_spf)
+                    continue
+                area.impressao_spf, area.lsdb_spf = impressao, lsdb_spf
+                log("rotas_debug", "LSDB da área %s mudou. Geração %s, impressão %x", area.id, area.geracao_spf, impressao & 0xFFFFFFFFFFFFFFFF)
+                mudaram.append((area, alterados))
+            if not mudaram and not reconciliar:
+                log("rotas", "LSDB não mudou, pulando recálculo.", nivel=DEBUG)
                 return
-            self.last_lsdb_hash = lsdb_hash
-            log("rotas_debug", f"LSDB mudou. Hash: {hash(lsdb_hash)}", self.id)
 
-            # Salva o LSDB atual em arquivo para depuração
-            NetworkInterface.salvar_lsdb_rotas_arquivo(lsdb_formatted, {}) # Salva LSDB antes de Dijkstra
+            if REGISTRO.habilitado("dijkstra_debug"):
+                # Salva o LSDB atual em arquivo para depuração
+                NetworkInterface.salvar_lsdb_rotas_arquivo(self.lsdb_formatado(), {}) # Salva LSDB antes de Dijkstra
+                log("dijkstra_debug", "Chamando Dijkstra com origem=%s e LSDB:", self.ip)
+                log("dijkstra_debug", lambda: json.dumps(self.lsdb_formatado(), indent=2)) # Log do LSDB completo
 
-            log("dijkstra_debug", f"Chamando Dijkstra com origem={self.ip} e LSDB:", self.id)
-            log("dijkstra_debug", json.dumps(lsdb_formatted, indent=2), self.id) # Log do LSDB completo
+            for i, (area, alterados) in enumerate(mudaram):
+                try:
+                    # Executa o SPF (incremental quando possível, completo caso contrário) só sobre a área
+                    area.spf.calcular(area.lsdb_spf, alterados)
+                    log("dijkstra_debug", "SPF da área %s %s (%d LSA(s) alterado(s), execuções: %s) retornou: %s, alternativos (LFA): %s",
+                        area.id, area.spf.ultimo_modo, len(alterados), area.spf.execucoes, area.spf.tabela, area.spf.alternativos)
+                except Exception as e:
+                    log("erros", f"Erro durante execução do Dijkstra na área {area.id}: {e}")
+                    # Esta área e as que ainda não rodaram já consumiram os alterados: descarta o
+                    # estado incremental delas e agenda outra execução (com o backoff), que será completa
+                    for pendente, _ in mudaram[i:]:
+                        pendente.spf = self.criar_spf(pendente.id)
+                        pendente.geracao_spf = pendente.impressao_spf = None
+                    self.reconciliar_fib = self.reconciliar_fib or reconciliar
+                    # No modo asyncio o recálculo roda no executor: o timer do agendador é criado no loop
+                    self.executar_externo(self.agendador_spf.agendar)
+                    return # Aborta se Dijkstra falhar
 
-            try:
-                # Executa Dijkstra
-                rotas_calculadas = dijkstra(self.ip, lsdb_formatted)
-                log("dijkstra_debug", f"Dijkstra retornou: {rotas_calculadas}", self.id)
-            except Exception as e:
-                log("erros", f"Erro durante execução do Dijkstra: {e}", self.id)
-                return # Aborta se Dijkstra falhar
+            # Rotas dentro das áreas têm preferência sobre as aprendidas pelos resumos de outras
+            rotas_calculadas: Dict[str, ProximosSaltos] = {}
+            for area in self.areas.values():
+                for subnet, proximos_saltos in area.spf.tabela.items():
+                    rotas_calculadas.setdefault(subnet, proximos_saltos)
+            entre_areas = self.calcular_rotas_entre_areas()
+            for subnet, proximos_saltos in entre_areas.items():
+                rotas_calculadas.setdefault(subnet, proximos_saltos)
+            if self.abr:
+                self.atualizar_resumos()
 
             # Filtra rotas para garantir que o próximo salto seja um vizinho ativo
             # (Esta lógica parece redundante se Dijkstra já faz isso, mas mantemos por segurança)
+            # Numa rota ECMP só os caminhos por vizinhos ativos ficam; sem nenhum, a rota é descartada
             rotas_validas = {}
-            for destino, proximo_salto in rotas_calculadas.items():
-                is_valid_next_hop = False
-                # Verifica se proximo_salto é o IP de algum vizinho ATIVO
-                for viz_ip, _ in self.vizinhos_ativos.values():
-                    if proximo_salto == viz_ip:
-                        rotas_validas[destino] = proximo_salto
-                        is_valid_next_hop = True
-                        break
-                if not is_valid_next_hop:
-                     log("rotas_debug", f"Rota para {destino} via {proximo_salto} descartada (próximo salto não é vizinho ativo: {list(self.vizinhos_ativos.values())})", self.id)
-
-            log("rotas", f"Rotas válidas após filtro de vizinhos ativos: {rotas_validas}", self.id)
-            # Salva as rotas válidas calculadas
-            NetworkInterface.salvar_lsdb_rotas_arquivo(lsdb_formatted, rotas_validas)
-
-            # Compara com rotas do kernel e determina ações
-            rotas_adicionar, rotas_remover, rotas_substituir = NetworkInterface.obter_rotas_existentes(rotas_validas)
+            ips_ativos = {viz_ip for viz_ip, _ in self.vizinhos_ativos.values()}
+            for destino, proximos_saltos in rotas_calculadas.items():
+                validos = tuple(salto for salto in proximos_saltos if salto in ips_ativos)
+                if validos:
+                    rotas_validas[destino] = validos
+                if validos != proximos_saltos:
+                     log("rotas_debug", "Rota para %s via %s: próximos saltos inativos descartados (vizinhos ativos: %s)",
+                         destino, proximos_saltos, lambda: list(self.vizinhos_ativos.values()))
+
+            log("rotas", "Rotas válidas após filtro de vizinhos ativos: %s", rotas_validas, nivel=DEBUG)
+            if REGISTRO.habilitado("dijkstra_debug"):
+                # Salva o LSDB e as rotas válidas calculadas. Fora da depuração, o SPF não converte o LSDB
+                # (to_dict em todos os LSAs) nem grava em disco a cada execução
+                NetworkInterface.salvar_lsdb_rotas_arquivo(self.lsdb_formatado(), rotas_validas)
+
+            # Compara com a cópia em memória das rotas do roteador e determina ações. Se só prefixos mudaram (cálculo parcial),
+            # apenas as sub-redes afetadas são comparadas e reprogramadas
+            destinos = None
+            if not reconciliar and all(area.spf.ultimo_modo == "parcial" for area, _ in mudaram):
+                destinos = set().union(*(area.spf.prefixos_alterados for area, _ in mudaram))
+                destinos |= {subnet for subnet in entre_areas.keys() | self.rotas_entre_areas.keys()
+                             if entre_areas.get(subnet) != self.rotas_entre_areas.get(subnet)}
+                log("rotas", "Cálculo parcial de rotas: SPF não executado, prefixos afetados: %s", destinos, nivel=DEBUG)
+            self.rotas_entre_areas = entre_areas
+            rotas_adicionar, rotas_remover, rotas_substituir = NetworkInterface.obter_rotas_existentes(self.fib, rotas_validas, self.subredes.conectadas(), destinos)
 
             # Aplica as mudanças na tabela de roteamento do kernel
-            log("rotas", f"Aplicando mudanças: ADD={list(rotas_adicionar.keys())}, REMOVE={list(rotas_remover.keys())}, REPLACE={list(rotas_substituir.keys())}", self.id)
-            erros_aplicacao = 0
-            for destino in rotas_remover:
-                if not NetworkInterface.remover_interfaces(destino):
-                    erros_aplicacao += 1
-            for destino, proximo_salto in rotas_adicionar.items():
-                if not NetworkInterface.adicionar_interface(destino, proximo_salto):
-                     erros_aplicacao += 1
-            for destino, proximo_salto in rotas_substituir.items():
-                if not NetworkInterface.replase_interface(destino, proximo_salto):
-                     erros_aplicacao += 1
+            log("rotas", f"Aplicando mudanças: ADD={list(rotas_adicionar.keys())}, REMOVE={list(rotas_remover.keys())}, REPLACE={list(rotas_substituir.keys())}")
+            erros_aplicacao, janelas = NetworkInterface.aplicar_rotas(self.fib, rotas_adicionar, rotas_remover, rotas_substituir, self.hello.caiu_em)
+            self.registrar_janelas(janelas)
 
             if erros_aplicacao > 0:
-                 log("erros", f"{erros_aplicacao} erro(s) ao aplicar rotas no kernel.", self.id)
+                 log("erros", f"{erros_aplicacao} erro(s) ao aplicar rotas no kernel.")
             else:
-                 log("rotas", "Todas as mudanças de rota aplicadas com sucesso.", self.id)
+                 log("rotas", "Todas as mudanças de rota aplicadas com sucesso.")
 
-    def escutar_lsa(self):
+    def lsdb_formatado(self) -> Dict:
+        """LSDB da última execução do SPF em JSON, para depuração: por área quando há mais de uma."""
+        if not self.abr:
+            return {id: lsa.to_dict() for id, lsa in next(iter(self.areas.values())).lsdb_spf.items()}
+        return {id: {router_id: lsa.to_dict() for router_id, lsa in area.lsdb_spf.items()} for id, area in self.areas.items()}
+
+    def calcular_rotas_entre_areas(self) -> Dict[str, ProximosSaltos]:
+        """
+        Rotas para os prefixos anunciados nos resumos dos ABRs: cada prefixo sai pelo
+        caminho até o ABR de menor custo somado ao custo anunciado (empates viram ECMP).
+        Um ABR só usa os resumos do backbone, como no OSPF, para um prefixo resumido
+        numa área nunca voltar a ela por outro ABR.
+        """
+        if self.abr and AREA_BACKBONE in self.areas:
+            areas = [self.areas[AREA_BACKBONE]]
+        else:
+            areas = list(self.areas.values())
+        melhores: Dict[str, Tuple[float, set]] = {}
+        for area in areas:
+            for router_id, lsa in area.lsdb_spf.items():
+                if router_id == self.ip or not lsa.resumos:
+                    continue
+                caminho = area.spf.caminho(router_id)
+                if caminho is None or not caminho[1]:
+                    continue
+                distancia, saltos = caminho
+                for subnet, custo in lsa.resumos:
+                    total = distancia + custo
+                    melhor = melhores.get(subnet)
+                    if melhor is None or total < melhor[0]:
+                        melhores[subnet] = (total, set(saltos))
+                    elif total == melhor[0]:
+                        melhor[1].update(saltos)
+        self.custos_entre_areas = {subnet: total for subnet, (total, _) in melhores.items()}
+        return {subnet: tuple(sorted(saltos)[:ECMP_MAXIMO_CAMINHOS]) for subnet, (_, saltos) in melhores.items()}
+
+    def atualizar_resumos(self):
+        """
+        (ABR) Recalcula os resumos anunciados em cada área: os prefixos das outras áreas,
+        com o custo até eles, e, fora do backbone, também os aprendidos pelos resumos do
+        backbone. Prefixos que se sobrepõem aos da própria área não são anunciados nela.
+        Se algum resumo mudou, os LSAs são originados de novo.
+        """
+        internos: Dict[str, Dict[str, float]] = {}
+        for area in self.areas.values():
+            custos: Dict[str, float] = {}
+            distancias: Dict[str, Optional[float]] = {self.ip: 0.0}
+            for subnet, router_ids in area.lsdb.prefixos().items():
+                if subnet == SUBREDE_LOOPBACK:
+                    continue
+                for router_id in router_ids:
+                    if router_id not in distancias:
+                        caminho = area.spf.caminho(router_id)
+                        distancias[router_id] = caminho[0] if caminho is not None else None
+                    distancia = distancias[router_id]
+                    if distancia is not None and distancia < custos.get(subnet, float("inf")):
+                        custos[subnet] = distancia
+            internos[area.id] = custos
+
+        mudou = False
+        for area in self.areas.values():
+            prefixos: Dict[str, float] = {}
+            origens = [custos for id, custos in internos.items() if id != area.id]
+            if area.id != AREA_BACKBONE:
+                origens.append(self.custos_entre_areas)
+            for custos in origens:
+                for subnet, custo in custos.items():
+                    if custo < prefixos.get(subnet, float("inf")):
+                        prefixos[subnet] = custo
+            proprios = [ipaddress.ip_network(subnet) for subnet in internos[area.id]]
+            prefixos = {subnet: custo for subnet, custo in prefixos.items()
+                        if not any(ipaddress.ip_network(subnet).overlaps(rede) for rede in proprios)}
+            resumos = agregar_prefixos(prefixos)
+            if resumos != area.resumos:
+                log("lsa", "Resumos anunciados na área %s: %s", area.id, resumos)
+                area.resumos = resumos
+                mudou = True
+        if mudou:
+            self.executar_externo(self.enviar_lsa)
+
+    def vincular_socket(self) -> bool:
+        """Vincula o socket antes de qualquer envio (senão o kernel escolhe uma porta efêmera)."""
         try:
             self.socket.bind(("0.0.0.0", PORTA))
-            log("init", f"Socket vinculado a 0.0.0.0:{PORTA}", self.id)
+            log("init", f"Socket vinculado a 0.0.0.0:{PORTA}")
+            return True
         except Exception as e:
-            log("erros", f"Falha ao vincular socket: {e}", self.id)
-            return # Não pode continuar sem socket
+            log("erros", f"Falha ao vincular socket: {e}")
+            return False
 
+    def escutar_lsa(self):
+        # O buffer tem o tamanho máximo de um datagrama UDP, então nada é truncado; a
+        # memoryview evita uma cópia por pacote (só LSAs aceitos são copiados)
+        visao = memoryview(self.buffer_recepcao)
         while True:
             try:
-                data, addr = self.socket.recvfrom(4096)
-                log("lsa", f"Recebeu {len(data)} bytes de {addr[0]}", self.id)
-                # Inicia processamento em nova thread para não bloquear o recebimento
-                threading.Thread(target=self.propagar_lsa, args=(data, addr[0]), daemon=True).start()
+                tamanho, addr = self.socket.recvfrom_into(self.buffer_recepcao)
+                log("lsa", "Recebeu %d bytes de %s", tamanho, addr[0], nivel=DEBUG)
             except Exception as e:
-                log("erros", f"Erro no loop de recebimento de LSA: {e}", self.id)
+                log("erros", f"Erro no loop de recebimento de LSA: {e}")
                 time.sleep(1) # Evita busy-loop em caso de erro contínuo
+                continue
+            self.receber_datagrama(visao[:tamanho], addr[0])
 
-    def enviar_periodicamente(self):
-        # Espera inicial para permitir que a rede estabilize um pouco
-        time.sleep(5)
+    def receber_datagrama(self, data: Union[bytes, memoryview], origem_ip: str) -> bool:
+        """
+        Trata Hellos na hora, junta fragmentos e coloca LSAs na fila de ingestão.
+        data pode ser uma visão do buffer de recepção: tudo que é guardado é copiado.
+        Retorna True se um LSA foi enfileirado.
+        """
+        try:
+            if protocolo.eh_binario(data):
+                # Só o cabeçalho é lido aqui; o corpo é decodificado pelo worker
+                origem_id, seq = protocolo.ler_cabecalho(data)
+                lsa_dict = None
+                if self.lsdb_de(origem_ip).conhecido(origem_id, seq):
+                    self.fila_lsa.registrar_descarte("descartados_lsdb")
+                    self.lsa_repetido(origem_id, seq, origem_ip)
+                    return False
+                if protocolo.eh_fragmento(data):
+                    data = self.remontagem.adicionar(data, origem_ip)
+                    if data is None:
+                        return False # Faltam fragmentos
+                else:
+                    data = bytes(data)
+            else:
+                # JSON (Hellos e LSAs de vizinhos sem suporte ao binário): o dicionário segue para o worker
+                data = bytes(data)
+                lsa_dict = json.loads(data.decode())
+                tipo = lsa_dict.get("tipo")
+                if tipo == "hello":
+                    self.hello.receber_hello(lsa_dict)
+                    return False
+                if tipo == "ack":
+                    self.inundacao.receber_ack(lsa_dict)
+                    return False
+                if tipo == "dd":
+                    self.sincronizacao.receber_dd(lsa_dict)
+                    return False
+                if tipo == "dd_ok":
+                    self.sincronizacao.receber_dd_ok(lsa_dict)
+                    return False
+                if tipo == "lsr":
+                    self.sincronizacao.receber_lsr(lsa_dict)
+                    return False
+                origem_id, seq = lsa_dict["id"], lsa_dict["seq"]
+                if self.lsdb_de(origem_ip).conhecido(origem_id, seq):
+                    self.fila_lsa.registrar_descarte("descartados_lsdb")
+                    self.lsa_repetido(origem_id, seq, origem_ip)
+                    return False
+            chave = (self.area_do_vizinho.get(origem_ip, AREA), origem_id) # Um ABR recebe LSAs do mesmo roteador em mais de uma área
+            if not self.fila_lsa.enfileirar(chave, seq, data, origem_ip, lsa_dict):
+                log("lsa", "LSA de %s (seq %s) vindo de %s descartado na ingestão", origem_id, seq, origem_ip, nivel=DEBUG)
+                return False
+            return True
+        except ValueError as e:
+            log("erros", f"Erro ao decodificar LSA recebido de {origem_ip}: {e}")
+        except KeyError as e:
+            log("erros", f"Campo faltando no LSA recebido de {origem_ip}: {e}")
+        except Exception as e:
+            log("erros", f"Erro ao enfileirar LSA recebido de {origem_ip}: {e}")
+        return False
+
+    def refresh_lsa(self):
+        """
+        Envelhece o LSDB e origina o LSA se ainda não houve nenhum ou se o último tem
+        mais de LSA_REFRESH segundos (no máximo metade da idade máxima, para ele nunca
+        expirar nos vizinhos). Fora isso, LSAs só são originados quando algo muda
+        (adjacência, custo de enlace ou sub-redes anunciadas).
+        """
+        try:
+            for area in self.areas.values():
+                expirados = area.lsdb.envelhecer()
+                if expirados:
+                    log("lsa", f"LSA(s) de {sorted(expirados)} na área {area.id} atingiram a idade máxima ({LSA_IDADE_MAXIMA} s) e saíram do SPF")
+                    self.agendador_spf.agendar()
+            if self.lsa_originado_em is None or time.monotonic() - self.lsa_originado_em >= min(LSA_REFRESH, LSA_IDADE_MAXIMA / 2):
+                self.enviar_lsa(forcar=True)
+        except Exception as e:
+            log("erros", f"Erro no refresh do LSA: {e}")
+        areas = {id: area.estado() for id, area in self.areas.items()}
+        log("lsa", f"Fila de ingestão de LSAs: {self.fila_lsa.estado()}, áreas: {areas}, inundação: {self.inundacao.estado()}, troca de LSDB: {self.sincronizacao.estado()}, DR: {self.eleicao.estado()}, remontagem: {self.remontagem.estado()}, FIB: {self.fib.estado()}, processo do SPF: {self.processo_spf.estado() if self.processo_spf else None}, janelas sem rota: {self.janelas_sem_rota}, sub-redes: {self.subredes.estado()}")
+
+    def retirar_lsa(self):
+        """
+        Envelhecimento prematuro ao desligar: origina o próprio LSA já com a idade máxima,
+        para a rede tirá-lo do SPF sem esperar ele envelhecer. Vai uma vez para cada
+        vizinho ativo, sem esperar acks (o processo está terminando); daí em diante a
+        inundação dos vizinhos é confiável.
+        """
+        with self.lsa_send_lock:
+            self.seq += 1
+            lsa = LSA(self.ip, self.seq, {}, frozenset(), LSA_IDADE_MAXIMA)
+        lsa_dict = lsa.para_envio()
+        codificados = {}
+        for viz_id, (ip, _) in self.vizinhos_ativos.items():
+            try:
+                for datagrama in self.codificar_lsa(lsa_dict, ip, codificados):
+                    self.enviar_pacote(datagrama, ip)
+            except Exception as e:
+                log("erros", f"Erro ao enviar a retirada do LSA para {viz_id}: {e}")
+        log("lsa", f"LSA retirado (seq {lsa.seq}, idade máxima) enviado a {len(self.vizinhos_ativos)} vizinho(s)")
+
+    @staticmethod
+    def interromper(signum, frame):
+        raise KeyboardInterrupt
+
+    def retransmitir(self) -> float:
+        """Reenvia LSAs não confirmados e a troca de LSDB pendente. Retorna a espera até o próximo prazo."""
+        return min(self.inundacao.tick(), self.sincronizacao.tick())
+
+    def loop_retransmissao(self):
         while True:
+            espera = LSA_RETRANSMISSAO
             try:
-                self.enviar_lsa()
+                espera = self.retransmitir()
             except Exception as e:
-                log("erros", f"Erro no loop de envio periódico de LSA: {e}", self.id)
-            # Intervalo de envio periódico
-            time.sleep(15) # Aumentado para 15 segundos
+                log("erros", f"Erro no loop de retransmissão de LSAs: {e}")
+            time.sleep(espera)
+
+    def enviar_periodicamente(self):
+        # O primeiro LSA sai na hora (só com as sub-redes); os seguintes, quando as adjacências subirem
+        while True:
+            self.refresh_lsa()
+            time.sleep(INTERVALO_ENVIO_LSA)
 
     def iniciar(self):
-        log("init", "Iniciando threads do roteador...", self.id)
+        log("init", "Iniciando threads do roteador...")
+        if not self.vincular_socket():
+            return # Não pode continuar sem socket
+        self.fila_lsa.iniciar()
         threads = [
             threading.Thread(target=self.escutar_lsa, daemon=True, name="escutar_lsa"),
-            threading.Thread(target=self.enviar_periodicamente, daemon=True, name="enviar_lsa")
+            threading.Thread(target=self.hello.loop, daemon=True, name="hello"),
+            threading.Thread(target=self.loop_retransmissao, daemon=True, name="retransmissao"),
+            threading.Thread(target=self.enviar_periodicamente, daemon=True, name="enviar_lsa"),
+            threading.Thread(target=self.agendador_spf.loop, daemon=True, name="agendador_spf"),
+            threading.Thread(target=self.monitorar_rotas, daemon=True, name="monitor_rotas"),
         ]
         for t in threads:
             t.start()
-        log("init", "Threads iniciadas. Roteador em execução.", self.id)
+        log("init", "Threads iniciadas. Roteador em execução.")
+        signal.signal(signal.SIGTERM, self.interromper) # docker stop encerra como o Ctrl+C
         # Mantém a thread principal viva
         try:
             while True:
                 time.sleep(3600) # Dorme por uma hora, efetivamente esperando para sempre
         except KeyboardInterrupt:
-            log("init", "Recebido sinal de interrupção. Encerrando...", self.id)
+            log("init", "Recebido sinal de interrupção. Encerrando...")
+            self.retirar_lsa()
             # Aqui poderiam ser adicionadas lógicas de cleanup, se necessário
 
+class ProtocoloLSA(asyncio.DatagramProtocol):
+    """
+    Recebe os datagramas da porta de LSAs no runtime asyncio. O transporte do asyncio
+    já lê datagramas inteiros (buffer de 256 KiB), então aqui não há recvfrom_into.
+    """
+
+    def __init__(self, router: "RouterAsyncio"):
+        self.router = router
+
+    def datagram_received(self, data: bytes, addr):
+        self.router.receber_datagrama(data, addr[0])
+
+    def error_received(self, exc: Exception):
+        log("erros", f"Erro no socket de LSAs: {exc}")
+
+
+class RouterAsyncio(Router):
+    """
+    Runtime alternativo do roteador sobre um único event loop asyncio.
+
+    Datagramas chegam por um DatagramProtocol e vão para a mesma fila de ingestão
+    do modo com threads, drenada em lotes pelo próprio loop. O refresh do LSA,
+    os Hellos, as retransmissões de LSAs e o atraso do SPF são timers do loop; o
+    recálculo de rotas roda no executor.
+    """
+
+    LOTE_INGESTAO = 64 # LSAs processados antes de devolver o controle ao loop
+
+    def __init__(self):
+        super().__init__()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transporte: Optional[asyncio.DatagramTransport] = None
+        self.drenagem_agendada = False
+
+    def enviar_pacote(self, data: bytes, ip: str):
+        self.transporte.sendto(data, (ip, PORTA))
+
+    def receber_datagrama(self, data: bytes, origem_ip: str) -> bool:
+        enfileirado = super().receber_datagrama(data, origem_ip)
+        if enfileirado and not self.drenagem_agendada:
+            self.drenagem_agendada = True
+            self.loop.call_soon(self.drenar_fila)
+        return enfileirado
+
+    def executar_externo(self, funcao: Callable[[], None]):
+        # Os timers do agendador e o transporte pertencem ao event loop
+        self.loop.call_soon_threadsafe(funcao)
+
+    def drenar_fila(self):
+        self.drenagem_agendada = False
+        for _ in range(self.LOTE_INGESTAO):
+            if not self.fila_lsa.processar_proximo():
+                return
+        # Ainda há LSAs: cede o loop para timers e novos datagramas antes de continuar
+        self.drenagem_agendada = True
+        self.loop.call_soon(self.drenar_fila)
+
+    async def enviar_periodicamente_async(self):
+        while True:
+            self.refresh_lsa()
+            await asyncio.sleep(INTERVALO_ENVIO_LSA)
+
+    def hello_periodico(self):
+        espera = self.hello.intervalo
+        try:
+            espera = self.hello.tick()
+        except Exception as e:
+            log("erros", f"Erro no loop do protocolo Hello: {e}")
+        self.loop.call_later(espera, self.hello_periodico)
+
+    def retransmissao_periodica(self):
+        espera = LSA_RETRANSMISSAO
+        try:
+            espera = self.retransmitir()
+        except Exception as e:
+            log("erros", f"Erro no loop de retransmissão de LSAs: {e}")
+        self.loop.call_later(espera, self.retransmissao_periodica)
+
+    async def executar(self):
+        self.loop = asyncio.get_running_loop()
+        self.agendador_spf = AgendadorSPFAsyncio(self.loop, self.recalcular_rotas, SPF_ATRASO_INICIAL, SPF_ESPERA_MINIMA, SPF_ESPERA_MAXIMA)
+        if not self.vincular_socket():
+            return # Não pode continuar sem socket
+        self.transporte, _ = await self.loop.create_datagram_endpoint(lambda: ProtocoloLSA(self), sock=self.socket)
+        self.hello_periodico()
+        self.retransmissao_periodica()
+        tarefa = asyncio.current_task()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sinal, self.encerrar, tarefa)
+        # O monitor bloqueia no socket netlink e devolve o trabalho ao loop por executar_externo
+        threading.Thread(target=self.monitorar_rotas, daemon=True, name="monitor_rotas").start()
+        log("init", "Event loop iniciado. Roteador em execução (modo asyncio).")
+        await self.enviar_periodicamente_async()
+
+    def encerrar(self, tarefa: "asyncio.Task"):
+        # Ainda dentro do loop, com o transporte aberto para a retirada do LSA
+        log("init", "Recebido sinal de interrupção. Encerrando...")
+        self.retirar_lsa()
+        tarefa.cancel()
+
+    def iniciar(self):
+        log("init", "Iniciando roteador no modo asyncio...")
+        try:
+            asyncio.run(self.executar())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            log("init", "Roteador encerrado.")
+
+
 if __name__ == "__main__":
-    router = Router()
+    # O modo com threads continua sendo o padrão e serve de fallback
+    router = RouterAsyncio() if MODO_EXECUCAO == "asyncio" else Router()
     router.iniciar()
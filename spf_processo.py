@@ -0,0 +1,299 @@
+"""
+SPF num processo separado do roteador.
+
+O Dijkstra de um LSDB grande segura o GIL por todo o cálculo, e com ele parados
+ficam a recepção, os Hellos e as retransmissões. Aqui o SPF roda num processo
+filho que guarda, para cada área, um SPFIncremental e uma cópia do LSDB. O
+roteador só espera a resposta (sem o GIL) e continua atendendo a rede.
+
+A cada recálculo o roteador publica numa memória compartilhada um snapshot
+compacto da área, em ordem de rede:
+
+    cabeçalho    tamanho_ordem I, tamanho_alterados I, num_lsas I
+    ordem        IDs de todos os LSAs do SPF, na ordem do LSDB, separados por \\n
+    alterados    IDs alterados desde o último snapshot (inclusive os que saíram)
+    lsas         num_lsas x (tamanho I, LSA no formato binário de protocolo.py,
+                 ou em JSON se não couber nele)
+
+Só os LSAs alterados vão no snapshot; os demais o processo já tem. A ordem
+completa vai sempre porque decide o custo de enlaces assimétricos no SPF. Pelo
+pipe passam só o nome da memória compartilhada e o tamanho do snapshot, e
+voltam as rotas que mudaram, os alternativos (LFA) e as distâncias até os
+roteadores pedidos.
+
+Se o processo morrer, ou não responder dentro do prazo, ele é recriado e o
+cálculo é repetido uma vez no processo novo com o LSDB inteiro da área; as
+demais áreas mandam o LSDB inteiro no próximo recálculo (ver SPFRemoto).
+"""
+import atexit
+import json
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import protocolo
+from dycastra import ProximosSaltos, SPFIncremental
+
+CABECALHO = struct.Struct("!III")
+TAMANHO = struct.Struct("!I")
+
+
+def codificar_snapshot(ordem: List[str], alterados: Iterable[str], lsas: Dict[str, Dict]) -> bytes:
+    """Monta o snapshot de uma área: ordem dos IDs, IDs alterados e os LSAs enviados."""
+    texto_ordem = "\n".join(ordem).encode()
+    texto_alterados = "\n".join(alterados).encode()
+    partes = [CABECALHO.pack(len(texto_ordem), len(texto_alterados), len(lsas)), texto_ordem, texto_alterados]
+    for lsa in lsas.values():
+        dados = None
+        if all(isinstance(custo, int) for _, custo in lsa["vizinhos"].values()): # O binário só leva custos inteiros
+            try:
+                dados = protocolo.codificar_binario(lsa)
+            except ValueError:
+                pass
+        if dados is None:
+            dados = json.dumps(lsa).encode()
+        partes.append(TAMANHO.pack(len(dados)))
+        partes.append(dados)
+    return b"".join(partes)
+
+
+def decodificar_snapshot(dados: bytes) -> Tuple[List[str], set, Dict[str, Dict]]:
+    tamanho_ordem, tamanho_alterados, num_lsas = CABECALHO.unpack_from(dados)
+    posicao = CABECALHO.size
+    texto_ordem = dados[posicao:posicao + tamanho_ordem].decode()
+    posicao += tamanho_ordem
+    texto_alterados = dados[posicao:posicao + tamanho_alterados].decode()
+    posicao += tamanho_alterados
+    lsas = {}
+    for _ in range(num_lsas):
+        (tamanho,) = TAMANHO.unpack_from(dados, posicao)
+        posicao += TAMANHO.size
+        lsa = protocolo.decodificar(dados[posicao:posicao + tamanho])
+        lsas[lsa["id"]] = lsa
+        posicao += tamanho
+    ordem = texto_ordem.split("\n") if texto_ordem else []
+    alterados = set(texto_alterados.split("\n")) if texto_alterados else set()
+    return ordem, alterados, lsas
+
+
+def executar_worker(conexao, origem: str, limite_afetados: float, alternativos: bool, maximo_caminhos: int):
+    """
+    Laço do processo do SPF: para cada pedido (área, memória compartilhada, tamanho,
+    reiniciar, roteadores), aplica o snapshot ao LSDB da área, roda o SPF e responde
+    ("ok", resultado) ou ("erro", mensagem). Termina quando o roteador fecha o pipe.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # O Ctrl+C é tratado pelo roteador, que fecha o pipe
+    segmento: Optional[shared_memory.SharedMemory] = None
+    areas: Dict[str, Tuple[SPFIncremental, Dict[str, Dict]]] = {}
+    while True:
+        try:
+            area, nome, tamanho, reiniciar, roteadores = conexao.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if segmento is None or segmento.name != nome:
+                if segmento is not None:
+                    segmento.close()
+                segmento = shared_memory.SharedMemory(name=nome)
+            ordem, alterados, lsas = decodificar_snapshot(bytes(segmento.buf[:tamanho]))
+            if reiniciar or area not in areas:
+                areas[area] = (SPFIncremental(origem, limite_afetados, alternativos, maximo_caminhos), {})
+            spf, lsdb = areas[area]
+            lsdb.update(lsas)
+            lsdb = {id: lsdb[id] for id in ordem}
+            areas[area] = (spf, lsdb)
+            spf.calcular(lsdb, alterados)
+            caminhos = {}
+            for router_id in (lsdb if roteadores is None else roteadores):
+                caminho = spf.caminho(router_id)
+                if caminho is not None:
+                    caminhos[router_id] = caminho
+            resposta = ("ok", {
+                "modo": spf.ultimo_modo,
+                "alteradas": {subnet: spf.tabela.get(subnet) for subnet in spf.prefixos_alterados},
+                "alternativos": spf.alternativos,
+                "protecao": spf.protecao,
+                "caminhos": caminhos,
+            })
+        except Exception as e:
+            areas.pop(area, None) # O estado incremental pode ter ficado pela metade
+            resposta = ("erro", f"{type(e).__name__}: {e}")
+        try:
+            conexao.send(resposta)
+        except (EOFError, OSError):
+            break
+    if segmento is not None:
+        segmento.close()
+
+
+class ProcessoSPF:
+    """
+    Processo do SPF e a memória compartilhada por onde passam os snapshots.
+
+    O processo é criado por fork, de preferência antes de o roteador iniciar suas
+    threads (ver Router.__init__). A memória cresce quando um snapshot não cabe:
+    uma nova é criada e a antiga é removida; o processo passa a usar a nova pelo
+    nome que vai em cada pedido. `geracao` muda sempre que o processo é recriado,
+    para as áreas saberem que precisam mandar o LSDB inteiro. Um processo vivo que
+    não responde em `prazo` segundos é considerado travado e também é recriado.
+    """
+
+    CAPACIDADE_INICIAL = 64 * 1024
+    ESPERA_RESPOSTA = 1.0 # Segundos entre verificações de que o processo continua vivo
+
+    def __init__(self, origem: str, limite_afetados: float, alternativos: bool, maximo_caminhos: int, prazo: float = 30.0):
+        self.parametros = (origem, limite_afetados, alternativos, maximo_caminhos)
+        self.prazo = prazo
+        self.lock = threading.Lock()
+        self.contexto = multiprocessing.get_context("fork")
+        # Criada antes do fork, para o processo compartilhar o resource tracker do roteador
+        self.segmento = shared_memory.SharedMemory(create=True, size=self.CAPACIDADE_INICIAL)
+        self.processo = None
+        self.conexao = None
+        self.geracao = 0
+        self.contadores = {"pedidos": 0, "reinicios": 0, "sem_resposta": 0, "erros": 0, "ultimo_snapshot_bytes": 0, "maior_snapshot_bytes": 0}
+        self.iniciar_processo()
+        atexit.register(self.encerrar)
+
+    def iniciar_processo(self):
+        self.conexao, conexao_processo = self.contexto.Pipe()
+        self.processo = self.contexto.Process(target=executar_worker, args=(conexao_processo, *self.parametros),
+                                              daemon=True, name="spf")
+        self.processo.start()
+        conexao_processo.close()
+        self.geracao += 1
+
+    def reiniciar_processo(self):
+        self.contadores["reinicios"] += 1
+        self.conexao.close()
+        if self.processo.is_alive():
+            self.processo.terminate()
+        self.processo.join(1.0)
+        if self.processo.is_alive(): # Travado sem tratar o SIGTERM
+            self.processo.kill()
+            self.processo.join(1.0)
+        self.iniciar_processo()
+
+    def publicar(self, dados: bytes):
+        if len(dados) > self.segmento.size:
+            novo = shared_memory.SharedMemory(create=True, size=max(len(dados), 2 * self.segmento.size))
+            self.segmento.close()
+            self.segmento.unlink()
+            self.segmento = novo
+        self.segmento.buf[:len(dados)] = dados
+        self.contadores["ultimo_snapshot_bytes"] = len(dados)
+        self.contadores["maior_snapshot_bytes"] = max(self.contadores["maior_snapshot_bytes"], len(dados))
+
+    def calcular(self, area: str, dados: bytes, reiniciar: bool, roteadores: Optional[List[str]]) -> Dict:
+        """
+        Publica o snapshot e espera o resultado do SPF. Levanta RuntimeError se o processo
+        falhar; se ele morreu ou passou do prazo, já foi recriado (e `geracao` mudou).
+        """
+        with self.lock:
+            self.contadores["pedidos"] += 1
+            try:
+                self.publicar(dados)
+                self.conexao.send((area, self.segmento.name, len(dados), reiniciar, roteadores))
+                limite = time.monotonic() + self.prazo
+                while not self.conexao.poll(self.ESPERA_RESPOSTA):
+                    if not self.processo.is_alive():
+                        raise EOFError(f"processo terminou com código {self.processo.exitcode}")
+                    if time.monotonic() >= limite:
+                        self.contadores["sem_resposta"] += 1
+                        raise TimeoutError(f"processo sem resposta há {self.prazo}s")
+                situacao, resultado = self.conexao.recv()
+            except (EOFError, OSError) as e:
+                self.reiniciar_processo()
+                raise RuntimeError(f"Processo do SPF recriado após falha: {e}") from e
+        if situacao != "ok":
+            self.contadores["erros"] += 1
+            raise RuntimeError(f"Erro no processo do SPF: {resultado}")
+        return resultado
+
+    def encerrar(self):
+        """Fecha o pipe (o processo termina sozinho) e remove a memória compartilhada."""
+        if not self.lock.acquire(timeout=self.ESPERA_RESPOSTA): # Um cálculo em andamento ao sair não segura o encerramento
+            return
+        try:
+            if self.conexao.closed:
+                return
+            self.conexao.close()
+            self.processo.join(1.0)
+            if self.processo.is_alive():
+                self.processo.terminate()
+            self.segmento.close()
+            self.segmento.unlink()
+        finally:
+            self.lock.release()
+
+    def estado(self) -> Dict:
+        return {"pid": self.processo.pid, "vivo": self.processo.is_alive(), "memoria_bytes": self.segmento.size, **self.contadores}
+
+
+class SPFRemoto:
+    """
+    SPF de uma área calculado no ProcessoSPF, com a mesma interface do SPFIncremental
+    usada pelo roteador (calcular, caminho, tabela, protecao, alternativos,
+    prefixos_alterados, ultimo_modo, execucoes).
+
+    Recebe o LSDB do roteador ({id: LSA}); só os LSAs alterados são convertidos
+    (to_dict) e codificados no snapshot. A tabela de rotas fica aqui e recebe só
+    as rotas que mudaram em cada cálculo.
+    As distâncias até roteadores (caminho) vêm só para os que anunciam resumos de
+    outras áreas, ou para todos com todos_caminhos (roteadores de borda, que
+    resumem as próprias áreas).
+    """
+
+    def __init__(self, processo: ProcessoSPF, area: str, todos_caminhos: bool = False):
+        self.processo = processo
+        self.area = area
+        self.todos_caminhos = todos_caminhos
+        self.geracao: Optional[int] = None # Geração do processo que tem o LSDB desta área
+        self.tabela: Dict[str, ProximosSaltos] = {}
+        self.prefixos_alterados: set = set()
+        self.ultimo_modo: Optional[str] = None
+        self.execucoes = {"completo": 0, "incremental": 0, "parcial": 0}
+        self.alternativos: Dict[str, str] = {}
+        self.protecao: Dict[str, List[str]] = {}
+        self.caminhos: Dict[str, Tuple[float, ProximosSaltos]] = {}
+
+    def calcular(self, lsdb: Dict, alterados) -> Dict[str, ProximosSaltos]:
+        roteadores = None if self.todos_caminhos else [id for id, lsa in lsdb.items() if lsa.resumos]
+        for tentativa in range(2):
+            geracao = self.processo.geracao
+            reiniciar = self.geracao != geracao
+            enviados = {id: lsdb[id].to_dict() for id in (lsdb if reiniciar else alterados) if id in lsdb}
+            dados = codificar_snapshot(list(lsdb), alterados, enviados)
+            try:
+                resultado = self.processo.calcular(self.area, dados, reiniciar, roteadores)
+                break
+            except RuntimeError:
+                self.geracao = None # O processo perdeu (ou pode ter perdido) o LSDB desta área
+                # Processo recriado (morreu ou travou): repete uma vez no novo, com o LSDB inteiro
+                if tentativa or self.processo.geracao == geracao:
+                    raise
+        self.geracao = geracao
+
+        # Com o processo recriado, as rotas alteradas são a tabela inteira
+        tabela = {} if reiniciar else self.tabela
+        for subnet, proximos_saltos in resultado["alteradas"].items():
+            if proximos_saltos:
+                tabela[subnet] = proximos_saltos
+            else:
+                tabela.pop(subnet, None)
+        self.tabela = tabela
+        self.prefixos_alterados = set(resultado["alteradas"])
+        self.ultimo_modo = resultado["modo"]
+        self.execucoes[self.ultimo_modo] += 1
+        # Troca as tabelas de uma vez: o roteador as lê de outra thread quando uma adjacência cai
+        self.alternativos, self.protecao = resultado["alternativos"], resultado["protecao"]
+        self.caminhos = resultado["caminhos"]
+        return self.tabela
+
+    def caminho(self, router_id: str) -> Optional[Tuple[float, ProximosSaltos]]:
+        """Distância e próximos saltos até um roteador no último cálculo (None se inalcançável ou não pedido)."""
+        return self.caminhos.get(router_id)
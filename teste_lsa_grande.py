@@ -0,0 +1,230 @@
+"""
+Teste de inundação de um LSA grande pelo código do roteador.
+
+Sobe, no próprio processo, instâncias de router.Router ligadas por uma rede em
+memória no lugar dos sockets UDP (o netifaces também é substituído: as interfaces
+de cada roteador são só o seu IP). As adjacências sobem pelo protocolo Hello, que
+negocia o formato dos LSAs de cada enlace, e os datagramas são entregues por
+receber_datagrama a partir do buffer de recepção do roteador, como no recvfrom_into.
+A fila de ingestão é drenada com processar_proximo, como no modo asyncio.
+
+1. Um vizinho fictício origina um LSA com 500 vizinhos (maior que um datagrama),
+   que é fragmentado, remontado, instalado por propagar_lsa e repassado salto a
+   salto por codificar_lsa, em binário ou JSON conforme o enlace. O último
+   roteador da cadeia confere se o LSA chegou intacto.
+2. O mesmo LSA é reenviado: todos os fragmentos repetidos precisam ser descartados
+   só pelo cabeçalho, sem nova remontagem.
+3. Dois vizinhos, um em binário e outro em JSON, repassam ao mesmo roteador uma seq
+   nova do LSA ao mesmo tempo, com os fragmentos intercalados: as duas remontagens
+   não podem se misturar.
+
+Uso:
+    python teste_lsa_grande.py [--roteadores 5] [--vizinhos 500] [--tamanho-datagrama 1400]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import types
+from collections import OrderedDict, deque
+
+# Configuração lida pelo router.py na importação; o IP e os vizinhos de cada
+# instância são trocados em criar_roteador
+os.environ.update(my_ip="10.254.0.1", my_name="teste", vizinhos="", fib_backend="memoria", spf_processo="0",
+                  metrica="configurada", dr="0", log_stdout="0")
+
+# Sem interfaces reais: cada roteador "tem" o seu IP numa /32
+netifaces = types.ModuleType("netifaces")
+netifaces.AF_INET = 2
+netifaces.enderecos = OrderedDict() # Interface -> IP, preenchido por criar_roteador
+netifaces.interfaces = lambda: list(netifaces.enderecos)
+netifaces.ifaddresses = lambda iface: {netifaces.AF_INET: [{"addr": netifaces.enderecos[iface], "netmask": "255.255.255.255"}]}
+sys.modules["netifaces"] = netifaces
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "router"))
+import protocolo
+import router
+
+ORIGEM = "10.255.0.1" # Vizinho fictício que origina o LSA grande
+BINARIO_JSON = (protocolo.FORMATO_BINARIO, protocolo.FORMATO_JSON)
+SO_JSON = (protocolo.FORMATO_JSON,)
+
+
+def gerar_lsa(num_vizinhos: int, seq: int = 1) -> dict:
+    return {
+        "id": ORIGEM,
+        "seq": seq,
+        "vizinhos": {f"router{i}": [f"10.{i // 250}.{i % 250}.2", i % 10 + 1] for i in range(num_vizinhos)},
+        "subnets": [f"172.20.{i}.0/24" for i in range(20)],
+    }
+
+
+def normalizar(lsa: dict) -> tuple:
+    """Conteúdo comparável de um LSA: o binário não leva os nomes dos vizinhos."""
+    vizinhos = sorted((ip, custo) for ip, custo in lsa["vizinhos"].values())
+    return lsa["id"], lsa["seq"], vizinhos, sorted(lsa["subnets"])
+
+
+class SocketMemoria:
+    """Lado de envio do socket UDP de um roteador na RedeMemoria."""
+
+    def __init__(self, rede: "RedeMemoria", ip: str):
+        self.rede = rede
+        self.ip = ip
+
+    def sendto(self, data: bytes, endereco):
+        self.rede.enviar(self.ip, endereco[0], data)
+
+
+class RedeMemoria:
+    """
+    Substitui os sockets UDP entre os roteadores do teste. Os datagramas de cada
+    remetente saem na ordem de envio, mas remetentes diferentes são intercalados
+    (um datagrama de cada por vez), como em enlaces transmitindo ao mesmo tempo.
+    """
+
+    def __init__(self, tamanho_datagrama: int):
+        self.tamanho_datagrama = tamanho_datagrama
+        self.roteadores = OrderedDict() # IP -> router.Router
+        self.filas = OrderedDict() # IP do remetente -> deque de (destino, datagrama)
+
+    def enviar(self, origem: str, destino: str, data: bytes):
+        if protocolo.eh_binario(data): # LSAs e fragmentos; Hellos e acks são JSON pequenos
+            assert len(data) <= self.tamanho_datagrama, f"datagrama de {len(data)} bytes"
+        self.filas.setdefault(origem, deque()).append((destino, bytes(data)))
+
+    def entregar(self):
+        """Entrega os datagramas e processa as filas de ingestão até a rede ficar parada."""
+        while True:
+            while any(self.filas.values()):
+                for origem, fila in list(self.filas.items()):
+                    if fila:
+                        destino, data = fila.popleft()
+                        self.receber(origem, destino, data)
+            processados = [r for r in self.roteadores.values() if r.fila_lsa.processar_proximo()]
+            if not processados and not any(self.filas.values()):
+                return
+
+    def receber(self, origem: str, destino: str, data: bytes):
+        roteador = self.roteadores.get(destino)
+        if roteador is None:
+            return # Acks para o vizinho fictício
+        visao = memoryview(roteador.buffer_recepcao)
+        visao[:len(data)] = data
+        roteador.receber_datagrama(visao[:len(data)], origem)
+
+
+def criar_roteador(rede: RedeMemoria, indice: int, vizinhos: dict, formatos: tuple) -> "router.Router":
+    ip = f"10.254.0.{indice + 1}"
+    router.ROTEADOR_IP, router.ROTEADOR_NAME = ip, f"r{indice}"
+    router.VIZINHOS = {nome: (f"10.254.0.{i + 1}", 1) for nome, i in vizinhos.items()}
+    router.AREAS_VIZINHOS = {nome: router.AREA for nome in vizinhos}
+    netifaces.enderecos[f"eth{indice}"] = ip
+    roteador = router.Router()
+    roteador.hello.formatos = formatos
+    roteador.socket = SocketMemoria(rede, ip)
+    rede.roteadores[ip] = roteador
+    return roteador
+
+
+def subir_adjacencias(rede: RedeMemoria):
+    """Duas rodadas de Hello: a primeira leva as adjacências a INIT, a segunda a UP."""
+    for _ in range(2):
+        for roteador in rede.roteadores.values():
+            roteador.hello.proximo_hello = 0.0
+            roteador.hello.tick()
+        rede.entregar()
+
+
+def enviar_da_origem(rede: RedeMemoria, lsa: dict, formato: str, destinos) -> int:
+    datagramas = protocolo.fragmentar(protocolo.codificar(lsa, formato), lsa["id"], lsa["seq"], rede.tamanho_datagrama)
+    for destino in destinos:
+        for datagrama in datagramas:
+            rede.enviar(ORIGEM, destino.ip, datagrama)
+    return len(datagramas)
+
+
+def lsa_instalado(roteador: "router.Router") -> dict:
+    lsa = roteador.areas[router.AREA].lsdb.lsas.get(ORIGEM)
+    if lsa is None:
+        raise SystemExit(f"FALHA: o LSA não chegou a {roteador.id}")
+    return lsa.para_envio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roteadores", type=int, default=5)
+    parser.add_argument("--vizinhos", type=int, default=500)
+    parser.add_argument("--tamanho-datagrama", type=int, default=1400)
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix="teste_lsa_grande_")
+    router.LOG_BASE_DIR = router.REGISTRO.diretorio = diretorio
+    router.LSA_TAMANHO_DATAGRAMA = args.tamanho_datagrama
+    erros = []
+    log_original = router.log
+    def log(categoria, msg, *a, **kw):
+        if categoria == "erros":
+            erros.append(msg)
+        log_original(categoria, msg, *a, **kw)
+    router.log = log
+
+    # Cadeia r0 - r1 - ... em que todo terceiro roteador só entende JSON: há enlaces
+    # binário-binário (bytes repassados), binário-JSON e JSON-binário (LSA recodificado)
+    rede = RedeMemoria(args.tamanho_datagrama)
+    cadeia = []
+    for i in range(args.roteadores):
+        vizinhos = {f"r{j}": j for j in (i - 1, i + 1) if 0 <= j < args.roteadores}
+        cadeia.append(criar_roteador(rede, i, vizinhos, SO_JSON if i % 3 == 2 else BINARIO_JSON))
+    subir_adjacencias(rede)
+    enlaces = [a.hello.formato_lsa(b.ip) for a, b in zip(cadeia, cadeia[1:])]
+
+    lsa = gerar_lsa(args.vizinhos)
+    tamanhos = {f: len(protocolo.codificar(lsa, f)) for f in BINARIO_JSON}
+    print(f"LSA com {args.vizinhos} vizinhos: {tamanhos[protocolo.FORMATO_BINARIO]} bytes em binário, "
+          f"{tamanhos[protocolo.FORMATO_JSON]} bytes em JSON; enlaces da cadeia: {' '.join(enlaces)}")
+
+    # 1. Inundação pela cadeia
+    enviar_da_origem(rede, lsa, protocolo.FORMATO_BINARIO, cadeia[:1])
+    rede.entregar()
+    if normalizar(lsa_instalado(cadeia[-1])) != normalizar(json.loads(json.dumps(lsa))):
+        raise SystemExit("FALHA: LSA chegou diferente do originado")
+
+    # 2. Reenvio do mesmo LSA: tudo deve morrer no cabeçalho do primeiro salto
+    primeiro = cadeia[0]
+    fragmentos_antes = primeiro.remontagem.estado()["fragmentos"]
+    descartes_antes = primeiro.fila_lsa.estado()["descartados_lsdb"]
+    esperados = enviar_da_origem(rede, lsa, protocolo.FORMATO_BINARIO, cadeia[:1])
+    rede.entregar()
+    descartados = primeiro.fila_lsa.estado()["descartados_lsdb"] - descartes_antes
+    if descartados != esperados or primeiro.remontagem.estado()["fragmentos"] != fragmentos_antes:
+        raise SystemExit(f"FALHA: reenvio não foi descartado pelo cabeçalho ({descartados}/{esperados} fragmentos)")
+
+    # 3. A seq 2 chega a a (binário) e b (só JSON), que a repassam juntos a x
+    rede_mista = RedeMemoria(args.tamanho_datagrama)
+    base = args.roteadores
+    a = criar_roteador(rede_mista, base, {"x": base + 2}, BINARIO_JSON)
+    b = criar_roteador(rede_mista, base + 1, {"x": base + 2}, SO_JSON)
+    x = criar_roteador(rede_mista, base + 2, {"a": base, "b": base + 1}, BINARIO_JSON)
+    subir_adjacencias(rede_mista)
+    nova = gerar_lsa(args.vizinhos, seq=2)
+    enviar_da_origem(rede_mista, nova, protocolo.FORMATO_BINARIO, [a])
+    enviar_da_origem(rede_mista, nova, protocolo.FORMATO_JSON, [b])
+    rede_mista.entregar()
+    remontagem = x.remontagem.estado()
+    if normalizar(lsa_instalado(x)) != normalizar(json.loads(json.dumps(nova))):
+        raise SystemExit("FALHA: LSA vindo de dois vizinhos em formatos diferentes chegou diferente do originado")
+    if remontagem["remontados"] != 2 or remontagem["descartados_invalidos"] or remontagem["pendentes"]:
+        raise SystemExit(f"FALHA: fragmentos de a e b se misturaram na remontagem: {remontagem}")
+
+    if erros:
+        raise SystemExit(f"FALHA: {len(erros)} erro(s) registrados pelos roteadores, o primeiro: {erros[0]}")
+    for r in cadeia + [x]:
+        print(f"  {r.id}: remontagem {r.remontagem.estado()}, fila {r.fila_lsa.estado()}")
+    print(f"OK: LSA de {args.vizinhos} vizinhos atravessou {args.roteadores} roteadores intacto e foi remontado "
+          f"sem mistura vindo de vizinhos em binário e JSON")
+
+
+if __name__ == "__main__":
+    main()